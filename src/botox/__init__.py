@@ -1,23 +1,55 @@
 import sys
 import struct
 
-import botox.architecture as architecture
+__version__ = "0.1b"
+
 from botox.elf import ELF
-from botox.exceptions import BotoxException
+from botox.layout import Layout, free_space
+from botox.exceptions import BotoxException, ElfFormatException, NotElfException, UnsupportedElfException, \
+                             TruncatedElfException, MalformedElfException
 
 class Botox(object):
 
-    def __init__(self, elfile, verbose=False):
+    # Payload placements, see patch_many()
+    ENTRY = "entry"
+    DETACHED = "detached"
+
+    # Each payload is padded out to a multiple of this many bytes
+    PAYLOAD_ALIGNMENT = 16
+    # Payloads written over free space are only aligned this much (enough for the
+    # instructions and data words of every supported architecture), to fit in more places
+    FREE_SPACE_ALIGNMENT = 4
+
+    # Layout strategies, see _layout()
+    APPEND = "append"
+    PAGES = "pages"
+    LAYOUT_STRATEGIES = [APPEND, PAGES]
+
+    # How _layout() places the payloads
+    LAYOUT_STRATEGY = PAGES
+
+    # Page size assumed when predicting the pages touched by payloads
+    PAGE_SIZE = 0x1000
+
+    # Default maximum number of bytes patch_stream() buffers
+    STREAM_LIMIT = 0x4000000
+
+    def __init__(self, elfile, verbose=False, cache=None):
         '''
         Class constructor.
 
         @elfile  - Path to the target ELF file to patch.
         @verbose - Set to True to enable verbose debug print statements.
+        @cache   - An instance of cache.Cache; if given, patch() re-uses previously patched
+                   copies of the same file instead of patching it again.
 
         Returns None.
         '''
         self.elfile = elfile
         self.verbose = verbose
+        self.cache = cache
+        # The layout.Layout of the last patch, e.g. for its predicted page touches
+        self.layout = None
 
     def _resolve_architecture(self, machine_type):
         '''
@@ -29,6 +61,9 @@ class Botox(object):
         Returns a subclass of architecture.Architecture on success.
         Returns None on failure.
         '''
+        # Only loaded once a payload is actually needed; see architecture._keystone()
+        import botox.architecture as architecture
+
         # Loop through all the attributes in the architecture.py module
         # and find the Architecture subclass that matches the target
         # ELF's machine type.
@@ -58,117 +93,478 @@ class Botox(object):
         if True == self.verbose:
             sys.stderr.write(msg + "\n")
 
-    def patch(self, payload=None):
+    def patch(self, payload=None, **options):
         '''
         Injects the supplied payload into the target ELF file.
         The entry point will be modified to point to the injected code.
 
         @payload - The payload to inject into the ELF file.
                    If no payload is provided, the default pause payload will be used.
+        @options - Options for the default pause payload (see architecture.Architecture),
+                   e.g. trigger=("env", "BOTOX_STOP=1") to only pause processes that
+                   have BOTOX_STOP=1 in their environment.
 
         Returns the new entry point address on success.
         Returns None on failure, or (more likely) raises an exception.
         '''
-        alignment_size = None
-        load_segment_size = None
-        load_segment_offset = None
-        load_segment_virtual_base_address = None
+        if self.cache is None or callable(payload):
+            return self.patch_many([(payload, self.ENTRY)], **options)[0]
+
+        key = self.cache.key(self.elfile, self.LAYOUT_STRATEGY, payload, **options)
+        if self.cache.fetch(key, self.elfile):
+            self._debug_print("Using cached patch %s" % key)
+            with ELF(self.elfile, read_only=True) as elf:
+                return elf.header.e_entry
 
+        entry_point = self.patch_many([(payload, self.ENTRY)], **options)[0]
+        self.cache.insert(key, self.elfile)
+        return entry_point
+
+    def patch_many(self, payloads, **options):
+        '''
+        Injects several payloads into the target ELF file with a single relocation
+        of the ELF headers and a single rewrite of the file.
+
+        @payloads - A list of (payload, placement) tuples. Each payload may be:
+
+                        o None, to use the default pause payload
+                        o A callable, invoked as payload(jump_address, address), which
+                          returns the payload bytes for the given load address; when
+                          the payload is done it should jump to jump_address. For
+                          position independent executables, both are link time
+                          addresses, and the payload must only jump relative to them
+                        o A string of raw bytes, used verbatim; such payloads are
+                          responsible for their own control flow
+
+                    Each placement is one of:
+
+                        o Botox.ENTRY, to chain the payload into the program's startup
+                          path; ENTRY payloads run in the order given, the first one
+                          becomes the new entry point and the last one jumps to the
+                          original entry point
+                        o Botox.DETACHED, to only place the payload in the file (e.g.,
+                          to be hooked up to some other code by the caller); callable
+                          DETACHED payloads are passed the original entry point as their
+                          jump address
+
+        @options  - Options for the default pause payload, see patch().
+
+        Returns a list of the virtual address of each payload, in the order given.
+        Raises BotoxException on failure.
+        '''
         # Open the target ELF file for writing
         with ELF(self.elfile, read_only=False) as elf:
-            # Relocatable files, shared objects, etc should be ignored.
-            # These can be supported in the future, but relative addressing
-            # support needs to be added to the payload code in architectures.py.
-            if ELF.ET_EXEC != elf.header.e_type:
-                raise BotoxException("Sorry, I only support ELF executable files!")
+            return self._patch(elf, payloads, options)
+
+        return None
+
+    def diff(self, payload=None, **options):
+        '''
+        Works out the edits that patch() would make to the target ELF file, without
+        modifying it.
+
+        @payload - The payload to inject, see patch().
+        @options - Options for the default pause payload, see patch().
+
+        Returns an instance of delta.Delta, which can be applied to the file (or any
+        identical copy of it) to patch it.
+        '''
+        import botox.delta
+
+        with botox.delta.Recorder(self.elfile) as elf:
+            self._patch(elf, [(payload, self.ENTRY)], options)
+            return elf.delta()
+
+    def _patch(self, elf, payloads, options):
+        '''
+        Injects payloads into an ELF file, see patch_many().
+
+        @elf      - An instance of the ELF class, opened for writing.
+        @payloads - A list of (payload, placement) tuples.
+        @options  - Options for the default pause payload.
+
+        Returns a list of the virtual address of each payload, in the order given.
+        '''
+        # Nothing is written until the whole file has been checked
+        elf.validate()
+
+        for (payload, placement) in payloads:
+            if placement not in [self.ENTRY, self.DETACHED]:
+                raise BotoxException("Unknown payload placement: %s" % str(placement))
+
+        self._check_type(elf)
+
+        layout = self._layout(elf, payloads, options)
+        self._check_patched(elf, layout)
+        self.layout = layout
+
+        # Update all the header information to acommodate the payloads,
+        # and insert the payloads into the ELF file.
+        layout.apply(elf, self._debug_print)
+
+        return layout.addresses
+
+    def patch_stream(self, source, destination, limit=None, payload=None, **options):
+        '''
+        Patches an ELF file read from a non-seekable stream (e.g., a pipe), writing the
+        patched file to another, in a single pass. The target ELF file passed to the
+        constructor is not used.
+
+        Only the start of the file is buffered: as far as the program headers and the
+        original entry point, and the section headers too if they come before the payload
+        (they are normally at the very end, and are then updated as they are copied).
+        Memory use is bounded by limit, plus the payload and a copy buffer.
+
+        @source      - File object to read the ELF file from.
+        @destination - File object to write the patched ELF file to.
+        @limit       - Maximum number of bytes to buffer (default: STREAM_LIMIT).
+        @payload     - The payload to inject, see patch().
+        @options     - Options for the default pause payload, see patch().
+
+        Returns the new entry point address.
+        Raises BotoxException on failure, including when the layout can't be worked out
+        without buffering more than limit bytes; by then, nothing has been written.
+        '''
+        import botox.stream
+
+        if limit is None:
+            limit = self.STREAM_LIMIT
+
+        elf = botox.stream.StreamELF(source, limit)
+        elf.validate()
+        self._check_type(elf)
+
+        # Finding free space takes the section headers, which normally come at the end of the file
+        layout = self._layout(elf, [(payload, self.ENTRY)], options, self.APPEND)
+        self._check_patched(elf, layout)
+        self.layout = layout
+
+        if layout.offset <= elf.header.e_phoff:
+            raise BotoxException("The program headers come after the payload; can't patch this file from a stream!")
+
+        # Section headers that have not been buffered by now are updated on their way through
+        e_shoff = elf.header.e_shoff
+        table_size = elf._e_shnum * elf.header.e_shentsize
+        late = e_shoff >= layout.offset and e_shoff + table_size > len(elf.storage.data)
+
+        if not late and len(elf.read(e_shoff, table_size)) != table_size:
+            raise TruncatedElfException("Section header table (0x%X) is truncated!" % e_shoff)
+
+        layout.update_program_headers(elf, self._debug_print)
+        if not late:
+            layout.update_section_headers(elf, self._debug_print)
+        layout.update_header(elf, self._debug_print)
+
+        def copy(start, end):
+            for chunk in elf.chunks(start, end):
+                destination.write(chunk)
+                start += len(chunk)
+            if end is not None and start != end:
+                raise BotoxException("Unexpected end of stream!")
+
+        self._debug_print("Inserting payload of size 0x%X at file offset 0x%X" % (layout.size, layout.offset))
+        copy(0, layout.offset)
+        destination.write(layout.data)
+        position = layout.offset
+
+        if late and table_size:
+            copy(position, e_shoff)
+            table = b"".join(elf.chunks(e_shoff, e_shoff + table_size))
+            if len(table) != table_size:
+                raise BotoxException("Unexpected end of stream!")
+
+            # The table is placed where the updated ELF header says it is (i.e., where it will be in the output)
+            elf.storage.window_offset = elf.header.e_shoff
+            elf.storage.window = bytearray(table)
+            layout.update_section_headers(elf, self._debug_print)
+            destination.write(bytes(elf.storage.window))
+            position = e_shoff + table_size
+
+        copy(position, None)
+        return layout.entry
+
+    def patch_bytes(self, data, payload=None, **options):
+        '''
+        Patches an ELF file held in memory, without touching the file system. The target
+        ELF file passed to the constructor is not used.
+
+        The patched file is built in a single, exactly sized, buffer: the original data is
+        copied into it once, and the payload is inserted in place.
+
+        @data    - The ELF file; any object supporting the buffer protocol (bytes, bytearray, mmap, ...).
+        @payload - The payload to inject, see patch().
+        @options - Options for the default pause payload, see patch().
+
+        Returns the patched ELF file, as a bytearray.
+        Raises BotoxException on failure.
+        '''
+        view = memoryview(data)
+
+        with ELF(view, read_only=True) as elf:
+            elf.validate()
+            self._check_type(elf)
+
+            layout = self._layout(elf, [(payload, self.ENTRY)], options)
+            self._check_patched(elf, layout)
+            self.layout = layout
+
+        output = bytearray(len(view) + layout.size)
+        output[0:len(view)] = view
+
+        with ELF(output, read_only=False, size=len(view)) as elf:
+            layout.apply(elf, self._debug_print)
+
+        return output
+
+    def _check_type(self, elf):
+        '''
+        Raises BotoxException if the target ELF file is not an executable: either a fixed
+        address (ET_EXEC) executable, or a position independent executable (an ET_DYN
+        file that is not a shared library).
+        '''
+        e_type = elf.header.e_type
+
+        # Relocatable files, shared objects, etc should be ignored. A shared object's
+        # entry point (if it has one at all) is not run when it is loaded as a library.
+        if e_type == ELF.ET_DYN:
+            dynamic = dict(elf.dynamic())
+            interpreter = any(phdr.p_type == ELF.PT_INTERP for phdr in elf.program_headers)
+
+            # Recent linkers mark PIEs with DF_1_PIE; older ones can only be told apart from
+            # shared libraries by having a program interpreter and no soname.
+            if not (dynamic.get(ELF.DT_FLAGS_1, 0) & ELF.DF_1_PIE or
+                    (interpreter and ELF.DT_SONAME not in dynamic)):
+                raise BotoxException("Sorry, I don't support shared libraries, only executables!")
+        elif e_type != ELF.ET_EXEC:
+            raise BotoxException("Sorry, I only support ELF executable files!")
+
+        if elf.header.e_entry == 0:
+            raise BotoxException("The executable has no entry point!")
+
+    def _check_patched(self, elf, layout):
+        '''
+        Raises BotoxException if the target ELF file has already been patched with this layout's entry payload.
+        '''
+        # Don't want to insert multiple SIGSTOPs, do a sanity check before modifying anything.
+        # Check the first few bytes of the current entry point against the first few bytes of the payload.
+        # Can't check against the entire payload, since the end of the payload will be jumping to the
+        # entry point, which will change each time botox modifies an ELF file; 16 bytes should be sufficient.
+        if layout.entry is not None:
+            segment = elf.program_headers[layout.segment]
+            entry_offset = elf.header.e_entry - (segment.p_vaddr - segment.p_offset)
+            start = layout.entry - layout.vaddr
+            entry_payload = bytes(layout.data[start:start+16])
+            # (an entry point outside the segment can't be a payload botox put there)
+            in_segment = segment.p_offset <= entry_offset < segment.p_offset + segment.p_filesz
+            if in_segment and elf.read(entry_offset, 16) == entry_payload:
+                raise BotoxException("I've already patched this binary, and I shan't do it again!")
+
+    def _layout(self, elf, payloads, options={}, strategy=None):
+        '''
+        Works out where each payload will be placed, and generates the payload code.
+
+        With the APPEND strategy, the payloads are inserted into the file right after the
+        executable load segment, which is grown to hold them. With the PAGES strategy,
+        free space in and right after the segment (see layout.free_space()) is considered
+        too, and the placement that adds the fewest pages to those each exec touches
+        anyway (see _pages()) is picked; free space is preferred to growing the file
+        when it is no worse, and then the placement closest to the entry point.
+
+        @elf      - An instance of the ELF class.
+        @payloads - A list of (payload, placement) tuples; see patch_many.
+        @options  - Options for the default pause payload.
+        @strategy - The layout strategy (default: LAYOUT_STRATEGY).
+
+        Returns an instance of layout.Layout.
+        '''
+        strategy = strategy or self.LAYOUT_STRATEGY
+        if strategy not in self.LAYOUT_STRATEGIES:
+            raise BotoxException("Unknown layout strategy: %s" % str(strategy))
+
+        segment = None
+
+        # Loop through all the program headers looking for the first executable load segment
+        for phdr in elf.program_headers:
+            if ELF.PT_LOAD == phdr.p_type and True == phdr.flags.execute:
+                self._debug_print("Modifying program header #%d" % phdr.index)
+                segment = phdr
+                break
+
+        # Sanity checks
+        if segment is None:
+            raise BotoxException("Failed to locate a loadable, executable segment! What is this, an ELF file for ants?!")
+        if segment.p_align < 1:
+            raise BotoxException("The executable segment has no alignment; I don't know how much space to make for the payload!")
+
+        # By default, the payload is just slapped on the end of the executable
+        # load segment as defined in the program headers.
+        payload_offset = segment.p_offset + segment.p_filesz
+        layout = Layout(segment.index,
+                        payload_offset,
+                        segment.p_vaddr - segment.p_offset + payload_offset,
+                        segment.p_align)
+        code = self._generate(elf, payloads, options, layout, self.PAYLOAD_ALIGNMENT)
+        layout.pages = self._pages(elf, segment, layout)
+
+        candidates = [layout]
+        if strategy == self.PAGES:
+            # The size of the payloads, were they written over free space
+            # (the last one needs no padding after it)
+            size = sum([len(data) + (-len(data) % self.FREE_SPACE_ALIGNMENT) for data in code])
+            if code:
+                size -= -len(code[-1]) % self.FREE_SPACE_ALIGNMENT
+
+            for (offset, vaddr, capacity) in free_space(elf, segment):
+                if size > capacity - (-vaddr % self.FREE_SPACE_ALIGNMENT):
+                    continue
+                candidate = Layout(segment.index, offset, vaddr, 1, capacity)
+                candidate.used = (-vaddr % self.FREE_SPACE_ALIGNMENT) + size
+                candidate.pages = self._pages(elf, segment, candidate)
+                candidates.append(candidate)
+
+            # Fewest pages first, then free space before growing the file, then closest to the entry point
+            candidates.sort(key=lambda c: (c.pages, c.capacity is None, abs(c.vaddr - elf.header.e_entry)))
+
+        for candidate in candidates:
+            self._debug_print("Candidate payload placement at file offset 0x%X (virtual address: 0x%X): %s, %d extra page(s) touched per exec" %
+                              (candidate.offset,
+                               candidate.vaddr,
+                               "appended" if candidate.capacity is None else "0x%X bytes of free space" % candidate.capacity,
+                               candidate.pages))
+
+        error = None
+        for candidate in candidates:
+            if candidate is not layout:
+                # The size may differ a little at a different address (e.g., shorter jumps)
+                self._generate(elf, payloads, options, candidate, self.FREE_SPACE_ALIGNMENT)
+                candidate.pages = self._pages(elf, segment, candidate)
+                if candidate.used > candidate.capacity:
+                    continue
+
+            try:
+                self._check_space(elf, candidate)
+            except BotoxException as e:
+                error = error or e
+                continue
+
+            self._debug_print("Payload will be placed at file offset 0x%X (virtual address: 0x%X)" % (candidate.offset, candidate.vaddr))
+            return candidate
+
+        raise error
+
+    def _generate(self, elf, payloads, options, layout, alignment):
+        '''
+        Generates the payload code for a layout, and places it.
+
+        @elf       - An instance of the ELF class.
+        @payloads  - A list of (payload, placement) tuples; see patch_many.
+        @options   - Options for the default pause payload.
+        @layout    - An instance of layout.Layout.
+        @alignment - Each payload is aligned to this many bytes.
+
+        Returns the list of payload code, in the order it was placed.
+        '''
+        # ENTRY payloads are chained together, each one jumping to the next, and the
+        # last one to the original entry point. They are laid out in reverse order of
+        # execution, so that every jump target is known by the time the code that jumps
+        # to it is generated, regardless of how large each payload turns out to be.
+        order = [n for n in range(0, len(payloads)) if payloads[n][1] == self.ENTRY]
+        order.reverse()
+        order += [n for n in range(0, len(payloads)) if payloads[n][1] != self.ENTRY]
+
+        code = {}
+        address = layout.vaddr + (-layout.vaddr % alignment)
+        start = address
+        jump_address = elf.header.e_entry
+        layout.entry = None
+
+        for n in order:
+            (payload, placement) = payloads[n]
 
-            # If no payload was specified, use the built-in pause payload
             if payload is None:
-                arch = self._resolve_architecture(elf.header.e_machine)
-                if arch is None:
-                    raise BotoxException("Sorry, this architecture [0x%X 0x%X] is not supported!" % (elf.header.e_machine, elf.header.e_ident.ei_class))
-                payload = arch(elf.header.e_ident.ei_encoding).payload(elf.header.e_entry)
-
-            # Loop through all the program headers looking for the first executable load segment
-            for phdr in elf.program_headers:
-                if ELF.PT_LOAD == phdr.p_type and True == phdr.flags.execute:
-                    self._debug_print("Modifying program header #%d" % phdr.index)
-
-                    alignment_size = phdr.p_align
-
-                    load_segment_size = phdr.p_filesz
-                    load_segment_offset = phdr.p_offset
-                    load_segment_virtual_base_address = phdr.p_vaddr - phdr.p_offset
-
-                    # Don't want to insert multiple SIGSTOPs, do a sanity check before modifying anything.
-                    # Check the first few bytes of the current entry point against the first few bytes of the payload.
-                    # Can't check against the entire payload, since the end of the payload will be jumping to the
-                    # entry point, which will change each time botox modifies an ELF file; 16 bytes should be sufficient.
-                    if elf.read((elf.header.e_entry - load_segment_virtual_base_address), 16) == payload[0:16]:
-                        raise BotoxException("I've already patched this binary, and I shan't do it again!")
-
-                    # Increase this segment's file and memory size so we can shove our payload in it
-                    phdr.p_memsz += alignment_size
-                    phdr.p_filesz += alignment_size
-
-                    break
-
-            # Sanity checks
-            if None in [alignment_size, load_segment_size, load_segment_offset, load_segment_virtual_base_address]:
-                raise BotoxException("Failed to locate a loadable, executable segment! What is this, an ELF file for ants?!")
-            if len(payload) > alignment_size:
-                raise BotoxException("Sorry, my developer was too lazy to tell me how to handle payloads larger than the segment alignment size (%d)!" % alignment_size)
-
-            # Pad our payload out to the alignment size of the load segment
-            payload += "\x00" * (alignment_size - len(payload))
-            payload_size = len(payload)
-
-            # By default, the payload is just slapped on the end of the executable
-            # load segment as defined in the program headers.
-            payload_offset = load_segment_offset + load_segment_size
-            self._debug_print("Payload will be placed at file offset 0x%X (virtual address: 0x%X)" % (payload_offset, load_segment_virtual_base_address + payload_offset))
-
-            # Each segment defined in the program headers that starts *after*
-            # the offset where our payload will be inserted must have its
-            # starting offset increased by the size of our payload.
-            for phdr in elf.program_headers:
-                if payload_offset <= phdr.p_offset:
-                    self._debug_print("Increasing the size of program header #%d by 0x%X" % (phdr.index, payload_size))
-                    phdr.p_offset += payload_size
-
-            # Each section defined in the section headers that starts *after*
-            # the offset where our payload will be inserted must have its
-            # starting offset increased by the size of our payload.
-            for shdr in elf.section_headers:
-                if payload_offset <= shdr.sh_offset:
-                    self._debug_print("Increasing the size of section header %s by 0x%X" % (shdr.name, payload_size))
-                    shdr.sh_offset += payload_size
-
-                # The section in which the actual payload should reside must have its size increased
-                # to acommodate the new payload, and must also be marked as executable.
-                if payload_offset > shdr.sh_offset and payload_offset <= (shdr.sh_offset + shdr.sh_size):
-                    self._debug_print("Payload will reside in section %s, increasing its size by 0x%X" % (shdr.name, payload_size))
-                    shdr.flags.execute = True
-                    shdr.flags.allocate = True
-                    shdr.sh_size += payload_size
-
-            # If the section headers come after the new payload insertion location
-            # (which they will), update the offset of the section headers by the
-            # size of the payload.
-            if payload_offset <= elf.header.e_shoff:
-                self._debug_print("Increasing section header offset by 0x%X" % payload_size)
-                elf.header.e_shoff += payload_size
-
-            # Update the program entry point to be the location of our payload
-            self._debug_print("Setting ELF entry point to 0x%X" % (load_segment_virtual_base_address + payload_offset))
-            elf.header.e_entry = load_segment_virtual_base_address + payload_offset
-
-            # Now that all header information has been updated to acommodate the
-            # payload, insert the payload into the ELF file.
-            self._debug_print("Inserting payload of size 0x%X at file offset 0x%X" % (payload_size, payload_offset))
-            elf.insert(payload_offset, payload)
-
-            return elf.header.e_entry
+                payload = self._default_payload(elf, **options)
 
-        return None
+            if callable(payload):
+                if placement == self.ENTRY:
+                    code[n] = payload(jump_address, address)
+                else:
+                    code[n] = payload(elf.header.e_entry, address)
+            else:
+                code[n] = payload
+
+            if placement == self.ENTRY:
+                jump_address = address
+                layout.entry = address
+
+            # Keep each payload aligned, since some architectures require it for instructions
+            address += len(code[n]) + (-len(code[n]) % alignment)
+
+        addresses = layout.place([code[n] for n in order], start, alignment)
+        layout.addresses = [None] * len(payloads)
+        for (n, vaddr) in zip(order, addresses):
+            layout.addresses[n] = vaddr
+
+        return [code[n] for n in order]
+
+    def _pages(self, elf, segment, layout):
+        '''
+        Predicts how many more pages each exec of the patched file touches than of the
+        original: the pages the payloads span, other than the one holding the original
+        entry point, and the first and last pages of the executable segment (where the
+        linker puts _init and _fini, which are run at startup and exit).
+
+        @elf     - An instance of the ELF class.
+        @segment - The program header of the executable segment.
+        @layout  - An instance of layout.Layout.
+
+        Returns the number of pages.
+        '''
+        start = layout.vaddr
+        if layout.addresses:
+            start = min([address for address in layout.addresses if address is not None] or [start])
+        end = layout.vaddr + layout.used
+        if end <= start:
+            return 0
+
+        resident = set([elf.header.e_entry // self.PAGE_SIZE,
+                        segment.p_vaddr // self.PAGE_SIZE,
+                        (segment.p_vaddr + max(segment.p_filesz, 1) - 1) // self.PAGE_SIZE])
+        return len([page for page in range(start // self.PAGE_SIZE, (end - 1) // self.PAGE_SIZE + 1) if page not in resident])
+
+    def _check_space(self, elf, layout):
+        '''
+        Raises BotoxException if the payloads would run into the load segment that follows
+        the executable segment in memory. The grown segment must not share a page with the
+        next one, or the loader would map the next segment's data over the payloads.
+
+        @elf    - An instance of the ELF class.
+        @layout - An instance of layout.Layout, with the payloads placed.
+
+        Returns None.
+        '''
+        end = layout.vaddr + layout.used
+        end += -end % layout.alignment
+
+        for phdr in elf.program_headers:
+            if ELF.PT_LOAD == phdr.p_type and phdr.index != layout.segment and phdr.p_vaddr >= layout.vaddr:
+                start = phdr.p_vaddr - phdr.p_vaddr % layout.alignment
+                if end > start:
+                    raise BotoxException("There is only room for 0x%X bytes of payload before program header #%d, "
+                                         "and 0x%X are needed!" % (max(start - layout.vaddr, 0), phdr.index, layout.used))
+
+    def _default_payload(self, elf, **options):
+        '''
+        Returns the default pause payload generator for the target ELF.
+
+        @elf     - An instance of the ELF class.
+        @options - Keyword arguments for the architecture.Architecture constructor.
+
+        Returns a callable suitable for use as a payload in patch_many.
+        '''
+        arch = self._resolve_architecture(elf.header.e_machine)
+        if arch is None:
+            raise BotoxException("Sorry, this architecture [0x%X 0x%X] is not supported!" % (elf.header.e_machine, elf.header.e_ident.ei_class))
+        # A PIE is loaded at an address that is only known at run time
+        position_independent = (elf.header.e_type == ELF.ET_DYN)
+        return arch(elf.header.e_ident.ei_encoding, position_independent=position_independent, **options).payload
 
@@ -1,11 +1,20 @@
+import re
 import struct
 from botox.elf import ELF
 from botox.exceptions import BotoxException
 
-try:
-    from keystone import *
-except ImportError as e:
-    raise BotoxException("Botox requires the keystone module! Please install it from: https://github.com/keystone-engine/keystone")
+def _keystone():
+    '''
+    Imports the keystone module. This is only done when a payload is first assembled, as
+    keystone is slow to load, and is not needed to verify, inspect or snapshot anything.
+
+    Returns the keystone module.
+    '''
+    try:
+        import keystone
+    except ImportError as e:
+        raise BotoxException("Botox requires the keystone module! Please install it from: https://github.com/keystone-engine/keystone")
+    return keystone
 
 class Architecture(object):
     '''
@@ -24,72 +33,461 @@ class Architecture(object):
     # be replaced at runtime by the hexadecimal entry point address prior to
     # assembly.
     ASM = []
-    # The keystone.KS_ARCH_XXX architecture associated with this architecture
+    # Name of the keystone.KS_ARCH_XXX architecture associated with this architecture
     ARCH = None
-    # The keystone.KS_MODE_XXX mode to be used with this architecture
+    # Name of the keystone.KS_MODE_XXX mode to be used with this architecture
     MODE = None
     # The machine type of the target architecture, as defined in the ELF header
     # See the elf.ELF.EM_XXX constants.
     MACHINE = None
 
+    # Building blocks for the conditional (and other non-default) payloads, and
+    # the default payload for position independent executables, which are
+    # assembled as:
+    #
+    #       PROLOGUE + <condition> + <variant> + EPILOGUE
+    #
+    # where <variant> is STOP for the default pause payload (see VARIANTS).
+    #
+    # PROLOGUE must come first in the payload; it saves any registers that
+    # carry information from the kernel/dynamic loader to the program entry
+    # point, and loads the address of the payload plus ANCHOR into a register,
+    # so that the payload's data can be found without absolute addresses.
+    # EPILOGUE defines the "botox_resume" label, restores the saved registers,
+    # and jumps to the original entry point, relative to the PC. The result
+    # runs correctly wherever it is loaded.
+    PROLOGUE = []
+    EPILOGUE = []
+    ANCHOR = 0
+    # Code to send the process a SIGSTOP signal
+    STOP = []
+    # Code to wait for a SIGCONT or SIGUSR1 signal, giving up after a timeout
+    WAIT = []
+    # Code to append a timestamped record to a file (see VARIANT_PROBE)
+    PROBE = []
+    # Code to send the process ID (and name) to a FIFO or socket (see VARIANT_NOTIFY)
+    NOTIFY = []
+    # Conditions under which the process should be stopped, keyed by trigger
+    # type. If the condition does not hold, the code must jump to "botox_resume".
+    TRIGGERS = {}
+
     BIG = ELF.ELFDATA2MSB
     LITTLE = ELF.ELFDATA2LSB
 
     ENTRY_POINT = "entry_point"
 
-    def __init__(self, endianess):
+    # Stop only if the environment contains the given "NAME=VALUE" string
+    # (or, if no value is given, any definition of NAME).
+    TRIGGER_ENV = "env"
+    # Stop only if the given file exists
+    TRIGGER_FILE = "file"
+    # Stop only if the process has the given PID
+    TRIGGER_PID = "pid"
+
+    # Maximum length of an environment trigger string
+    MAX_TRIGGER_LENGTH = 255
+
+    # Payload variants: what the payload does once it decides to pause the process
+    #
+    # Stop the process with SIGSTOP until it is sent a SIGCONT
+    VARIANT_PAUSE = "pause"
+    # Wait up to a configurable time for a SIGCONT (or SIGUSR1) signal, then continue regardless
+    VARIANT_TIMEOUT = "timeout"
+    # Don't pause at all; write a PROBE_RECORD_SIZE byte record of the process ID, a binary ID
+    # and the CLOCK_MONOTONIC time to a file or file descriptor, then continue (see botox.probe)
+    VARIANT_PROBE = "probe"
+    # Send the process ID (and optionally argv[0]) to a controller listening on a FIFO
+    # or abstract Unix datagram socket, then stop the process with SIGSTOP (see botox.notify)
+    VARIANT_NOTIFY = "notify"
+
+    # The names of the class attributes holding the code for each variant
+    VARIANTS = {
+        VARIANT_PAUSE : ("STOP",),
+        VARIANT_TIMEOUT : ("WAIT",),
+        VARIANT_PROBE : ("PROBE",),
+        VARIANT_NOTIFY : ("NOTIFY", "STOP"),
+    }
+
+    # Probe records are a 32-bit PID, a 32-bit binary ID, and the 64-bit seconds
+    # and nanoseconds of the timestamp, all in the target's byte order.
+    PROBE_RECORD_SIZE = 24
+    # Binary IDs reserved for the exec and exit marks written by botox.probe.launch()
+    PROBE_EXEC_ID = 0
+    PROBE_EXIT_ID = 0xFFFFFFFF
+    # Default binary ID for probe payloads
+    DEFAULT_PROBE_ID = 1
+
+    # Notification messages are a 32-bit PID and a 32-bit name length, in the target's
+    # byte order, followed by that many bytes of argv[0] (at most NOTIFY_NAME_MAX).
+    # Messages are small enough to be written to a FIFO atomically.
+    NOTIFY_HEADER_SIZE = 8
+    NOTIFY_NAME_MAX = 1024
+    # Notification targets starting with this are abstract Unix socket names
+    NOTIFY_ABSTRACT_PREFIX = "@"
+    AF_UNIX = 1
+    # Maximum length of an abstract socket name (sizeof(sockaddr_un.sun_path) - 1)
+    MAX_SOCKET_NAME = 107
+
+    # Default maximum pause time for VARIANT_TIMEOUT, in seconds
+    DEFAULT_TIMEOUT = 60
+
+    # Target specific ABI details
+    LONG_SIZE = 4
+    SIGSET_SIZE = 8
+    SIGCONT = 18
+    SIGUSR1 = 10
+
+    def __init__(self, endianess, variant=None, trigger=None, timeout=None, probe=None, probe_id=None,
+                 notify=None, notify_name=False, position_independent=False):
         '''
         Class constructor.
 
         @endianess - The endianess of the target architecture, as specified in the ELF
                      header (e_ident.ei_encoding).
+        @variant   - The payload variant, one of the VARIANT_XXX constants. Defaults to VARIANT_PAUSE.
+        @trigger   - Optional (type, value) tuple, specifying a condition which must hold
+                     for the process to be stopped (e.g., (Architecture.TRIGGER_ENV, "BOTOX_STOP=1")).
+                     If the condition does not hold, the payload jumps straight to the
+                     original entry point.
+        @timeout   - The maximum time to pause for, in seconds, for VARIANT_TIMEOUT.
+        @probe     - The file path, or the (already open) file descriptor number, that
+                     VARIANT_PROBE payloads write their records to. Files are opened
+                     with O_APPEND, and created if they do not exist.
+        @probe_id  - The binary ID written in each VARIANT_PROBE record, to tell apart the
+                     records from different binaries sharing a file. Defaults to DEFAULT_PROBE_ID.
+        @notify    - The FIFO path, or "@name" abstract Unix socket name, that VARIANT_NOTIFY
+                     payloads send their notifications to. The FIFO is opened non-blocking,
+                     and the process is stopped whether or not anybody is listening.
+        @notify_name - Set to True to include argv[0] in VARIANT_NOTIFY notifications.
+        @position_independent - Set to True to only use PC-relative addressing, for targets
+                                that are loaded at an address only known at run time (PIE).
 
         Returns None.
         '''
         self.endianess = endianess
+        self.variant = variant or self.VARIANT_PAUSE
+        self.trigger = trigger
+        self.timeout = timeout
+        self.probe = probe
+        self.probe_id = probe_id
+        self.notify = notify
+        self.notify_name = notify_name
+        self.position_independent = position_independent
+
+        if self.variant not in self.VARIANTS:
+            raise BotoxException("Unknown payload variant '%s'!" % str(self.variant))
+        if not all([getattr(self, name) for name in self.VARIANTS[self.variant]]):
+            raise BotoxException("Sorry, the '%s' payload variant is not supported on %s!" % (self.variant, self.__class__.__name__))
+
+        if self.variant == self.VARIANT_TIMEOUT:
+            if self.timeout is None:
+                self.timeout = self.DEFAULT_TIMEOUT
+            if self.timeout < 0:
+                raise BotoxException("The payload timeout must not be negative!")
+
+        if self.variant == self.VARIANT_PROBE:
+            if self.probe is None:
+                raise BotoxException("The probe payload requires a file path or descriptor to write to!")
+            if isinstance(self.probe, int) and self.probe < 0:
+                raise BotoxException("Invalid probe file descriptor %d!" % self.probe)
+            if self.probe_id is None:
+                self.probe_id = self.DEFAULT_PROBE_ID
+            if self.probe_id in [self.PROBE_EXEC_ID, self.PROBE_EXIT_ID] or not 0 < self.probe_id < 0xFFFFFFFF:
+                raise BotoxException("Invalid probe binary ID %d; IDs 0x%X and 0x%X are reserved!" % (self.probe_id,
+                                                                                                    self.PROBE_EXEC_ID,
+                                                                                                    self.PROBE_EXIT_ID))
+
+        if self.variant == self.VARIANT_NOTIFY:
+            if not self.notify:
+                raise BotoxException("The notify payload requires a FIFO path or abstract socket name to notify!")
+            if self.notify.startswith(self.NOTIFY_ABSTRACT_PREFIX):
+                if len(self.notify) - len(self.NOTIFY_ABSTRACT_PREFIX) > self.MAX_SOCKET_NAME:
+                    raise BotoxException("Socket name '%s' is too long!" % self.notify)
+
+        if self.trigger is not None:
+            if self.trigger[0] not in [self.TRIGGER_ENV, self.TRIGGER_FILE, self.TRIGGER_PID]:
+                raise BotoxException("Unknown payload trigger type '%s'!" % str(self.trigger[0]))
+            if self.trigger[0] not in self.TRIGGERS:
+                raise BotoxException("Sorry, the '%s' payload trigger is not supported on %s!" % (self.trigger[0], self.__class__.__name__))
+
+    @staticmethod
+    def parse_trigger(spec):
+        '''
+        Parses a trigger specification string, as given on the command line.
+
+        @spec - A string of the form "<type>:<value>", e.g., "env:BOTOX_STOP=1",
+                "file:/tmp/botox.stop" or "pid:1234".
+
+        Returns a (type, value) tuple suitable for the constructor's trigger argument.
+        '''
+        try:
+            (kind, value) = spec.split(":", 1)
+        except ValueError as e:
+            raise BotoxException("Invalid trigger '%s'; expected <type>:<value>!" % spec)
+
+        if kind == Architecture.TRIGGER_PID:
+            try:
+                value = int(value, 0)
+            except ValueError as e:
+                raise BotoxException("Invalid PID in trigger '%s'!" % spec)
+
+        return (kind, value)
+
+    def _word(self, value, signed=False):
+        '''
+        Packs a 32-bit data word in the target's byte order.
+        '''
+        if self.endianess == self.BIG:
+            fmt = ">"
+        else:
+            fmt = "<"
+
+        if signed:
+            fmt += "i"
+        else:
+            fmt += "I"
+
+        try:
+            return struct.pack(fmt, value)
+        except struct.error as e:
+            # e.g., an entry point too far away from the payload to jump to
+            raise BotoxException("Value %d does not fit in a 32-bit word!" % value)
+
+    def _long(self, value):
+        '''
+        Packs a C long (e.g., a member of a struct timespec or sigset_t) in the target's byte order.
+        '''
+        if self.endianess == self.BIG:
+            fmt = ">"
+        else:
+            fmt = "<"
+
+        if self.LONG_SIZE == 8:
+            fmt += "Q"
+        else:
+            fmt += "I"
+
+        return struct.pack(fmt, value)
+
+    def _sigset(self, signals):
+        '''
+        Builds a kernel sigset_t containing the specified signals.
+        '''
+        mask = 0
+        for signal in signals:
+            mask |= 1 << (signal - 1)
+
+        words = []
+        while len(words) * self.LONG_SIZE < self.SIGSET_SIZE:
+            words.append(self._long(mask & ((1 << (self.LONG_SIZE * 8)) - 1)))
+            mask >>= self.LONG_SIZE * 8
+
+        return b"".join(words)
+
+    def _source(self):
+        '''
+        Returns the list of assembly instructions for the configured payload.
+        '''
+        # ASM jumps to the absolute entry point address, which is only known for ET_EXEC
+        # targets; everything else addresses its data and the entry point relative to the PC.
+        if self.variant == self.VARIANT_PAUSE and self.trigger is None and not self.position_independent:
+            return self.ASM
+
+        if self.trigger is not None:
+            condition = self.TRIGGERS[self.trigger[0]]
+        else:
+            condition = []
+
+        source = self.PROLOGUE + condition
+        for name in self.VARIANTS[self.variant]:
+            source += getattr(self, name)
+
+        return source + self.EPILOGUE
+
+    def _parameters(self, jump_address, address):
+        '''
+        Returns the data and the constant values used by the configured payload.
+
+        @jump_address - The address the payload jumps to when it is done.
+        @address      - The virtual address the payload will be loaded at.
+
+        Returns a tuple of ([(name, data), ...], {name : value, ...}).
+
+        Each named data item is appended to the payload code, and its name is replaced
+        in the assembly code by its offset relative to the anchor register (see ANCHOR).
+        Each named value is replaced in the assembly code by the value itself.
+        '''
+        data = [("entry_data", self._word(jump_address - address - self.ANCHOR, signed=True))]
+        values = {self.ENTRY_POINT : jump_address}
+
+        if self.trigger is not None:
+            (kind, value) = self.trigger
+
+            if kind == self.TRIGGER_PID:
+                data.append(("trigger_data", self._word(value)))
+                values["trigger_value"] = value
+            else:
+                if not isinstance(value, bytes):
+                    value = value.encode("utf-8")
+
+                if kind == self.TRIGGER_ENV:
+                    # Match "NAME=VALUE" exactly (including the NULL terminator),
+                    # or any "NAME=..." if no value was specified.
+                    if b"=" in value:
+                        value += b"\x00"
+                    else:
+                        value += b"="
+
+                    if len(value) > self.MAX_TRIGGER_LENGTH:
+                        raise BotoxException("Trigger string '%s' is too long!" % self.trigger[1])
+
+                    values["trigger_length"] = len(value)
+                else:
+                    value += b"\x00"
+
+                data.append(("trigger_data", value))
+
+        if self.variant == self.VARIANT_TIMEOUT:
+            seconds = int(self.timeout)
+            nanoseconds = int((self.timeout - seconds) * 1000000000)
+            data.append(("wait_sigset", self._sigset([self.SIGCONT, self.SIGUSR1])))
+            data.append(("wait_timeout", self._long(seconds) + self._long(nanoseconds)))
+
+        if self.variant == self.VARIANT_PROBE:
+            # A negative descriptor tells the payload to open probe_path instead
+            if isinstance(self.probe, int):
+                (fd, path) = (self.probe, b"")
+            elif isinstance(self.probe, bytes):
+                (fd, path) = (-1, self.probe)
+            else:
+                (fd, path) = (-1, self.probe.encode("utf-8"))
+
+            data.append(("probe_fd", self._word(fd, signed=True)))
+            data.append(("probe_path", path + b"\x00"))
+            data.append(("probe_id_data", self._word(self.probe_id)))
+            values["probe_id"] = self.probe_id
+
+            # 32-bit targets get a 32-bit struct timespec from the kernel; these are the
+            # offsets in the record of the low words of the 64-bit seconds and nanoseconds.
+            if self.endianess == self.BIG:
+                (values["probe_sec"], values["probe_nsec"]) = (12, 20)
+            else:
+                (values["probe_sec"], values["probe_nsec"]) = (8, 16)
+
+        if self.variant == self.VARIANT_NOTIFY:
+            target = self.notify
+            if not isinstance(target, bytes):
+                target = target.encode("utf-8")
+
+            if target.startswith(self.NOTIFY_ABSTRACT_PREFIX.encode("utf-8")):
+                # struct sockaddr_un, with a leading NULL byte in sun_path for the abstract namespace
+                if self.endianess == self.BIG:
+                    address = struct.pack(">H", self.AF_UNIX)
+                else:
+                    address = struct.pack("<H", self.AF_UNIX)
+                address += b"\x00" + target[len(self.NOTIFY_ABSTRACT_PREFIX):]
+
+                data.append(("notify_path", address))
+                values["notify_path_length"] = len(address)
+                values["notify_socket"] = 1
+            else:
+                data.append(("notify_path", target + b"\x00"))
+                values["notify_path_length"] = len(target) + 1
+                values["notify_socket"] = 0
+
+            if self.notify_name:
+                values["notify_name_max"] = self.NOTIFY_NAME_MAX
+            else:
+                values["notify_name_max"] = 0
+
+        return (data, values)
+
+    def _assemble(self, source, address):
+        '''
+        Assembles a block of code.
+
+        @source  - Assembly code.
+        @address - The virtual address the code will be loaded at.
+
+        Returns a string containing the machine code.
+        '''
+        keystone = _keystone()
+
+        # Set big/little endian flag for keystone
+        if self.endianess == self.BIG:
+            endian_mode = keystone.KS_MODE_BIG_ENDIAN
+        else:
+            endian_mode = keystone.KS_MODE_LITTLE_ENDIAN
+
+        # Instatiate the keystone.Ks class for assembly
+        ks = keystone.Ks(getattr(keystone, self.ARCH), getattr(keystone, self.MODE) | endian_mode)
+
+        # Exceptions in assembling the code will be caught and a BotoxException will be raised.
+        try:
+            (encoding, count) = ks.asm(source, address)
+        except KeyboardInterrupt as e:
+            raise e
+        except Exception as e:
+            raise BotoxException("Failed to assemble payload '%s': %s" % (source.replace("\n", "; "), str(e)))
 
-    def payload(self, jump_address):
+        # Convert the list of raw bytes into a string and return
+        return bytes(bytearray(encoding))
+
+    def payload(self, jump_address, address=0):
         '''
         Generates a payload that will pause the process execution
         until a SIGCONT signal is passed to the process, at which
         point the code will jump to a specified address.
 
         @jump_address - The address to jump to when SIGCONT is encountered.
+        @address      - The virtual address the payload will be loaded at.
 
         Returns a string containing the shellcode.
         '''
-        encoding = []
+        source = "\n".join(self._source())
+        (items, values) = self._parameters(jump_address, address)
 
-        # Set big/little endian flag for keystone
-        if self.endianess == self.BIG:
-            endian_mode = KS_MODE_BIG_ENDIAN
-        else:
-            endian_mode = KS_MODE_LITTLE_ENDIAN
+        # Only data that is actually referenced by the code is included in the payload;
+        # each item is padded to a multiple of 4 bytes to keep word loads aligned.
+        data = bytearray()
+        offsets = {}
+        for (name, value) in items:
+            if re.search(r"\b%s\b" % name, source):
+                offsets[name] = len(data)
+                data += value
+                data += b"\x00" * (-len(value) % 4)
 
-        # Instatiate the keystone.Ks class for assembly
-        ks = Ks(self.ARCH, self.MODE | endian_mode)
+        # The data goes right after the code, so its offset depends on the size of the
+        # code, which may in turn depend on the offset of the data (e.g., x86 picks
+        # shorter encodings for small displacements). Re-assemble until it settles.
+        code = b""
+        for attempt in range(0, 8):
+            for (name, offset) in offsets.items():
+                values[name] = len(code) + offset - self.ANCHOR
 
-        # Assemble each line to a list of raw bytes that are appended to the
-        # encoding list. Exceptions in assembling any specific line of code
-        # will be caught and a BotoxException will be raised.
-        for line in self.ASM:
-            assembly = line.replace(self.ENTRY_POINT, hex(jump_address))
+            assembly = re.sub(r"\b(%s)\b" % "|".join(values.keys()),
+                              lambda m: self._constant(values[m.group(1)]),
+                              source)
 
-            try:
-                (hexbytes, count) = ks.asm(assembly)
-                encoding += hexbytes
-            except KeyboardInterrupt as e:
-                raise e
-            except Exception as e:
-                raise BotoxException("Failed to assemble payload line '%s': %s" % (assembly, str(e)))
+            previous = code
+            code = self._assemble(assembly, address)
+            if len(code) == len(previous) or not offsets:
+                return b"".join((code, data))
 
-        # Convert the list of raw bytes into a string and return
-        return ''.join([chr(byte) for byte in encoding])
+        raise BotoxException("Failed to assemble payload: the code size did not converge!")
+
+    def _constant(self, value):
+        '''
+        Formats an integer for use in assembly code.
+        '''
+        if value < 0:
+            return "-0x%X" % -value
+        return "0x%X" % value
 
 class X86(Architecture):
     MACHINE = ELF.EM_386
-    ARCH = KS_ARCH_X86
-    MODE = KS_MODE_32
+    ARCH = "KS_ARCH_X86"
+    MODE = "KS_MODE_32"
     ASM = [
                 "mov eax, 20",
                 "int 0x80",         # getpid();
@@ -100,11 +498,191 @@ class X86(Architecture):
                 "mov eax, %s" % Architecture.ENTRY_POINT,
                 "jmp eax",          # goto entry_point
           ]
+    PROLOGUE = [
+                "push edx",         # atexit() function pointer from the dynamic loader
+                "call botox_pc",
+                "botox_pc:",
+                "pop ebp",          # ebp = payload + 6
+          ]
+    ANCHOR = 6
+    EPILOGUE = [
+                "botox_resume:",
+                "pop edx",
+                "jmp %s" % Architecture.ENTRY_POINT,
+          ]
+    STOP = [
+                "mov eax, 20",
+                "int 0x80",         # getpid();
+                "mov ebx, eax",
+                "mov ecx, 19",
+                "mov eax, 37",
+                "int 0x80",         # kill(pid, SIGSTOP);
+          ]
+    WAIT = [
+                "sub esp, 8",
+                "xor ebx, ebx",
+                "lea ecx, [ebp + wait_sigset]",
+                "mov edx, esp",
+                "mov esi, 8",
+                "mov eax, 175",
+                "int 0x80",         # rt_sigprocmask(SIG_BLOCK, &sigset, &old, 8);
+                "lea ebx, [ebp + wait_sigset]",
+                "xor ecx, ecx",
+                "lea edx, [ebp + wait_timeout]",
+                "mov esi, 8",
+                "mov eax, 177",
+                "int 0x80",         # rt_sigtimedwait(&sigset, NULL, &timeout, 8);
+                "mov ebx, 2",
+                "mov ecx, esp",
+                "xor edx, edx",
+                "mov esi, 8",
+                "mov eax, 175",
+                "int 0x80",         # rt_sigprocmask(SIG_SETMASK, &old, NULL, 8);
+                "add esp, 8",
+          ]
+    PROBE = [
+                "sub esp, 24",
+                "mov eax, 20",
+                "int 0x80",         # getpid();
+                "mov dword ptr [esp], eax",
+                "mov dword ptr [esp + 4], probe_id",
+                "mov ebx, 1",
+                "lea ecx, [esp + 8]",
+                "mov eax, 265",
+                "int 0x80",         # clock_gettime(CLOCK_MONOTONIC, &record.time);
+                "mov eax, dword ptr [esp + 12]",
+                "mov dword ptr [esp + 16], eax",
+                "xor eax, eax",
+                "mov dword ptr [esp + 12], eax",
+                "mov dword ptr [esp + 20], eax",   # widen the 32-bit timespec
+                "mov ebx, dword ptr [ebp + probe_fd]",
+                "test ebx, ebx",
+                "jns botox_probe_write",
+                "lea ebx, [ebp + probe_path]",
+                "mov ecx, 0x441",
+                "mov edx, 0x1A4",
+                "mov eax, 5",
+                "int 0x80",         # fd = open(path, O_WRONLY | O_APPEND | O_CREAT, 0644);
+                "mov ebx, eax",
+                "test ebx, ebx",
+                "js botox_probe_done",
+                "botox_probe_write:",
+                "mov ecx, esp",
+                "mov edx, 24",
+                "mov eax, 4",
+                "int 0x80",         # write(fd, &record, 24);
+                "cmp ebx, dword ptr [ebp + probe_fd]",
+                "je botox_probe_done",
+                "mov eax, 6",
+                "int 0x80",         # close(fd);
+                "botox_probe_done:",
+                "add esp, 24",
+          ]
+    NOTIFY = [
+                "sub esp, 24",      # message header, followed by struct iovec[2]
+                "mov eax, 20",
+                "int 0x80",         # getpid();
+                "mov dword ptr [esp], eax",
+                "mov esi, dword ptr [esp + 32]",    # argv[0]
+                "xor ecx, ecx",
+                "test esi, esi",
+                "jz botox_notify_open",
+                "botox_notify_strlen:",
+                "cmp ecx, notify_name_max",
+                "jae botox_notify_open",
+                "cmp byte ptr [esi + ecx], 0",
+                "je botox_notify_open",
+                "inc ecx",
+                "jmp botox_notify_strlen",
+                "botox_notify_open:",
+                "mov dword ptr [esp + 4], ecx",
+                "mov dword ptr [esp + 8], esp",
+                "mov dword ptr [esp + 12], 8",
+                "mov dword ptr [esp + 16], esi",
+                "mov dword ptr [esp + 20], ecx",
+                "mov eax, notify_socket",
+                "test eax, eax",
+                "jnz botox_notify_socket",
+                "lea ebx, [ebp + notify_path]",
+                "mov ecx, 0x801",
+                "mov eax, 5",
+                "int 0x80",         # fd = open(path, O_WRONLY | O_NONBLOCK);
+                "jmp botox_notify_send",
+                "botox_notify_socket:",
+                "push 0",
+                "push 2",
+                "push 1",
+                "mov ebx, 1",
+                "mov ecx, esp",
+                "mov eax, 102",
+                "int 0x80",         # fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+                "add esp, 12",
+                "test eax, eax",
+                "js botox_notify_done",
+                "mov edi, eax",
+                "push notify_path_length",
+                "lea ecx, [ebp + notify_path]",
+                "push ecx",
+                "push edi",
+                "mov ebx, 3",
+                "mov ecx, esp",
+                "mov eax, 102",
+                "int 0x80",         # connect(fd, &address, sizeof(address));
+                "add esp, 12",
+                "mov eax, edi",
+                "botox_notify_send:",
+                "test eax, eax",
+                "js botox_notify_done",
+                "mov ebx, eax",
+                "lea ecx, [esp + 8]",
+                "mov edx, 2",
+                "mov eax, 146",
+                "int 0x80",         # writev(fd, iov, 2);
+                "mov eax, 6",
+                "int 0x80",         # close(fd);
+                "botox_notify_done:",
+                "add esp, 24",
+          ]
+    TRIGGERS = {
+        Architecture.TRIGGER_ENV : [
+                "mov ecx, dword ptr [esp + 4]",
+                "lea esi, [esp + ecx*4 + 12]",      # envp
+                "lea ebx, [ebp + trigger_data]",
+                "botox_env_next:",
+                "mov edi, dword ptr [esi]",
+                "test edi, edi",
+                "jz botox_resume",
+                "add esi, 4",
+                "xor ecx, ecx",
+                "botox_env_cmp:",
+                "mov al, byte ptr [edi + ecx]",
+                "cmp al, byte ptr [ebx + ecx]",
+                "jne botox_env_next",
+                "inc ecx",
+                "cmp ecx, trigger_length",
+                "jb botox_env_cmp",
+        ],
+        Architecture.TRIGGER_FILE : [
+                "lea ebx, [ebp + trigger_data]",
+                "xor ecx, ecx",
+                "mov eax, 33",
+                "int 0x80",         # access(path, F_OK);
+                "test eax, eax",
+                "jnz botox_resume",
+        ],
+        Architecture.TRIGGER_PID : [
+                "mov eax, 20",
+                "int 0x80",         # getpid();
+                "cmp eax, trigger_value",
+                "jne botox_resume",
+        ],
+    }
 
 class X86_64(Architecture):
     MACHINE = ELF.EM_X86_64
-    ARCH = KS_ARCH_X86
-    MODE = KS_MODE_64
+    ARCH = "KS_ARCH_X86"
+    MODE = "KS_MODE_64"
+    LONG_SIZE = 8
     ASM = [
                 "mov eax, 0x27",
                 "syscall",          # getpid();
@@ -115,11 +693,177 @@ class X86_64(Architecture):
                 "mov rax, %s" % Architecture.ENTRY_POINT,
                 "jmp rax",          # goto entry_point;
           ]
+    PROLOGUE = [
+                "botox_start:",     # data is addressed relative to rip
+                "push rdx",         # atexit() function pointer from the dynamic loader
+          ]
+    EPILOGUE = [
+                "botox_resume:",
+                "pop rdx",
+                "jmp %s" % Architecture.ENTRY_POINT,
+          ]
+    STOP = [
+                "mov eax, 0x27",
+                "syscall",          # getpid();
+                "mov edi, eax",
+                "mov esi, 19",
+                "mov eax, 0x3E",
+                "syscall",          # kill(pid, SIGSTOP);
+          ]
+    WAIT = [
+                "sub rsp, 8",
+                "xor edi, edi",
+                "lea rsi, [rip + botox_start + wait_sigset]",
+                "mov rdx, rsp",
+                "mov r10d, 8",
+                "mov eax, 14",
+                "syscall",          # rt_sigprocmask(SIG_BLOCK, &sigset, &old, 8);
+                "lea rdi, [rip + botox_start + wait_sigset]",
+                "xor esi, esi",
+                "lea rdx, [rip + botox_start + wait_timeout]",
+                "mov r10d, 8",
+                "mov eax, 128",
+                "syscall",          # rt_sigtimedwait(&sigset, NULL, &timeout, 8);
+                "mov edi, 2",
+                "mov rsi, rsp",
+                "xor edx, edx",
+                "mov r10d, 8",
+                "mov eax, 14",
+                "syscall",          # rt_sigprocmask(SIG_SETMASK, &old, NULL, 8);
+                "add rsp, 8",
+          ]
+    PROBE = [
+                "sub rsp, 24",
+                "mov eax, 0x27",
+                "syscall",          # getpid();
+                "mov dword ptr [rsp], eax",
+                "mov dword ptr [rsp + 4], probe_id",
+                "mov edi, 1",
+                "lea rsi, [rsp + 8]",
+                "mov eax, 228",
+                "syscall",          # clock_gettime(CLOCK_MONOTONIC, &record.time);
+                "mov edi, dword ptr [rip + botox_start + probe_fd]",
+                "test edi, edi",
+                "jns botox_probe_write",
+                "lea rdi, [rip + botox_start + probe_path]",
+                "mov esi, 0x441",
+                "mov edx, 0x1A4",
+                "mov eax, 2",
+                "syscall",          # fd = open(path, O_WRONLY | O_APPEND | O_CREAT, 0644);
+                "mov edi, eax",
+                "test edi, edi",
+                "js botox_probe_done",
+                "botox_probe_write:",
+                "mov rsi, rsp",
+                "mov edx, 24",
+                "mov eax, 1",
+                "syscall",          # write(fd, &record, 24);
+                "cmp edi, dword ptr [rip + botox_start + probe_fd]",
+                "je botox_probe_done",
+                "mov eax, 3",
+                "syscall",          # close(fd);
+                "botox_probe_done:",
+                "add rsp, 24",
+          ]
+    NOTIFY = [
+                "sub rsp, 40",      # message header, followed by struct iovec[2]
+                "mov eax, 0x27",
+                "syscall",          # getpid();
+                "mov dword ptr [rsp], eax",
+                "mov rsi, qword ptr [rsp + 56]",    # argv[0]
+                "xor ecx, ecx",
+                "test rsi, rsi",
+                "jz botox_notify_open",
+                "botox_notify_strlen:",
+                "cmp ecx, notify_name_max",
+                "jae botox_notify_open",
+                "cmp byte ptr [rsi + rcx], 0",
+                "je botox_notify_open",
+                "inc ecx",
+                "jmp botox_notify_strlen",
+                "botox_notify_open:",
+                "mov dword ptr [rsp + 4], ecx",
+                "mov qword ptr [rsp + 8], rsp",
+                "mov qword ptr [rsp + 16], 8",
+                "mov qword ptr [rsp + 24], rsi",
+                "mov qword ptr [rsp + 32], rcx",
+                "mov eax, notify_socket",
+                "test eax, eax",
+                "jnz botox_notify_socket",
+                "lea rdi, [rip + botox_start + notify_path]",
+                "mov esi, 0x801",
+                "mov eax, 2",
+                "syscall",          # fd = open(path, O_WRONLY | O_NONBLOCK);
+                "jmp botox_notify_send",
+                "botox_notify_socket:",
+                "mov edi, 1",
+                "mov esi, 2",
+                "xor edx, edx",
+                "mov eax, 41",
+                "syscall",          # fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+                "test eax, eax",
+                "js botox_notify_done",
+                "mov edi, eax",
+                "lea rsi, [rip + botox_start + notify_path]",
+                "mov edx, notify_path_length",
+                "mov eax, 42",
+                "syscall",          # connect(fd, &address, sizeof(address));
+                "mov eax, edi",
+                "botox_notify_send:",
+                "test eax, eax",
+                "js botox_notify_done",
+                "mov edi, eax",
+                "lea rsi, [rsp + 8]",
+                "mov edx, 2",
+                "mov eax, 20",
+                "syscall",          # writev(fd, iov, 2);
+                "mov eax, 3",
+                "syscall",          # close(fd);
+                "botox_notify_done:",
+                "add rsp, 40",
+          ]
+    TRIGGERS = {
+        Architecture.TRIGGER_ENV : [
+                "mov rcx, qword ptr [rsp + 8]",
+                "lea rsi, [rsp + rcx*8 + 24]",      # envp
+                "lea r8, [rip + botox_start + trigger_data]",
+                "botox_env_next:",
+                "mov rdi, qword ptr [rsi]",
+                "test rdi, rdi",
+                "jz botox_resume",
+                "add rsi, 8",
+                "xor ecx, ecx",
+                "botox_env_cmp:",
+                "mov al, byte ptr [rdi + rcx]",
+                "cmp al, byte ptr [r8 + rcx]",
+                "jne botox_env_next",
+                "inc ecx",
+                "cmp ecx, trigger_length",
+                "jb botox_env_cmp",
+        ],
+        Architecture.TRIGGER_FILE : [
+                "lea rdi, [rip + botox_start + trigger_data]",
+                "xor esi, esi",
+                "mov eax, 21",
+                "syscall",          # access(path, F_OK);
+                "test eax, eax",
+                "jnz botox_resume",
+        ],
+        Architecture.TRIGGER_PID : [
+                "mov eax, 0x27",
+                "syscall",          # getpid();
+                "cmp eax, trigger_value",
+                "jne botox_resume",
+        ],
+    }
 
 class MIPS(Architecture):
     MACHINE = ELF.EM_MIPS
-    ARCH = KS_ARCH_MIPS
-    MODE = KS_MODE_MIPS32
+    ARCH = "KS_ARCH_MIPS"
+    MODE = "KS_MODE_MIPS32"
+    SIGSET_SIZE = 16
+    SIGCONT = 25
+    SIGUSR1 = 16
     ASM = [
                 "li $v0, 0xFB4",
                 "syscall 0",        # getpid();
@@ -130,11 +874,214 @@ class MIPS(Architecture):
                 "li $t0, %s" % Architecture.ENTRY_POINT,
                 "jr $t0",           # goto entry_point;
            ]
+    # Branch delay slots are always filled with explicit nops, so that the
+    # code is correct whether or not the assembler fills them itself.
+    PROLOGUE = [
+                "bal botox_pc",
+                "nop",
+                "botox_pc:",
+                "move $s7, $ra",    # $s7 = payload + 8
+                "addiu $sp, $sp, -8",
+                "sw $v0, 0($sp)",   # atexit() function pointer from the dynamic loader
+           ]
+    ANCHOR = 8
+    EPILOGUE = [
+                "botox_resume:",
+                "lw $v0, 0($sp)",
+                "addiu $sp, $sp, 8",
+                "lw $t0, entry_data($s7)",
+                "addu $t0, $t0, $s7",
+                "jr $t0",           # goto entry_point;
+                "nop",
+           ]
+    STOP = [
+                "li $v0, 0xFB4",
+                "syscall 0",        # getpid();
+                "move $a0, $v0",
+                "li $a1, 23",
+                "li $v0, 0xFC5",
+                "syscall 0",        # kill(pid, SIGSTOP);
+           ]
+    WAIT = [
+                "addiu $sp, $sp, -16",
+                "li $a0, 1",
+                "addiu $a1, $s7, wait_sigset",
+                "move $a2, $sp",
+                "li $a3, 16",
+                "li $v0, 0x1063",
+                "syscall 0",        # rt_sigprocmask(SIG_BLOCK, &sigset, &old, 16);
+                "addiu $a0, $s7, wait_sigset",
+                "move $a1, $zero",
+                "addiu $a2, $s7, wait_timeout",
+                "li $a3, 16",
+                "li $v0, 0x1065",
+                "syscall 0",        # rt_sigtimedwait(&sigset, NULL, &timeout, 16);
+                "li $a0, 3",
+                "move $a1, $sp",
+                "move $a2, $zero",
+                "li $a3, 16",
+                "li $v0, 0x1063",
+                "syscall 0",        # rt_sigprocmask(SIG_SETMASK, &old, NULL, 16);
+                "addiu $sp, $sp, 16",
+           ]
+    PROBE = [
+                "addiu $sp, $sp, -24",
+                "li $v0, 0xFB4",
+                "syscall 0",        # getpid();
+                "sw $v0, 0($sp)",
+                "lw $t0, probe_id_data($s7)",
+                "sw $t0, 4($sp)",
+                "li $a0, 1",
+                "addiu $a1, $sp, 8",
+                "li $v0, 0x10A7",
+                "syscall 0",        # clock_gettime(CLOCK_MONOTONIC, &record.time);
+                "lw $t0, 8($sp)",
+                "lw $t1, 12($sp)",
+                "sw $zero, 8($sp)",
+                "sw $zero, 12($sp)",
+                "sw $zero, 16($sp)",
+                "sw $zero, 20($sp)",
+                "sw $t0, probe_sec($sp)",
+                "sw $t1, probe_nsec($sp)",          # widen the 32-bit timespec
+                "lw $s0, probe_fd($s7)",
+                "bgez $s0, botox_probe_write",
+                "nop",
+                "addiu $a0, $s7, probe_path",
+                "li $a1, 0x109",
+                "li $a2, 0x1A4",
+                "li $v0, 0xFA5",
+                "syscall 0",        # fd = open(path, O_WRONLY | O_APPEND | O_CREAT, 0644);
+                "bne $a3, $zero, botox_probe_done",
+                "nop",
+                "move $s0, $v0",
+                "botox_probe_write:",
+                "move $a0, $s0",
+                "move $a1, $sp",
+                "li $a2, 24",
+                "li $v0, 0xFA4",
+                "syscall 0",        # write(fd, &record, 24);
+                "lw $t0, probe_fd($s7)",
+                "beq $s0, $t0, botox_probe_done",
+                "nop",
+                "move $a0, $s0",
+                "li $v0, 0xFA6",
+                "syscall 0",        # close(fd);
+                "botox_probe_done:",
+                "addiu $sp, $sp, 24",
+           ]
+    NOTIFY = [
+                "addiu $sp, $sp, -24",              # message header, followed by struct iovec[2]
+                "li $v0, 0xFB4",
+                "syscall 0",        # getpid();
+                "sw $v0, 0($sp)",
+                "lw $s1, 36($sp)",                  # argv[0]
+                "move $s2, $zero",
+                "beq $s1, $zero, botox_notify_open",
+                "nop",
+                "botox_notify_strlen:",
+                "sltiu $t0, $s2, notify_name_max",
+                "beq $t0, $zero, botox_notify_open",
+                "nop",
+                "addu $t0, $s1, $s2",
+                "lbu $t0, 0($t0)",
+                "beq $t0, $zero, botox_notify_open",
+                "nop",
+                "addiu $s2, $s2, 1",
+                "b botox_notify_strlen",
+                "nop",
+                "botox_notify_open:",
+                "sw $s2, 4($sp)",
+                "sw $sp, 8($sp)",
+                "li $t0, 8",
+                "sw $t0, 12($sp)",
+                "sw $s1, 16($sp)",
+                "sw $s2, 20($sp)",
+                "li $t0, notify_socket",
+                "bne $t0, $zero, botox_notify_socket",
+                "nop",
+                "addiu $a0, $s7, notify_path",
+                "li $a1, 0x81",
+                "li $v0, 0xFA5",
+                "syscall 0",        # fd = open(path, O_WRONLY | O_NONBLOCK);
+                "b botox_notify_send",
+                "nop",
+                "botox_notify_socket:",
+                "li $a0, 1",
+                "li $a1, 1",
+                "move $a2, $zero",
+                "li $v0, 0x1057",
+                "syscall 0",        # fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+                "bne $a3, $zero, botox_notify_done",
+                "nop",
+                "move $s0, $v0",
+                "move $a0, $s0",
+                "addiu $a1, $s7, notify_path",
+                "li $a2, notify_path_length",
+                "li $v0, 0x104A",
+                "syscall 0",        # connect(fd, &address, sizeof(address));
+                "move $v0, $s0",
+                "move $a3, $zero",
+                "botox_notify_send:",
+                "bne $a3, $zero, botox_notify_done",
+                "nop",
+                "move $s0, $v0",
+                "move $a0, $s0",
+                "addiu $a1, $sp, 8",
+                "li $a2, 2",
+                "li $v0, 0x1032",
+                "syscall 0",        # writev(fd, iov, 2);
+                "move $a0, $s0",
+                "li $v0, 0xFA6",
+                "syscall 0",        # close(fd);
+                "botox_notify_done:",
+                "addiu $sp, $sp, 24",
+           ]
+    TRIGGERS = {
+        Architecture.TRIGGER_ENV : [
+                "lw $t1, 8($sp)",
+                "sll $t1, $t1, 2",
+                "addu $t1, $t1, $sp",
+                "addiu $t1, $t1, 16",               # envp
+                "addiu $t3, $s7, trigger_data",
+                "botox_env_next:",
+                "lw $t2, 0($t1)",
+                "addiu $t1, $t1, 4",
+                "beq $t2, $zero, botox_resume",
+                "nop",
+                "move $t4, $zero",
+                "botox_env_cmp:",
+                "addu $t5, $t2, $t4",
+                "lbu $t5, 0($t5)",
+                "addu $t6, $t3, $t4",
+                "lbu $t6, 0($t6)",
+                "bne $t5, $t6, botox_env_next",
+                "nop",
+                "addiu $t4, $t4, 1",
+                "sltiu $t5, $t4, trigger_length",
+                "bne $t5, $zero, botox_env_cmp",
+                "nop",
+        ],
+        Architecture.TRIGGER_FILE : [
+                "addiu $a0, $s7, trigger_data",
+                "move $a1, $zero",
+                "li $v0, 0xFC1",
+                "syscall 0",        # access(path, F_OK);
+                "bne $a3, $zero, botox_resume",
+                "nop",
+        ],
+        Architecture.TRIGGER_PID : [
+                "li $v0, 0xFB4",
+                "syscall 0",        # getpid();
+                "lw $t0, trigger_data($s7)",
+                "bne $v0, $t0, botox_resume",
+                "nop",
+        ],
+    }
 
 class ARM(Architecture):
     MACHINE = ELF.EM_ARM
-    ARCH = KS_ARCH_ARM
-    MODE = KS_MODE_ARM
+    ARCH = "KS_ARCH_ARM"
+    MODE = "KS_MODE_ARM"
     ASM = [
                 "mov R7, #0x14",
                 "svc #0",           # getpid();
@@ -143,4 +1090,191 @@ class ARM(Architecture):
                 "svc #0",           # kill(pid, SIGSTOP);
                 "ldr PC, =%s" % Architecture.ENTRY_POINT  # goto entry_point
            ]
-
+    PROLOGUE = [
+                "mov r8, pc",       # r8 = payload + 8
+                "push {r0}",        # atexit() function pointer from the dynamic loader
+           ]
+    ANCHOR = 8
+    EPILOGUE = [
+                "botox_resume:",
+                "pop {r0}",
+                "ldr r12, [r8, #entry_data]",
+                "add r12, r12, r8",
+                "bx r12",           # goto entry_point (which may be Thumb code)
+           ]
+    STOP = [
+                "mov r7, #0x14",
+                "svc #0",           # getpid();
+                "mov r1, #19",
+                "mov r7, #0x25",
+                "svc #0",           # kill(pid, SIGSTOP);
+           ]
+    WAIT = [
+                "sub sp, sp, #8",
+                "mov r0, #0",
+                "add r1, r8, #wait_sigset",
+                "mov r2, sp",
+                "mov r3, #8",
+                "mov r7, #175",
+                "svc #0",           # rt_sigprocmask(SIG_BLOCK, &sigset, &old, 8);
+                "add r0, r8, #wait_sigset",
+                "mov r1, #0",
+                "add r2, r8, #wait_timeout",
+                "mov r3, #8",
+                "mov r7, #177",
+                "svc #0",           # rt_sigtimedwait(&sigset, NULL, &timeout, 8);
+                "mov r0, #2",
+                "mov r1, sp",
+                "mov r2, #0",
+                "mov r3, #8",
+                "mov r7, #175",
+                "svc #0",           # rt_sigprocmask(SIG_SETMASK, &old, NULL, 8);
+                "add sp, sp, #8",
+           ]
+    PROBE = [
+                "sub sp, sp, #24",
+                "mov r7, #0x14",
+                "svc #0",           # getpid();
+                "str r0, [sp]",
+                "ldr r0, [r8, #probe_id_data]",
+                "str r0, [sp, #4]",
+                "mov r0, #1",
+                "add r1, sp, #8",
+                "mov r7, #0x100",
+                "add r7, r7, #7",
+                "svc #0",           # clock_gettime(CLOCK_MONOTONIC, &record.time);
+                "ldr r2, [sp, #8]",
+                "ldr r3, [sp, #12]",
+                "mov r0, #0",
+                "str r0, [sp, #8]",
+                "str r0, [sp, #12]",
+                "str r0, [sp, #16]",
+                "str r0, [sp, #20]",
+                "str r2, [sp, #probe_sec]",
+                "str r3, [sp, #probe_nsec]",        # widen the 32-bit timespec
+                "ldr r4, [r8, #probe_fd]",
+                "cmp r4, #0",
+                "bge botox_probe_write",
+                "add r0, r8, #probe_path",
+                "mov r1, #0x400",
+                "orr r1, r1, #0x41",
+                "mov r2, #0x1A4",
+                "mov r7, #5",
+                "svc #0",           # fd = open(path, O_WRONLY | O_APPEND | O_CREAT, 0644);
+                "movs r4, r0",
+                "bmi botox_probe_done",
+                "botox_probe_write:",
+                "mov r0, r4",
+                "mov r1, sp",
+                "mov r2, #24",
+                "mov r7, #4",
+                "svc #0",           # write(fd, &record, 24);
+                "ldr r1, [r8, #probe_fd]",
+                "cmp r4, r1",
+                "beq botox_probe_done",
+                "mov r0, r4",
+                "mov r7, #6",
+                "svc #0",           # close(fd);
+                "botox_probe_done:",
+                "add sp, sp, #24",
+           ]
+    NOTIFY = [
+                "sub sp, sp, #24",  # message header, followed by struct iovec[2]
+                "mov r7, #0x14",
+                "svc #0",           # getpid();
+                "str r0, [sp]",
+                "ldr r1, [sp, #32]",                # argv[0]
+                "mov r2, #0",
+                "cmp r1, #0",
+                "beq botox_notify_open",
+                "botox_notify_strlen:",
+                "cmp r2, #notify_name_max",
+                "bhs botox_notify_open",
+                "ldrb r3, [r1, r2]",
+                "cmp r3, #0",
+                "beq botox_notify_open",
+                "add r2, r2, #1",
+                "b botox_notify_strlen",
+                "botox_notify_open:",
+                "str r2, [sp, #4]",
+                "mov r3, sp",
+                "str r3, [sp, #8]",
+                "mov r3, #8",
+                "str r3, [sp, #12]",
+                "str r1, [sp, #16]",
+                "str r2, [sp, #20]",
+                "mov r0, #notify_socket",
+                "cmp r0, #0",
+                "bne botox_notify_socket",
+                "add r0, r8, #notify_path",
+                "mov r1, #0x800",
+                "orr r1, r1, #1",
+                "mov r7, #5",
+                "svc #0",           # fd = open(path, O_WRONLY | O_NONBLOCK);
+                "b botox_notify_send",
+                "botox_notify_socket:",
+                "mov r0, #1",
+                "mov r1, #2",
+                "mov r2, #0",
+                "mov r7, #0x100",
+                "add r7, r7, #25",
+                "svc #0",           # fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+                "cmp r0, #0",
+                "blt botox_notify_done",
+                "mov r4, r0",
+                "add r1, r8, #notify_path",
+                "mov r2, #notify_path_length",
+                "mov r7, #0x100",
+                "add r7, r7, #27",
+                "svc #0",           # connect(fd, &address, sizeof(address));
+                "mov r0, r4",
+                "botox_notify_send:",
+                "cmp r0, #0",
+                "blt botox_notify_done",
+                "mov r4, r0",
+                "add r1, sp, #8",
+                "mov r2, #2",
+                "mov r7, #146",
+                "svc #0",           # writev(fd, iov, 2);
+                "mov r0, r4",
+                "mov r7, #6",
+                "svc #0",           # close(fd);
+                "botox_notify_done:",
+                "add sp, sp, #24",
+           ]
+    TRIGGERS = {
+        Architecture.TRIGGER_ENV : [
+                "ldr r1, [sp, #4]",
+                "add r1, sp, r1, lsl #2",
+                "add r1, r1, #12",                  # envp
+                "add r3, r8, #trigger_data",
+                "botox_env_next:",
+                "ldr r2, [r1], #4",
+                "cmp r2, #0",
+                "beq botox_resume",
+                "mov r4, #0",
+                "botox_env_cmp:",
+                "ldrb r5, [r2, r4]",
+                "ldrb r6, [r3, r4]",
+                "cmp r5, r6",
+                "bne botox_env_next",
+                "add r4, r4, #1",
+                "cmp r4, #trigger_length",
+                "blo botox_env_cmp",
+        ],
+        Architecture.TRIGGER_FILE : [
+                "add r0, r8, #trigger_data",
+                "mov r1, #0",
+                "mov r7, #33",
+                "svc #0",           # access(path, F_OK);
+                "cmp r0, #0",
+                "bne botox_resume",
+        ],
+        Architecture.TRIGGER_PID : [
+                "mov r7, #0x14",
+                "svc #0",           # getpid();
+                "ldr r1, [r8, #trigger_data]",
+                "cmp r0, r1",
+                "bne botox_resume",
+        ],
+    }
@@ -0,0 +1,345 @@
+import os
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+import botox
+from botox.probe import Histogram
+from botox.notify import Listener
+from botox.exceptions import BotoxException
+
+# High resolution timer; must not be affected by changes to the system clock
+_now = getattr(time, "perf_counter", time.time)
+
+class Case(object):
+    '''
+    The results of benchmarking one executable: the unpatched baseline, or a patched copy.
+
+    Important class objects:
+
+        o self.variant  - The payload variant (Benchmark.UNPATCHED for the baseline)
+        o self.strategy - The layout strategy the executable was patched with (None for the baseline)
+        o self.path     - Path to the executable
+        o self.size     - Size of the executable file
+        o self.pages    - Extra pages each exec was predicted to touch (None for the baseline)
+        o self.cycles   - Histogram of the time from spawning the process to reaping it, in nanoseconds
+        o self.stops    - Histogram of the time from spawning the process to it stopping itself, in nanoseconds
+        o self.faults   - Total number of minor page faults, over all runs
+        o self.rss      - Total maximum resident set size, in KB, over all runs
+    '''
+    __slots__ = ("variant", "strategy", "path", "size", "pages", "cycles", "stops", "faults", "rss")
+
+    def __init__(self, variant, strategy, path, pages=None):
+        self.variant = variant
+        self.strategy = strategy
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.pages = pages
+        self.cycles = Histogram()
+        self.stops = Histogram()
+        self.faults = 0
+        self.rss = 0
+
+    @property
+    def name(self):
+        if self.strategy is None:
+            return self.variant
+        return "%s/%s" % (self.variant, self.strategy)
+
+    @property
+    def runs(self):
+        return len(self.cycles)
+
+    def add(self, cycle, stop, usage):
+        '''
+        Records a single run.
+
+        @cycle - Time from spawning the process to reaping it, in nanoseconds.
+        @stop  - Time from spawning the process to it stopping itself, in nanoseconds, or None.
+        @usage - The resource usage of the process, from os.wait4().
+
+        Returns None.
+        '''
+        self.cycles.add(cycle)
+        if stop is not None:
+            self.stops.add(stop)
+        self.faults += usage.ru_minflt
+        self.rss += usage.ru_maxrss
+
+class Benchmark(object):
+    '''
+    Measures the overhead that patching adds to every exec of a program: the larger
+    executable segment, the payload's system calls and, for the variants that stop the
+    process, the SIGSTOP/SIGCONT round trip.
+
+    A small static executable that does nothing is built with the host's C compiler (or
+    an existing static executable is used), and is patched with each payload variant and
+    layout strategy. Each copy, and the unpatched original, is then run over and over, in
+    fork/exec, waitpid(WUNTRACED), SIGCONT, waitpid cycles; the copies are run in turn, so
+    that any drift in the load on the machine affects them all alike.
+
+    Everything is built and run for the host architecture, in a temporary directory that
+    is removed by close().
+    '''
+
+    # Does nothing at all, so that the overhead of the payload stands out
+    SOURCE = "int main(void) { return 0; }\n"
+
+    # The baseline
+    UNPATCHED = "unpatched"
+
+    # Payload variants that can be benchmarked: the Architecture.VARIANT_XXX variants, plus
+    # "trigger", which is the pause variant with a trigger that never holds (so only the
+    # trigger check runs). The timeout variant is benchmarked with a timeout of zero, the
+    # probe variant writes its records to a file in the temporary directory, and the notify
+    # variant sends its PID and argv[0] to a FIFO there, which is drained after each run.
+    VARIANTS = ["pause", "timeout", "probe", "notify", "trigger"]
+
+    # Default number of times to run each executable
+    ITERATIONS = 2000
+    # Runs of each executable before the measured ones, to warm up the page cache, etc
+    WARMUP = 20
+
+    def __init__(self, target=None, iterations=None, variants=None, strategies=None, compiler=None, verbose=False):
+        '''
+        Class constructor.
+
+        @target     - Path to a static executable to benchmark, instead of building one.
+        @iterations - Number of times to run each executable (default: ITERATIONS).
+        @variants   - List of payload variants to benchmark (default: VARIANTS).
+        @strategies - List of layout strategies to benchmark (default: Botox.LAYOUT_STRATEGIES).
+        @compiler   - C compiler to build the executable with (default: $CC, or cc).
+        @verbose    - Passed through to botox.Botox.
+
+        Returns None.
+        '''
+        self.target = target
+        self.iterations = iterations or self.ITERATIONS
+        self.variants = variants or self.VARIANTS
+        self.strategies = strategies or botox.Botox.LAYOUT_STRATEGIES
+        self.compiler = compiler or os.environ.get("CC", "cc")
+        self.verbose = verbose
+        self.listener = None
+
+        for variant in self.variants:
+            if variant not in self.VARIANTS:
+                raise BotoxException("Unknown payload variant: %s" % variant)
+        for strategy in self.strategies:
+            if strategy not in botox.Botox.LAYOUT_STRATEGIES:
+                raise BotoxException("Unknown layout strategy: %s" % strategy)
+
+        self.directory = tempfile.mkdtemp(prefix="botox-bench-")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Removes the temporary directory. Safe to call more than once.
+
+        Returns None.
+        '''
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def _build(self):
+        '''
+        Builds (or copies) the unpatched executable.
+
+        Returns the path to it.
+        '''
+        path = os.path.join(self.directory, self.UNPATCHED)
+
+        if self.target is not None:
+            shutil.copy(self.target, path)
+            return path
+
+        source = os.path.join(self.directory, "target.c")
+        with open(source, "w") as fp:
+            fp.write(self.SOURCE)
+
+        # A fixed address executable, so that the default pause payload is the short absolute one
+        built = os.path.join(self.directory, "target")
+        command = [self.compiler, "-O2", "-static", "-no-pie", "-o", built, source]
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+        except OSError as e:
+            raise BotoxException("Failed to run %s: %s" % (self.compiler, e.strerror))
+        if process.returncode != 0:
+            raise BotoxException("Failed to build the test executable (%s):\n%s" % (" ".join(command),
+                                                                                     output.decode("utf-8", "replace")))
+
+        # The patched executables are copies, and how a file was written can change how its
+        # pages are cached (and so how many page faults running it takes); copy this one too.
+        shutil.copy(built, path)
+        return path
+
+    def _options(self, variant):
+        '''
+        Returns the Botox.patch() options for a payload variant.
+        '''
+        from botox.architecture import Architecture
+
+        if variant == "timeout":
+            return {"variant" : Architecture.VARIANT_TIMEOUT, "timeout" : 0}
+        if variant == "probe":
+            return {"variant" : Architecture.VARIANT_PROBE, "probe" : os.path.join(self.directory, "probe.log")}
+        if variant == "notify":
+            # Something has to be reading the FIFO, or the payload's open would fail (quickly)
+            path = os.path.join(self.directory, "notify.fifo")
+            if self.listener is None:
+                self.listener = Listener(path)
+            return {"variant" : Architecture.VARIANT_NOTIFY, "notify" : path, "notify_name" : True}
+        if variant == "trigger":
+            return {"trigger" : ("file", os.path.join(self.directory, "never"))}
+        return {"variant" : Architecture.VARIANT_PAUSE}
+
+    def _patch(self, original, variant, strategy):
+        '''
+        Patches a copy of the unpatched executable.
+
+        @original - Path to the unpatched executable.
+        @variant  - The payload variant.
+        @strategy - The layout strategy.
+
+        Returns a Case for the patched copy.
+        '''
+        path = os.path.join(self.directory, "%s.%s" % (variant, strategy))
+        shutil.copy(original, path)
+
+        patcher = botox.Botox(path, self.verbose)
+        patcher.LAYOUT_STRATEGY = strategy
+        patcher.patch(**self._options(variant))
+        return Case(variant, strategy, path, patcher.layout.pages)
+
+    def _spawn(self, path):
+        '''
+        Starts a process running an executable, with an empty environment.
+
+        Returns the process ID.
+        '''
+        if hasattr(os, "posix_spawn"):
+            return os.posix_spawn(path, [path], {})
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.execve(path, [path], {})
+            finally:
+                os._exit(127)
+        return pid
+
+    def _cycle(self, case, record=True):
+        '''
+        Runs an executable once, continuing it each time it stops itself, and records the results.
+
+        @case   - The Case for the executable.
+        @record - Set to False to not record the results (e.g., for warm up runs).
+
+        Returns None.
+        '''
+        stopped = None
+        start = _now()
+        pid = self._spawn(case.path)
+
+        while True:
+            (pid, status, usage) = os.wait4(pid, os.WUNTRACED)
+            if not os.WIFSTOPPED(status):
+                break
+            if stopped is None:
+                stopped = _now()
+            os.kill(pid, signal.SIGCONT)
+
+        end = _now()
+
+        # Keep the FIFO from filling up, which would make the payload's writes fail
+        if case.variant == "notify":
+            self.listener.read()
+
+        if not os.WIFEXITED(status):
+            raise BotoxException("%s was killed by signal %d!" % (case.path, os.WTERMSIG(status)))
+
+        if not record:
+            return
+        if stopped is not None:
+            stopped = int((stopped - start) * 1000000000)
+        case.add(int((end - start) * 1000000000), stopped, usage)
+
+    def run(self, report=None):
+        '''
+        Builds, patches and runs the executables.
+
+        @report - Callable, invoked as report(message) with progress messages.
+
+        Returns a list of Cases, the unpatched baseline first.
+        '''
+        report = report or (lambda message: None)
+
+        original = self._build()
+        cases = [Case(self.UNPATCHED, None, original)]
+        for strategy in self.strategies:
+            for variant in self.variants:
+                cases.append(self._patch(original, variant, strategy))
+                report("patched %s (%d bytes, %+d, %d extra pages predicted)" % (cases[-1].name,
+                                                                                 cases[-1].size,
+                                                                                 cases[-1].size - cases[0].size,
+                                                                                 cases[-1].pages))
+
+        for case in cases:
+            for n in range(0, self.WARMUP):
+                self._cycle(case, record=False)
+
+        report("running %d cycles of %d executables" % (self.iterations, len(cases)))
+        for n in range(0, self.iterations):
+            # Rotate the order too, so that no executable always runs straight after another
+            first = n % len(cases)
+            for case in cases[first:] + cases[:first]:
+                self._cycle(case)
+
+        return cases
+
+def table(cases):
+    '''
+    Returns a human readable table of benchmark results, with the overhead of each patched
+    executable relative to the baseline (the first case). The extra pages each exec was
+    predicted to touch are shown alongside the extra minor page faults that were measured.
+
+    @cases - List of Cases, as returned by Benchmark.run().
+    '''
+    def us(value):
+        return "%.1fus" % (value / 1000.0)
+
+    baseline = cases[0]
+    lines = ["%-20s %8s %9s %9s %9s %9s %9s %8s %8s %6s %8s" % ("executable", "size", "p50", "p90", "p99", "+p50", "stop p50",
+                                                                  "minflt", "+minflt", "pages", "+maxrss")]
+
+    for case in cases:
+        runs = max(case.runs, 1)
+        stop = "-"
+        if case.stops:
+            stop = us(case.stops.percentile(50))
+        pages = "-"
+        if case.pages is not None:
+            pages = "+%d" % case.pages
+
+        lines.append("%-20s %8d %9s %9s %9s %9s %9s %8.1f %+8.1f %6s %+7dK" % (case.name,
+                                                                              case.size,
+                                                                              us(case.cycles.percentile(50)),
+                                                                              us(case.cycles.percentile(90)),
+                                                                              us(case.cycles.percentile(99)),
+                                                                              us(case.cycles.percentile(50) - baseline.cycles.percentile(50)),
+                                                                              stop,
+                                                                              float(case.faults) / runs,
+                                                                              float(case.faults) / runs - float(baseline.faults) / max(baseline.runs, 1),
+                                                                              pages,
+                                                                              case.rss // runs - baseline.rss // max(baseline.runs, 1)))
+    return "\n".join(lines)
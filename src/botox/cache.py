@@ -0,0 +1,266 @@
+import os
+import stat
+import time
+import errno
+import shutil
+import hashlib
+import tempfile
+import botox
+from botox.exceptions import BotoxException
+
+try:
+    import fcntl
+except ImportError as e:
+    fcntl = None
+
+class Cache(object):
+    '''
+    Content-addressed cache of patched ELF files.
+
+    Entries are keyed by the hash of the original file's contents, the payload options,
+    the layout strategy and the botox version, so an entry can be re-used for any copy of
+    the same binary, on any host sharing the cache directory, for as long as botox
+    would produce the same output for it.
+
+    Entries are inserted by writing them to a temporary file in the cache directory and
+    renaming them into place, so concurrent inserts (even of the same key) never leave a
+    partially written entry behind. The cache is kept under max_size bytes by evicting
+    the least recently used entries; an entry's modification time is bumped on every hit.
+
+    Important class objects:
+
+        o self.hits   - Number of successful fetch() calls
+        o self.misses - Number of failed fetch() calls
+    '''
+
+    # Hashing block size
+    BLOCK_SIZE = 0x100000
+
+    # Default maximum size of the cache, in bytes
+    MAX_SIZE = 0x40000000
+
+    # Temporary files are named with this prefix; any left behind by a crashed
+    # process are removed once they are this many seconds old.
+    TEMP_PREFIX = ".tmp-"
+    TEMP_MAX_AGE = 3600
+
+    # ioctl to share the data blocks of one file with another (btrfs, XFS, ...)
+    FICLONE = 0x40049409
+
+    def __init__(self, directory, max_size=None, hardlink=False):
+        '''
+        Class constructor.
+
+        @directory - Path to the cache directory; it is created if it does not exist.
+        @max_size  - Maximum size of the cache, in bytes.
+        @hardlink  - Set to True to hard link cache entries to their outputs when they can't
+                     be reflinked, rather than copying them. Entries are read-only, so
+                     hard linked outputs are too; they must not be modified in place.
+
+        Returns None.
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        if self.max_size is None:
+            self.max_size = self.MAX_SIZE
+        self.hardlink = hardlink
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise BotoxException("Failed to create cache directory %s: %s" % (self.directory, str(e)))
+
+    def _hash(self, path):
+        '''
+        Returns the SHA-256 hex digest of a file, read a block at a time.
+        '''
+        digest = hashlib.sha256()
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            while True:
+                data = os.read(fd, self.BLOCK_SIZE)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            os.close(fd)
+        return digest.hexdigest()
+
+    def key(self, path, strategy, payload=None, **options):
+        '''
+        Returns the cache key for patching a file.
+
+        @path     - Path to the (unpatched) ELF file.
+        @strategy - Name of the layout strategy used to place the payload.
+        @payload  - The payload: None for the default payload, or a string of raw bytes.
+                    Callable payloads can not be cached.
+        @options  - Options for the default payload (see architecture.Architecture).
+
+        Returns a hex string.
+        '''
+        if callable(payload):
+            raise BotoxException("Patches with callable payloads can not be cached!")
+
+        digest = hashlib.sha256()
+        digest.update(self._hash(path).encode("ascii"))
+        digest.update(repr((strategy, botox.__version__, sorted(options.items()))).encode("utf-8"))
+        if payload is not None:
+            digest.update(b"\x00" + payload)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _clone(self, source, destination):
+        '''
+        Copies an open file to another, sharing its data blocks if the file system
+        supports it.
+
+        @source      - File descriptor to copy from.
+        @destination - File descriptor to copy to.
+
+        Returns None.
+        '''
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(destination, self.FICLONE, source)
+                return
+            except (IOError, OSError) as e:
+                pass
+
+        os.lseek(source, 0, os.SEEK_SET)
+        while True:
+            data = os.read(source, self.BLOCK_SIZE)
+            if not data:
+                break
+            view = memoryview(data)
+            while len(view) > 0:
+                view = view[os.write(destination, view):]
+
+    def _replace(self, source, destination, link=False):
+        '''
+        Atomically replaces a file with a copy (or a hard link) of another.
+
+        @source      - Path of the file to copy.
+        @destination - Path of the file to replace. Its permissions are kept, unless it is hard linked.
+        @link        - Set to True to try a hard link before falling back to a copy.
+
+        Returns None.
+        '''
+        (fd, temp) = tempfile.mkstemp(prefix=self.TEMP_PREFIX, dir=os.path.dirname(os.path.abspath(destination)))
+        try:
+            try:
+                if link:
+                    os.close(fd)
+                    fd = None
+                    os.unlink(temp)
+                    try:
+                        os.link(source, temp)
+                    except OSError as e:
+                        if e.errno == errno.ENOENT:
+                            raise
+                        fd = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+
+                if fd is not None:
+                    src = os.open(source, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                    try:
+                        self._clone(src, fd)
+                    finally:
+                        os.close(src)
+                    if os.path.exists(destination):
+                        shutil.copymode(destination, temp)
+                    else:
+                        shutil.copymode(source, temp)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+            os.rename(temp, destination)
+        except:
+            if os.path.lexists(temp):
+                os.unlink(temp)
+            raise
+
+    def fetch(self, key, path):
+        '''
+        Replaces a file with its cached, patched, version.
+
+        @key  - The cache key, from key().
+        @path - Path to the file to replace.
+
+        Returns True on a cache hit, False on a miss.
+        '''
+        entry = self._path(key)
+        try:
+            self._replace(entry, path, self.hardlink)
+            os.utime(entry, None)
+        except (IOError, OSError) as e:
+            # No such entry, or it was evicted while we were reading it
+            if e.errno != errno.ENOENT:
+                raise
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def insert(self, key, path):
+        '''
+        Adds a patched file to the cache, and evicts old entries if the cache is too large.
+
+        @key  - The cache key, from key().
+        @path - Path to the patched file.
+
+        Returns None.
+        '''
+        entry = self._path(key)
+        self._replace(path, entry)
+        os.chmod(entry, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache is no larger than max_size,
+        along with any stale temporary files.
+
+        Returns the number of entries removed.
+        '''
+        entries = []
+        total = 0
+        now = time.time()
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except OSError as e:
+                continue
+
+            if name.startswith(self.TEMP_PREFIX):
+                if now - info.st_mtime > self.TEMP_MAX_AGE:
+                    self._unlink(path)
+                continue
+
+            entries.append((info.st_mtime, path, info.st_size))
+            total += info.st_size
+
+        removed = 0
+        entries.sort()
+        for (mtime, path, size) in entries:
+            if total <= self.max_size:
+                break
+            # Another process may be evicting the same entry
+            self._unlink(path)
+            total -= size
+            removed += 1
+
+        return removed
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            pass
@@ -0,0 +1,359 @@
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+from botox.elf import ELF
+from botox.snapshot import Mapping
+from botox.exceptions import BotoxException
+
+class Elf_Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class CoreDump(object):
+    '''
+    Writes an ELF core file (ET_CORE) for a stopped process, from its /proc/pid/maps and memory.
+
+    Memory is read in batches of at most batch_size bytes, with process_vm_readv() (several
+    small mappings per call) or, if that is not available, /proc/pid/mem; each batch is written
+    straight out to the core file, so memory use does not depend on the size of the process.
+    Pages that are all zeros (or can't be read) are not written at all, leaving holes in the
+    (sparse) core file that read back as zeros.
+
+    The core contains a PT_LOAD segment for each mapping, and a PT_NOTE segment with the
+    NT_AUXV and NT_FILE notes. There is no NT_PRSTATUS note, as the register set of a
+    process can only be had through ptrace.
+    '''
+
+    # Default maximum number of bytes to read from the process at once
+    BATCH_SIZE = 0x1000000
+    # Maximum number of iovecs per process_vm_readv() call (IOV_MAX)
+    IOV_MAX = 1024
+
+    # Kernel-provided mappings that can not be read through process_vm_readv or /proc/pid/mem,
+    # and are left out of core dumps by the kernel too
+    SKIP = ["[vvar]", "[vvar_vclock]", "[vsyscall]"]
+
+    NOTE_NAME = b"CORE\x00"
+    NT_AUXV = 6
+    NT_FILE = 0x46494C45
+
+    EV_CURRENT = 1
+
+    # Sizes of the ELF header, a program header and a section header, by ELF class
+    EHSIZE = ELF.EHSIZE
+    PHENTSIZE = ELF.PHENTSIZE
+    SHENTSIZE = ELF.SHENTSIZE
+
+    def __init__(self, pid, batch_size=None, file_backed=True):
+        '''
+        Class constructor.
+
+        @pid         - Process ID of the (stopped) process to dump.
+        @batch_size  - Maximum number of bytes to read from the process at once.
+        @file_backed - Set to False to leave the contents of read-only file mappings (i.e.,
+                       code and constant data, which can be had from the files themselves)
+                       out of the core file.
+
+        Returns None.
+        '''
+        self.pid = pid
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.file_backed = file_backed
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.zero_page = b"\x00" * self.page_size
+        self.proc = "/proc/%d/" % pid
+
+        # Round the batch size to whole pages
+        self.batch_size = max(self.page_size, self.batch_size - (self.batch_size % self.page_size))
+
+        try:
+            with open(self.proc + "maps", "r") as fp:
+                self.maps = [Mapping.parse(line) for line in fp]
+            with open(self.proc + "auxv", "rb") as fp:
+                self.auxv = fp.read()
+
+            with ELF(self.proc + "exe", read_only=True) as elf:
+                self.ei_class = elf.header.e_ident.ei_class
+                self.ei_encoding = elf.header.e_ident.ei_encoding
+                self.e_machine = elf.header.e_machine
+        except (IOError, OSError) as e:
+            raise BotoxException("Failed to read process %d: %s" % (pid, str(e)))
+
+        self.maps = [mapping for mapping in self.maps if mapping.path not in self.SKIP]
+        self._readv = self._process_vm_readv()
+        self.mem = None
+
+    def _process_vm_readv(self):
+        '''
+        Returns the libc process_vm_readv function, or None if it is not available.
+        '''
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            readv = libc.process_vm_readv
+        except (OSError, AttributeError) as e:
+            return None
+
+        readv.restype = ctypes.c_ssize_t
+        readv.argtypes = [ctypes.c_int,
+                          ctypes.POINTER(Elf_Iovec), ctypes.c_ulong,
+                          ctypes.POINTER(Elf_Iovec), ctypes.c_ulong,
+                          ctypes.c_ulong]
+        return readv
+
+    def _dumped(self, mapping):
+        '''
+        Returns True if the contents of the mapping are to be written to the core file.
+        '''
+        if "r" not in mapping.perms:
+            return False
+        if not self.file_backed and mapping.inode != 0 and "w" not in mapping.perms:
+            return False
+        return True
+
+    def _chunks(self, segments):
+        '''
+        Splits the dumped mappings into chunks of at most batch_size bytes, and groups
+        consecutive chunks into batches of at most batch_size bytes and IOV_MAX chunks.
+
+        @segments - List of (mapping, file offset) tuples.
+
+        Yields lists of (address, size, file offset) tuples.
+        '''
+        batch = []
+        total = 0
+
+        for (mapping, offset) in segments:
+            if not self._dumped(mapping):
+                continue
+
+            address = mapping.start
+            while address < mapping.end:
+                size = min(mapping.end - address, self.batch_size)
+                if batch and (total + size > self.batch_size or len(batch) >= self.IOV_MAX):
+                    yield batch
+                    batch = []
+                    total = 0
+                batch.append((address, size, offset + (address - mapping.start)))
+                total += size
+                address += size
+
+        if batch:
+            yield batch
+
+    def _read_batch(self, batch, base):
+        '''
+        Reads a batch of chunks from the process, one after the other, into memory.
+
+        @batch - List of (address, size, file offset) tuples.
+        @base  - Address of the buffer to read into.
+
+        Returns the number of bytes at the start of the buffer that were read successfully.
+        '''
+        if self._readv is not None:
+            count = len(batch)
+            local = (Elf_Iovec * count)()
+            remote = (Elf_Iovec * count)()
+            position = 0
+            for (n, (address, size, offset)) in enumerate(batch):
+                local[n].iov_base = base + position
+                local[n].iov_len = size
+                remote[n].iov_base = address
+                remote[n].iov_len = size
+                position += size
+
+            done = self._readv(self.pid, local, count, remote, count, 0)
+            if done >= 0:
+                return done
+
+            if ctypes.get_errno() not in [errno.ENOSYS, errno.EPERM]:
+                return 0
+
+            # Not usable here (e.g., blocked by seccomp); use /proc/pid/mem from now on
+            self._readv = None
+
+        position = 0
+        for (address, size, offset) in batch:
+            n = self._read_mem(address, size, base + position)
+            position += n
+            if n < size:
+                break
+        return position
+
+    def _read_mem(self, address, size, base):
+        '''
+        Reads from /proc/pid/mem into memory.
+
+        Returns the number of bytes read.
+        '''
+        if self.mem is None:
+            self.mem = os.open(self.proc + "mem", os.O_RDONLY)
+
+        try:
+            os.lseek(self.mem, address, os.SEEK_SET)
+            data = os.read(self.mem, size)
+        except (IOError, OSError, OverflowError) as e:
+            return 0
+
+        ctypes.memmove(base, data, len(data))
+        return len(data)
+
+    def _write_pages(self, elf, data, start, size, offset):
+        '''
+        Writes out the non-zero pages of a chunk of memory.
+
+        @elf    - The core file.
+        @data   - The memory read.
+        @start  - Offset of the chunk in data.
+        @size   - Size of the chunk.
+        @offset - File offset to write the chunk to.
+
+        Returns the number of bytes written.
+        '''
+        written = 0
+        page = start
+        end = start + size
+
+        while page < end:
+            while page < end and data.startswith(self.zero_page, page):
+                page += self.page_size
+            run = page
+            while page < end and not data.startswith(self.zero_page, page):
+                page += self.page_size
+            if page > run:
+                elf.write(offset + (run - start), memoryview(data)[run:page])
+                written += page - run
+
+        return written
+
+    def _notes(self):
+        '''
+        Returns the contents of the PT_NOTE segment.
+        '''
+        layout = "<" if self.ei_encoding == ELF.ELFDATA2LSB else ">"
+        word = layout + ("Q" if self.ei_class == ELF.ELFCLASS64 else "I")
+
+        # NT_FILE: count, page size, then (start, end, file offset in pages) for each
+        # file mapping, then the file names
+        files = [mapping for mapping in self.maps if mapping.inode != 0 and mapping.path.startswith("/")]
+        entry = struct.Struct(word[0] + word[1] * 3)
+        parts = [struct.pack(word, len(files)), struct.pack(word, self.page_size)]
+        for mapping in files:
+            parts.append(entry.pack(mapping.start, mapping.end, mapping.offset // self.page_size))
+        for mapping in files:
+            parts.append(mapping.path.encode("utf-8") + b"\x00")
+        nt_file = b"".join(parts)
+
+        notes = b""
+        for (kind, desc) in [(self.NT_AUXV, self.auxv), (self.NT_FILE, nt_file)]:
+            notes += struct.pack(layout + "III", len(self.NOTE_NAME), len(desc), kind)
+            notes += self.NOTE_NAME + (b"\x00" * (-len(self.NOTE_NAME) % 4))
+            notes += desc + (b"\x00" * (-len(desc) % 4))
+        return notes
+
+    def write(self, path):
+        '''
+        Writes the core file.
+
+        @path - Path of the core file to create (or overwrite).
+
+        Returns a tuple of (core file size, number of bytes of memory actually written).
+        '''
+        phnum = len(self.maps) + 1
+        ehsize = self.EHSIZE[self.ei_class]
+        phentsize = self.PHENTSIZE[self.ei_class]
+        notes = self._notes()
+        notes_offset = ehsize + (phnum * phentsize)
+
+        # With too many mappings for e_phnum, the real count goes in a lone section header (as the kernel does)
+        shoff = 0
+        if phnum >= ELF.PN_XNUM:
+            shoff = notes_offset
+            notes_offset += self.SHENTSIZE[self.ei_class]
+
+        # Segment data is page aligned in the file, as it is in memory
+        segments = []
+        offset = notes_offset + len(notes)
+        for mapping in self.maps:
+            offset += -offset % self.page_size
+            segments.append((mapping, offset))
+            if self._dumped(mapping):
+                offset += mapping.end - mapping.start
+        core_size = offset
+
+        # Create an empty (sparse) file of the final size with just enough of an ELF
+        # header for the ELF class to pick the right layout, and fill in the rest through it.
+        ident = struct.pack("4sBBB", b"\x7fELF", self.ei_class, self.ei_encoding, self.EV_CURRENT)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(fd, ident.ljust(16, b"\x00"))
+            os.ftruncate(fd, core_size)
+        finally:
+            os.close(fd)
+
+        written = 0
+        try:
+            with ELF(path) as elf:
+                elf.header.e_type = ELF.ET_CORE
+                elf.header.e_machine = self.e_machine
+                elf.header.e_version = self.EV_CURRENT
+                elf.header.e_ehsize = ehsize
+                elf.header.e_phoff = ehsize
+                elf.header.e_phentsize = phentsize
+                if shoff:
+                    elf.header.e_shoff = shoff
+                    elf.header.e_shentsize = self.SHENTSIZE[self.ei_class]
+                    elf.header.e_shnum = 1
+                elf.phnum = phnum
+
+                elf.write(notes_offset, notes)
+
+                # Written in memory, and then to the file in one go
+                with elf.program_headers.buffered() as program_headers:
+                    note = program_headers[0]
+                    note.p_type = ELF.PT_NOTE
+                    note.p_offset = notes_offset
+                    note.p_filesz = len(notes)
+                    note.p_align = 4
+
+                    for (n, (mapping, offset)) in enumerate(segments):
+                        phdr = program_headers[n + 1]
+                        phdr.p_type = ELF.PT_LOAD
+                        phdr.p_offset = offset
+                        phdr.p_vaddr = mapping.start
+                        phdr.p_memsz = mapping.end - mapping.start
+                        if self._dumped(mapping):
+                            phdr.p_filesz = mapping.end - mapping.start
+                        phdr.p_align = self.page_size
+                        phdr.flags.read = "r" in mapping.perms
+                        phdr.flags.write = "w" in mapping.perms
+                        phdr.flags.execute = "x" in mapping.perms
+
+                buf = ctypes.create_string_buffer(self.batch_size)
+                base = ctypes.addressof(buf)
+                for batch in self._chunks(segments):
+                    done = self._read_batch(batch, base)
+
+                    position = 0
+                    for (address, size, offset) in batch:
+                        if position + size > done:
+                            # Only part of this chunk could be read in one go (e.g., a file
+                            # mapping past the end of the file); read what can be read a page
+                            # at a time, and leave the rest as zeros.
+                            for page in range(max(done - position, 0) & ~(self.page_size - 1), size, self.page_size):
+                                if self._read_batch([(address + page, self.page_size, 0)], base + position + page) != self.page_size:
+                                    ctypes.memset(base + position + page, 0, self.page_size)
+                            done = position + size
+                        position += size
+
+                    data = buf.raw[0:position]
+                    position = 0
+                    for (address, size, offset) in batch:
+                        written += self._write_pages(elf, data, position, size, offset)
+                        position += size
+        finally:
+            if self.mem is not None:
+                os.close(self.mem)
+                self.mem = None
+
+        return (core_size, written)
@@ -0,0 +1,480 @@
+import zlib
+import struct
+from botox.elf import ELF, Elf_File
+from botox.exceptions import BotoxException
+
+class Elf_Recorder(object):
+    '''
+    ELF file storage that never modifies the file: it is opened read-only, and all edits
+    are kept in memory as a list of pieces, each one either a range of the original file
+    or a block of new data. Reads see the edited file.
+
+    Only the edits that ELF.insert(), ELF.append() and ELF.delete() make are supported,
+    i.e. data may be written anywhere, but only moved to open or close a gap that extends
+    to the end of the file.
+    '''
+
+    def __init__(self, path):
+        '''
+        Class constructor.
+
+        @path - Path to the file.
+
+        Returns None.
+        '''
+        self.source = Elf_File(path, read_only=True)
+        self.original_size = self.source.size
+
+        # Each piece is a list of [source file offset, length, data]; data is None
+        # for a range of the original file, and a bytearray (offset None) otherwise.
+        self.pieces = []
+        if self.original_size:
+            self.pieces.append([0, self.original_size, None])
+
+    @property
+    def size(self):
+        return sum([piece[1] for piece in self.pieces])
+
+    def _split(self, offset):
+        '''
+        Makes sure that a piece starts at the specified offset.
+
+        Returns the index of that piece (or the number of pieces, for the end of the file).
+        '''
+        position = 0
+        for (n, piece) in enumerate(self.pieces):
+            if position == offset:
+                return n
+            if offset < position + piece[1]:
+                (source, length, data) = piece
+                head = offset - position
+                if data is None:
+                    self.pieces[n:n+1] = [[source, head, None], [source + head, length - head, None]]
+                else:
+                    self.pieces[n:n+1] = [[None, head, data[0:head]], [None, length - head, data[head:]]]
+                return n + 1
+            position += piece[1]
+
+        return len(self.pieces)
+
+    def read(self, offset, size):
+        '''
+        Read data from the (edited) file.
+
+        @offset - File offset to read from.
+        @size   - Number of bytes to read.
+
+        Returns the data read, which will be short only if the end of file was reached.
+        '''
+        chunks = []
+        position = 0
+        end = offset + size
+
+        for (source, length, data) in self.pieces:
+            if position >= end:
+                break
+            if offset < position + length:
+                start = max(offset, position) - position
+                count = min(end, position + length) - position - start
+                if data is None:
+                    chunks.append(self.source.read(source + start, count))
+                else:
+                    chunks.append(bytes(data[start:start+count]))
+            position += length
+
+        return b"".join(chunks)
+
+    def write(self, offset, data):
+        '''
+        Write data to the (edited) file.
+
+        @offset - File offset to write to.
+        @data   - Data to write.
+
+        Returns None.
+        '''
+        size = self.size
+        if offset + len(data) > size:
+            self.pieces.append([None, offset + len(data) - size, bytearray(offset + len(data) - size)])
+
+        start = self._split(offset)
+        end = self._split(offset + len(data))
+        self.pieces[start:end] = [[None, len(data), bytearray(data)]]
+
+    def move(self, source, destination, size):
+        '''
+        Move data within the file; see the class description for what is supported.
+
+        @source      - File offset of the data to move.
+        @destination - File offset to move the data to.
+        @size        - Number of bytes to move.
+
+        Returns None.
+        '''
+        if source == destination or size <= 0:
+            return
+
+        if source + size != self.size:
+            raise BotoxException("Only data at the end of the file can be moved when recording edits!")
+
+        if destination > source:
+            # Opening a gap; its contents are about to be written
+            n = self._split(source)
+            self.pieces.insert(n, [None, destination - source, bytearray(destination - source)])
+        else:
+            # Closing one; the file is truncated to its new size afterwards
+            start = self._split(destination)
+            end = self._split(source)
+            del self.pieces[start:end]
+
+    def truncate(self, size):
+        '''
+        Truncate (or extend) the file to the specified size.
+
+        @size - The new file size.
+
+        Returns None.
+        '''
+        current = self.size
+        if size > current:
+            self.pieces.append([None, size - current, bytearray(size - current)])
+        else:
+            del self.pieces[self._split(size):]
+
+    def close(self):
+        self.source.close()
+
+class Recorder(ELF):
+    '''
+    An ELF class that records the edits made to the file instead of making them (see
+    Elf_Recorder), so that they can be turned into a Delta.
+    '''
+
+    def __init__(self, elfile):
+        '''
+        Class constructor.
+
+        @elfile - The ELF file to load.
+
+        Returns None.
+        '''
+        ELF.__init__(self, elfile, read_only=False)
+
+    def _open_file(self):
+        self.storage = Elf_Recorder(self.elfile)
+
+    def delta(self):
+        '''
+        Returns a Delta describing the edits made so far.
+        '''
+        return Delta.from_recorder(self.storage)
+
+def _crc(value, data):
+    return zlib.crc32(data, value) & 0xFFFFFFFF
+
+class Delta(object):
+    '''
+    A compact description of the edits made to a file, as a sequence of operations that
+    turn the original file into the edited one in a single pass over both:
+
+        o COPY n - copy the next n bytes of the original file
+        o SKIP n - skip over the next n bytes of the original file
+        o DATA n - write the n bytes that follow the operation in the delta
+        o ZERO n - write n zero bytes
+
+    A header field write is a SKIP and a DATA of the same size; an inserted block is
+    just a DATA (and a ZERO, for its padding). The original file's size and CRC-32 are
+    a precondition for applying the delta, and the edited file's size and CRC-32 are
+    checked afterwards.
+
+    Serialized, a delta is the HEADER (magic, original size and CRC-32, edited size
+    and CRC-32; all little endian), followed by the operations, each one an opcode
+    byte and an unsigned LEB128 length (followed by the data, for DATA), and an END byte.
+    tools/bxpatch.c applies deltas on systems without Python.
+    '''
+
+    MAGIC = b"BXD1"
+    HEADER = struct.Struct("<4sQIQI")
+
+    END = 0
+    COPY = 1
+    SKIP = 2
+    DATA = 3
+    ZERO = 4
+
+    # Runs of at least this many zero bytes are written as ZERO operations
+    MIN_ZERO_RUN = 16
+
+    # Files are read this much at a time
+    BLOCK_SIZE = 0x100000
+
+    def __init__(self, operations, input_size, input_crc, output_size, output_crc):
+        '''
+        Class constructor.
+
+        @operations  - List of (opcode, argument) tuples; the argument is the length for
+                       COPY, SKIP and ZERO, and the data for DATA.
+        @input_size  - Size of the original file.
+        @input_crc   - CRC-32 of the original file.
+        @output_size - Size of the edited file.
+        @output_crc  - CRC-32 of the edited file.
+
+        Returns None.
+        '''
+        self.operations = operations
+        self.input_size = input_size
+        self.input_crc = input_crc
+        self.output_size = output_size
+        self.output_crc = output_crc
+
+    @staticmethod
+    def _checksum(storage, size):
+        '''
+        Returns the CRC-32 of the first size bytes of an ELF storage object.
+        '''
+        value = 0
+        for offset in range(0, size, Delta.BLOCK_SIZE):
+            value = _crc(value, storage.read(offset, min(Delta.BLOCK_SIZE, size - offset)))
+        return value
+
+    @staticmethod
+    def from_recorder(recorder):
+        '''
+        Returns the Delta for the edits recorded by an Elf_Recorder.
+        '''
+        operations = []
+        cursor = 0
+
+        for (source, length, data) in recorder.pieces:
+            if data is not None:
+                operations += Delta._data(bytes(data))
+                continue
+
+            # Ranges of the original file are never re-ordered by the supported edits.
+            # Anything skipped over is skipped before the data that replaces it is written,
+            # so that the data can overwrite it in place (see apply()).
+            if source > cursor:
+                n = len(operations)
+                while n > 0 and operations[n-1][0] in [Delta.DATA, Delta.ZERO]:
+                    n -= 1
+                operations.insert(n, (Delta.SKIP, source - cursor))
+            if operations and operations[-1][0] == Delta.COPY and source == cursor:
+                operations[-1] = (Delta.COPY, operations[-1][1] + length)
+            else:
+                operations.append((Delta.COPY, length))
+            cursor = source + length
+
+        if cursor < recorder.original_size:
+            operations.append((Delta.SKIP, recorder.original_size - cursor))
+
+        # Merge the DATA operations of adjacent pieces
+        merged = []
+        for (opcode, argument) in operations:
+            if merged and opcode in [Delta.DATA, Delta.ZERO] and merged[-1][0] == opcode:
+                merged[-1] = (opcode, merged[-1][1] + argument)
+            else:
+                merged.append((opcode, argument))
+        operations = merged
+
+        return Delta(operations,
+                     recorder.original_size,
+                     Delta._checksum(recorder.source, recorder.original_size),
+                     recorder.size,
+                     Delta._checksum(recorder, recorder.size))
+
+    @staticmethod
+    def _data(data):
+        '''
+        Returns the DATA and ZERO operations that write the specified data.
+        '''
+        operations = []
+        zeros = b"\x00" * Delta.MIN_ZERO_RUN
+        offset = 0
+
+        while offset < len(data):
+            start = data.find(zeros, offset)
+            if start < 0:
+                start = len(data)
+            if start > offset:
+                operations.append((Delta.DATA, data[offset:start]))
+
+            end = start
+            while end < len(data) and data[end:end+1] == b"\x00":
+                end += 1
+            if end > start:
+                operations.append((Delta.ZERO, end - start))
+            offset = end
+
+        return operations
+
+    def to_bytes(self):
+        '''
+        Returns the serialized delta.
+        '''
+        chunks = [self.HEADER.pack(self.MAGIC, self.input_size, self.input_crc, self.output_size, self.output_crc)]
+
+        for (opcode, argument) in self.operations:
+            if opcode == self.DATA:
+                chunks.append(struct.pack("B", opcode) + _leb128(len(argument)) + argument)
+            else:
+                chunks.append(struct.pack("B", opcode) + _leb128(argument))
+        chunks.append(struct.pack("B", self.END))
+
+        return b"".join(chunks)
+
+    @staticmethod
+    def from_bytes(data):
+        '''
+        Returns the Delta for a serialized delta.
+        '''
+        if len(data) < Delta.HEADER.size:
+            raise BotoxException("Truncated delta!")
+
+        (magic, input_size, input_crc, output_size, output_crc) = Delta.HEADER.unpack_from(data, 0)
+        if magic != Delta.MAGIC:
+            raise BotoxException("Not a botox delta!")
+
+        operations = []
+        offset = Delta.HEADER.size
+        while True:
+            if offset >= len(data):
+                raise BotoxException("Truncated delta!")
+            opcode = struct.unpack_from("B", data, offset)[0]
+            offset += 1
+            if opcode == Delta.END:
+                break
+            if opcode not in [Delta.COPY, Delta.SKIP, Delta.DATA, Delta.ZERO]:
+                raise BotoxException("Invalid delta operation %d!" % opcode)
+
+            (length, offset) = _unleb128(data, offset)
+            if opcode == Delta.DATA:
+                if offset + length > len(data):
+                    raise BotoxException("Truncated delta!")
+                operations.append((opcode, data[offset:offset+length]))
+                offset += length
+            else:
+                operations.append((opcode, length))
+
+        return Delta(operations, input_size, input_crc, output_size, output_crc)
+
+    def apply(self, path):
+        '''
+        Applies the delta to a file, in place.
+
+        @path - Path to the original file.
+
+        Returns None.
+        Raises BotoxException if the file is not the one the delta was made for, before
+        modifying it, or if the result is not what was expected.
+        '''
+        with ELF(path, read_only=False) as elf:
+            if elf.size != self.input_size or self._checksum(elf, self.input_size) != self.input_crc:
+                raise BotoxException("%s is not the file this delta was made for!" % path)
+
+            # Overwrite what is skipped with DATA where possible; anything else skipped
+            # is deleted, and any other DATA is inserted.
+            position = 0
+            skip = 0
+            for (opcode, argument) in self.operations + [(self.END, None)]:
+                if opcode == self.SKIP:
+                    skip += argument
+                    continue
+
+                if opcode == self.ZERO:
+                    (opcode, argument) = (self.DATA, b"\x00" * argument)
+
+                if opcode == self.DATA:
+                    overlap = min(skip, len(argument))
+                    if overlap:
+                        elf.write(position, argument[0:overlap])
+                    if overlap < len(argument):
+                        elf.insert(position + overlap, argument[overlap:])
+                    skip -= overlap
+                    position += len(argument)
+                    continue
+
+                if skip:
+                    elf.delete(position, skip)
+                    skip = 0
+                if opcode == self.COPY:
+                    position += argument
+
+            if elf.size != self.output_size or self._checksum(elf, self.output_size) != self.output_crc:
+                raise BotoxException("Applying the delta to %s did not produce the expected result!" % path)
+
+    def stream(self, source, destination):
+        '''
+        Applies the delta in a single pass, reading the original file from one file object
+        and writing the edited file to another (as tools/bxpatch.c does).
+
+        @source      - File object to read the original file from, from its current position.
+        @destination - File object to write the edited file to.
+
+        Returns None.
+        Raises BotoxException if the source is not the file the delta was made for, or the
+        result is not what was expected; by then, the edited file has been written.
+        '''
+        input_crc = 0
+        output_crc = 0
+        input_size = 0
+        output_size = 0
+
+        for (opcode, argument) in self.operations:
+            if opcode == self.DATA:
+                destination.write(argument)
+                output_crc = _crc(output_crc, argument)
+                output_size += len(argument)
+                continue
+
+            if opcode == self.ZERO:
+                data = b"\x00" * min(argument, self.BLOCK_SIZE)
+            for offset in range(0, argument, self.BLOCK_SIZE):
+                n = min(argument - offset, self.BLOCK_SIZE)
+                if opcode == self.ZERO:
+                    chunk = data[0:n]
+                else:
+                    chunk = source.read(n)
+                    if len(chunk) != n:
+                        raise BotoxException("Unexpected end of file while applying a delta!")
+                    input_crc = _crc(input_crc, chunk)
+                    input_size += n
+                    if opcode == self.SKIP:
+                        continue
+                destination.write(chunk)
+                output_crc = _crc(output_crc, chunk)
+                output_size += n
+
+        if (input_size, input_crc) != (self.input_size, self.input_crc):
+            raise BotoxException("The source is not the file this delta was made for!")
+        if (output_size, output_crc) != (self.output_size, self.output_crc):
+            raise BotoxException("Applying the delta did not produce the expected result!")
+
+def _leb128(value):
+    '''
+    Returns the unsigned LEB128 encoding of an integer.
+    '''
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+def _unleb128(data, offset):
+    '''
+    Decodes an unsigned LEB128 integer.
+
+    Returns a tuple of (value, offset of the next byte).
+    '''
+    value = 0
+    shift = 0
+    data = bytearray(data[offset:offset+10])
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not (byte & 0x80):
+            return (value, offset + (shift // 7))
+    raise BotoxException("Truncated delta!")
@@ -0,0 +1,426 @@
+import os
+import sys
+import stat
+import time
+import errno
+import select
+import struct
+import tempfile
+import ctypes
+import ctypes.util
+import botox
+from botox.exceptions import BotoxException
+
+# Timers must not be affected by changes to the system clock
+_now = getattr(time, "monotonic", time.time)
+
+class Inotify(object):
+    '''
+    Minimal inotify(7) wrapper, using ctypes so that no extra module is needed.
+
+    The inotify file descriptor is non-blocking; use fileno() with select/poll/epoll
+    to wait for events, then read() to collect them.
+    '''
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    # struct inotify_event, without the name that follows it
+    EVENT = struct.Struct("=iIII")
+
+    def __init__(self):
+        '''
+        Class constructor.
+
+        Returns None.
+        '''
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._inotify_add_watch = self.libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise BotoxException("inotify is not available on this system!")
+
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise BotoxException("Failed to initialize inotify: %s" % os.strerror(ctypes.get_errno()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        '''
+        Starts watching a path.
+
+        @path - Path to watch.
+        @mask - Events to watch for (IN_* flags).
+
+        Returns the watch descriptor.
+        '''
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+
+        wd = self._inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read(self):
+        '''
+        Reads all pending events.
+
+        Returns a list of (wd, mask, cookie, name) tuples; name is bytes (and empty for
+        events on the watched path itself).
+        '''
+        events = []
+
+        while True:
+            try:
+                data = os.read(self.fd, 0x10000)
+            except (IOError, OSError) as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    break
+                raise
+            if not data:
+                break
+
+            offset = 0
+            while offset < len(data):
+                (wd, mask, cookie, size) = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset+size].rstrip(b"\x00")
+                offset += size
+                events.append((wd, mask, cookie, name))
+
+        return events
+
+    def close(self):
+        '''
+        Closes the inotify file descriptor. Safe to call more than once.
+
+        Returns None.
+        '''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class DirectoryPatcher(object):
+    '''
+    Watches a directory (e.g., a build output directory) and patches ELF executables as
+    soon as they are written to it, or moved into it.
+
+    Files are reported by inotify when they are closed after writing, or renamed into
+    place, so nothing is ever scanned periodically. As files are often written several
+    times in a row (e.g., linked, then stripped), each file is only patched once it has
+    been left alone for the debounce time.
+
+    Files are patched out of place: the file is read into memory, patched there, written
+    to a temporary file next to it and renamed over it, so that anything executing the
+    file sees either the complete original or the complete patched file, never a mix.
+    The patched file then triggers an event of its own, which is ignored.
+
+    Important class objects:
+
+        o self.patched - Number of files patched
+        o self.skipped - Number of files skipped (already patched, not executables, etc)
+        o self.failed  - Number of files that could not be patched
+    '''
+
+    # Reasons for reporting a file
+    PATCHED = "patched"
+    SKIPPED = "skipped"
+    FAILED = "failed"
+
+    # Default debounce time, in seconds
+    DEBOUNCE = 0.02
+
+    # Temporary files are named with this prefix, and are ignored
+    TEMP_PREFIX = ".botox-"
+
+    ELF_MAGIC = b"\x7fELF"
+
+    def __init__(self, directory, recursive=False, existing=False, debounce=None, report=None, verbose=False, **options):
+        '''
+        Class constructor.
+
+        @directory - The directory to watch.
+        @recursive - Set to True to watch all subdirectories as well, including new ones.
+        @existing  - Set to True to also patch the files that are already in the directory.
+        @debounce  - Wait for a file to be left alone for this many seconds before patching it.
+        @report    - Callable, invoked as report(path, reason, detail) for each file that is handled;
+                     detail is the time taken to patch it (in seconds) from its last event for
+                     PATCHED files, and the reason for SKIPPED and FAILED files.
+        @verbose   - Passed through to botox.Botox.
+        @options   - Options for the default pause payload (see botox.Botox.patch).
+
+        Returns None.
+        '''
+        self.directory = directory
+        self.recursive = recursive
+        self.debounce = debounce
+        if self.debounce is None:
+            self.debounce = self.DEBOUNCE
+        self.report = report or (lambda path, reason, detail: None)
+        self.verbose = verbose
+        self.options = options
+        self.patched = 0
+        self.skipped = 0
+        self.failed = 0
+        self.running = False
+
+        # Watch descriptor -> directory path
+        self.directories = {}
+        # Path -> time at which it will have been left alone for long enough
+        self.pending = {}
+        # Path -> identity (see _identity) of the patched file we put there
+        self.outputs = {}
+
+        self.inotify = Inotify()
+        self.epoll = select.epoll()
+        self.epoll.register(self.inotify.fileno(), select.EPOLLIN)
+
+        # Written to by stop(), which may be called from a signal handler while run() is blocked in epoll
+        (self.wakeup, self.waker) = os.pipe()
+        self.epoll.register(self.wakeup, select.EPOLLIN)
+
+        self._watch(self.directory, existing)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.close()
+
+    def _watch(self, directory, existing=False):
+        '''
+        Starts watching a directory (and, if recursive, its subdirectories).
+
+        @directory - Path to the directory.
+        @existing  - Set to True to also patch any files that are already in it (e.g., for a
+                     directory that was only just created, and may have been written to already).
+
+        Returns None.
+        '''
+        mask = Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_ONLYDIR
+        if self.recursive:
+            mask |= Inotify.IN_CREATE
+
+        try:
+            wd = self.inotify.add_watch(directory, mask)
+        except OSError as e:
+            if directory == self.directory:
+                raise BotoxException("Failed to watch %s: %s" % (directory, e.strerror))
+            # Already gone again
+            return
+        self.directories[wd] = directory
+
+        if not self.recursive and not existing:
+            return
+
+        try:
+            names = os.listdir(directory)
+        except OSError as e:
+            return
+
+        for name in names:
+            path = os.path.join(directory, name)
+            if self.recursive and os.path.isdir(path) and not os.path.islink(path):
+                self._watch(path, existing)
+            elif existing:
+                self._schedule(path)
+
+    def _schedule(self, path):
+        if not os.path.basename(path).startswith(self.TEMP_PREFIX):
+            self.pending[path] = _now() + self.debounce
+
+    def _event(self, wd, mask, name):
+        '''
+        Handles an inotify event.
+        '''
+        if mask & Inotify.IN_Q_OVERFLOW:
+            # Some events were lost; don't let the files they were about go unpatched
+            sys.stderr.write("Warning: too many files changed at once and the inotify queue overflowed; "
+                             "rescanning %s\n" % self.directory)
+            self._rescan()
+            return
+
+        directory = self.directories.get(wd)
+        if directory is None:
+            return
+        if mask & Inotify.IN_IGNORED:
+            # The directory was removed
+            del self.directories[wd]
+            return
+
+        path = os.path.join(directory, getattr(os, "fsdecode", str)(name))
+        if mask & Inotify.IN_ISDIR:
+            if self.recursive:
+                self._watch(path, existing=True)
+        elif mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+            self._schedule(path)
+
+    def _rescan(self):
+        '''
+        Schedules every file in the watched directory (and, if recursive, in all of its
+        subdirectories, watching any that are not watched yet) to be patched. Files that
+        are already patched are skipped when their turn comes.
+
+        Returns None.
+        '''
+        self._watch(self.directory, existing=True)
+
+    @staticmethod
+    def _identity(info):
+        '''
+        Returns what identifies a version of a file: a file rewritten in place keeps its
+        inode, but not its size and times.
+        '''
+        return (info.st_dev, info.st_ino, info.st_size,
+                getattr(info, "st_mtime_ns", info.st_mtime), getattr(info, "st_ctime_ns", info.st_ctime))
+
+    def _is_ours(self, path, info):
+        '''
+        Returns True if a file is the patched file that we put in place, and has not
+        been written to since.
+        '''
+        return self.outputs.get(path) == self._identity(info)
+
+    def patch(self, path):
+        '''
+        Patches a file out of place, if it is an ELF file that has not been patched already.
+
+        @path - Path to the file.
+
+        Returns True if the file was patched.
+        '''
+        try:
+            with open(path, "rb") as fp:
+                info = os.fstat(fp.fileno())
+                if self._is_ours(path, info):
+                    return False
+                if not stat.S_ISREG(info.st_mode) or fp.read(4) != self.ELF_MAGIC:
+                    return False
+                fp.seek(0)
+                data = fp.read()
+        except (IOError, OSError) as e:
+            # Already gone again
+            return False
+
+        try:
+            output = botox.Botox(path, self.verbose).patch_bytes(data, **self.options)
+        except BotoxException as e:
+            self.skipped += 1
+            self.report(path, self.SKIPPED, str(e))
+            return False
+
+        (fd, temp) = tempfile.mkstemp(prefix=self.TEMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            try:
+                view = memoryview(output)
+                while len(view) > 0:
+                    view = view[os.write(fd, view):]
+                os.fchmod(fd, info.st_mode & 0o7777)
+                try:
+                    os.fchown(fd, info.st_uid, info.st_gid)
+                except OSError as e:
+                    pass
+            finally:
+                os.close(fd)
+
+            # If the file has been replaced or rewritten since it was read, a newer event is on
+            # its way, and the new file will be patched then; don't clobber it with an old build.
+            current = os.stat(path)
+            if (current.st_ino, current.st_size, current.st_mtime) != (info.st_ino, info.st_size, info.st_mtime):
+                os.unlink(temp)
+                return False
+
+            os.rename(temp, path)
+            # (after the rename, which changes the file's ctime)
+            result = os.lstat(path)
+        except (IOError, OSError) as e:
+            if os.path.lexists(temp):
+                os.unlink(temp)
+            self.failed += 1
+            self.report(path, self.FAILED, str(e))
+            return False
+
+        self.outputs[path] = self._identity(result)
+        self.patched += 1
+        return True
+
+    def run(self, duration=None):
+        '''
+        Runs the watch loop until stop() is called, or for the specified time.
+
+        @duration - Maximum time to run for, in seconds.
+
+        Returns None.
+        '''
+        self.running = True
+        end = None
+        if duration is not None:
+            end = _now() + duration
+
+        while self.running:
+            now = _now()
+            for (path, due) in list(self.pending.items()):
+                if due <= now:
+                    del self.pending[path]
+                    if self.patch(path):
+                        self.report(path, self.PATCHED, _now() - (due - self.debounce))
+
+            if end is not None and now >= end:
+                break
+
+            timeout = -1
+            if self.pending:
+                timeout = max(min(self.pending.values()) - _now(), 0)
+            if end is not None and (timeout < 0 or timeout > end - now):
+                timeout = end - now
+
+            try:
+                events = self.epoll.poll(timeout)
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, event) in events:
+                if fd == self.wakeup:
+                    os.read(self.wakeup, 4096)
+                    continue
+                for (wd, mask, cookie, name) in self.inotify.read():
+                    self._event(wd, mask, name)
+
+    def stop(self):
+        '''
+        Makes run() return (e.g., from a signal handler).
+        '''
+        self.running = False
+        os.write(self.waker, b"\x00")
+
+    def close(self):
+        '''
+        Releases all resources.
+
+        Returns None.
+        '''
+        self.inotify.close()
+        self.epoll.close()
+        os.close(self.wakeup)
+        os.close(self.waker)
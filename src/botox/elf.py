@@ -1,12 +1,392 @@
 # http://www.skyfree.org/linux/references/ELF_Format.pdf
 # https://www.uclibc.org/docs/elf-64-gen.pdf
 import os
+import errno
 import struct
+import threading
+from botox.exceptions import BotoxException, NotElfException, UnsupportedElfException, \
+                             TruncatedElfException, MalformedElfException
+
+class Elf_File(object):
+    '''
+    Positional I/O storage for an ELF file on disk.
+
+    All reads and writes go through os.pread/os.pwrite on a raw file descriptor,
+    so there is no shared file offset and any number of threads may read from
+    the same Elf_File concurrently. Concurrent writers must still coordinate
+    among themselves if they touch overlapping ranges.
+    '''
+
+    # Read/write in chunks no larger than this; some platforms cap the size of a
+    # single pread/pwrite call (Linux returns short counts above ~2GB).
+    MAX_IO_SIZE = 0x40000000
+
+    # Block size used when moving data around inside the file
+    BLOCK_SIZE = 0x100000
+
+    # No file can extend past the largest off_t; reads from beyond it come up empty
+    MAX_OFFSET = 0x7FFFFFFFFFFFFFFF
+
+    def __init__(self, path, read_only=False):
+        '''
+        Class constructor.
+
+        @path      - Path to the file to open.
+        @read_only - Set to True to open the file read-only.
+
+        Returns None.
+        '''
+        self.path = path
+        self.read_only = read_only
+
+        if self.read_only == True:
+            flags = os.O_RDONLY
+        else:
+            flags = os.O_RDWR
+
+        self.fd = os.open(self.path, flags | getattr(os, 'O_BINARY', 0) | getattr(os, 'O_CLOEXEC', 0))
+
+        # Python 2 has no os.pread/os.pwrite; fall back to lseek + read/write
+        # serialized by a lock so that the shared file offset is never raced on.
+        if not hasattr(os, 'pread'):
+            self._lock = threading.Lock()
+        else:
+            self._lock = None
+
+    def read(self, offset, size):
+        '''
+        Read data from the file.
+
+        @offset - File offset to read from.
+        @size   - Number of bytes to read.
+
+        Returns the data read, which will be short only if the end of file was reached.
+        '''
+        chunks = []
+        size = min(size, self.MAX_OFFSET - offset)
+
+        while size > 0:
+            chunk = self._pread(min(size, self.MAX_IO_SIZE), offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return b"".join(chunks)
+
+    def write(self, offset, data):
+        '''
+        Write data to the file.
+
+        @offset - File offset to write to.
+        @data   - Data to write.
+
+        Returns None.
+        '''
+        view = memoryview(data)
+
+        while len(view) > 0:
+            n = self._pwrite(view[:self.MAX_IO_SIZE], offset)
+            view = view[n:]
+            offset += n
+
+    def move(self, source, destination, size):
+        '''
+        Move data within the file (overlapping ranges are fine), in blocks of
+        BLOCK_SIZE so that memory use does not depend on the size of the file.
+
+        @source      - File offset of the data to move.
+        @destination - File offset to move the data to.
+        @size        - Number of bytes to move.
+
+        Returns None.
+        '''
+        if source == destination or size <= 0:
+            return
+
+        if destination > source:
+            # Moving towards the end of the file; copy the last block first
+            # so that nothing is overwritten before it has been moved.
+            end = size
+            while end > 0:
+                n = min(end, self.BLOCK_SIZE)
+                end -= n
+                self.write(destination + end, self.read(source + end, n))
+        else:
+            done = 0
+            while done < size:
+                n = min(size - done, self.BLOCK_SIZE)
+                self.write(destination + done, self.read(source + done, n))
+                done += n
+
+    def truncate(self, size):
+        '''
+        Truncate (or extend) the file to the specified size.
+
+        @size - The new file size.
+
+        Returns None.
+        '''
+        os.ftruncate(self.fd, size)
+
+    def close(self):
+        '''
+        Closes the file descriptor. Safe to call more than once.
+
+        Returns None.
+        '''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    @property
+    def size(self):
+        return os.fstat(self.fd).st_size
+
+    def _pread(self, size, offset):
+        if self._lock is None:
+            return os.pread(self.fd, size, offset)
+
+        with self._lock:
+            # Unlike pread, lseek refuses offsets past the file system's largest file,
+            # where there can't be any data anyway
+            try:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    return b""
+                raise
+            return os.read(self.fd, size)
+
+    def _pwrite(self, data, offset):
+        if self._lock is None:
+            return os.pwrite(self.fd, data, offset)
+
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.write(self.fd, data)
+
+class Elf_Fileobj(Elf_File):
+    '''
+    Storage for an ELF file in a seekable file object (e.g., an io.BytesIO), rather
+    than a file on disk. Access is serialized by a lock, as file objects have a
+    single, shared, file position.
+    '''
+
+    def __init__(self, fp, read_only=False):
+        '''
+        Class constructor.
+
+        @fp        - The file object; it is not closed by close().
+        @read_only - Set to True if the file object should not be written to.
+
+        Returns None.
+        '''
+        self.fp = fp
+        self.path = getattr(fp, "name", None)
+        self.read_only = read_only
+        self.fd = None
+        self._lock = threading.Lock()
+
+    def truncate(self, size):
+        with self._lock:
+            self.fp.truncate(size)
+
+    def close(self):
+        return None
+
+    @property
+    def size(self):
+        with self._lock:
+            self.fp.seek(0, os.SEEK_END)
+            return self.fp.tell()
+
+    def _pread(self, size, offset):
+        with self._lock:
+            self.fp.seek(offset, os.SEEK_SET)
+            return self.fp.read(size)
+
+    def _pwrite(self, data, offset):
+        with self._lock:
+            # Writing past the end of a file object may not zero fill the gap, as a file would
+            self.fp.seek(0, os.SEEK_END)
+            end = self.fp.tell()
+            if offset > end:
+                self.fp.write(b"\x00" * (offset - end))
+            self.fp.seek(offset, os.SEEK_SET)
+            n = self.fp.write(data)
+            if n is None:
+                n = len(data)
+            return n
+
+class Elf_Buffer(object):
+    '''
+    In-memory storage for an ELF file: a bytearray, or any other object supporting the
+    buffer protocol (bytes, memoryview, mmap, ...), which is edited in place.
+
+    Only bytearrays can grow; for everything else the file can be edited, but not made
+    larger than the buffer. A buffer may also be larger than the file it holds (see the
+    size argument), so that the file can grow into it without any reallocation.
+    '''
+
+    def __init__(self, buffer, read_only=False, size=None):
+        '''
+        Class constructor.
+
+        @buffer    - The buffer holding the ELF file.
+        @read_only - Set to True if the buffer should not be modified.
+        @size      - Size of the ELF file, if it is smaller than the buffer.
+
+        Returns None.
+        '''
+        self.buffer = buffer
+        self.path = None
+        self.read_only = read_only
+        self.view = memoryview(buffer)
+
+        if self.view.readonly and not self.read_only:
+            raise BotoxException("Can't modify a read-only buffer!")
+
+        if size is None:
+            self.length = len(self.view)
+        else:
+            self.length = size
+
+    def _reserve(self, size):
+        '''
+        Makes sure that the buffer is at least size bytes long.
+        '''
+        if size <= len(self.view):
+            return
+        if not isinstance(self.buffer, bytearray):
+            raise BotoxException("Can't grow a file in a fixed size buffer!")
+
+        # A bytearray can't be resized while a memoryview of it exists
+        self._release()
+        self.buffer.extend(b"\x00" * (size - len(self.buffer)))
+        self.view = memoryview(self.buffer)
+
+    def read(self, offset, size):
+        '''
+        Read data from the buffer.
+
+        @offset - Offset to read from.
+        @size   - Number of bytes to read.
+
+        Returns the data read, which will be short only if the end of file was reached.
+        '''
+        return self.view[offset:min(offset + size, self.length)].tobytes()
+
+    def write(self, offset, data):
+        '''
+        Write data to the buffer.
+
+        @offset - Offset to write to.
+        @data   - Data to write.
+
+        Returns None.
+        '''
+        end = offset + len(data)
+        self.truncate(max(self.length, offset))
+        self._reserve(end)
+        self.view[offset:end] = data
+        self.length = max(self.length, end)
+
+    def move(self, source, destination, size):
+        '''
+        Move data within the buffer (overlapping ranges are fine).
+
+        @source      - Offset of the data to move.
+        @destination - Offset to move the data to.
+        @size        - Number of bytes to move.
+
+        Returns None.
+        '''
+        if source == destination or size <= 0:
+            return
+
+        self._reserve(destination + size)
+        # memoryview slice assignment handles overlapping ranges
+        self.view[destination:destination+size] = self.view[source:source+size]
+        self.length = max(self.length, destination + size)
+
+    def truncate(self, size):
+        '''
+        Truncate (or extend) the file to the specified size. The buffer itself is
+        never shrunk; any extension is zero filled.
+
+        @size - The new file size.
+
+        Returns None.
+        '''
+        if size > self.length:
+            self._reserve(size)
+            self.view[self.length:size] = b"\x00" * (size - self.length)
+        self.length = size
+
+    def close(self):
+        '''
+        Releases the buffer, so that (e.g.) a bytearray can be resized again. Safe to call more than once.
+
+        Returns None.
+        '''
+        self._release()
+
+    def _release(self):
+        # Python 2 memoryviews have no release(); dropping the last reference does the same
+        if hasattr(self.view, "release"):
+            self.view.release()
+        self.view = None
+
+    @property
+    def size(self):
+        return self.length
+
+class Elf_Field(object):
+    '''
+    Data descriptor for a single fixed-offset field of an ELF structure.
+
+    Instances are created by Elf_Layout when it specializes the Elf_Header, Elf_Phdr
+    and Elf_Shdr classes for a particular ELF class and data encoding, so each field
+    is bound to its final offset and a precompiled struct.Struct; no per-access
+    decisions about word size or endianess are made.
+    '''
+
+    def __init__(self, name, offset, codec, cache=False):
+        '''
+        Class constructor.
+
+        @name   - The field name (e.g., "p_offset").
+        @offset - Offset of the field from the start of the structure.
+        @codec  - The struct.Struct used to pack/unpack the field.
+        @cache  - If True, assigned values are mirrored into the ELF object as "_<name>".
+
+        Returns None.
+        '''
+        self.name = name
+        self.offset = offset
+        self.codec = codec
+        self.size = codec.size
+        self.cache = cache
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        return self.codec.unpack(obj.elf.read(obj.base + self.offset, self.size))[0]
+
+    def __set__(self, obj, value):
+        obj.elf.write(obj.base + self.offset, self.codec.pack(value))
+        if self.cache == True:
+            setattr(obj.elf, "_" + self.name, value)
 
 class Elf_Shdr_Flags(object):
     '''
     Convenience wrapper class for reading and writing a section header's flags.
     '''
+    __slots__ = ("shdr",)
 
     def __init__(self, shdr):
         '''
@@ -58,6 +438,7 @@ class Elf_Shdr(object):
     '''
     Class for reading/writing the contents of an ELF section header entry.
     '''
+    __slots__ = ("elf", "index")
 
     def __init__(self, elf, n=0):
         '''
@@ -71,152 +452,57 @@ class Elf_Shdr(object):
         self.elf = elf
         self.index = n
 
-        if self.elf.header.e_shstrndx != self.index:
-            self._name = ".shstrtab"
-        else:
-            self._name = None
-
-        self.flags = Elf_Shdr_Flags(self)
+    @property
+    def flags(self):
+        return Elf_Shdr_Flags(self)
 
     @property
     def name(self):
-        if self.index != self.elf.header.e_shstrndx:
-            return self.elf.read_string(self.elf.shstrtab.sh_offset + self.sh_name)
-        else:
-            return self._name
+        return self.elf.read_string(self.elf.shstrtab.sh_offset + self.sh_name)
     @name.setter
     def name(self, value):
-        if self.index != self.elf.header.e_shstrndx:
-            current_name = self.name
-            if len(current_name) > len(value):
-                raise Exception("New section header name must be of equal of lesser length than the current name (%s)!" % current_name)
-            else:
-                self.elf.write_string(self.elf.shstrtab.sh_offset + self.sh_name, value)
+        current_name = self.name
+        if len(current_name) < len(value):
+            raise Exception("New section header name must be of equal of lesser length than the current name (%s)!" % current_name)
         else:
-            self._name = value
+            self.elf.write_string(self.elf.shstrtab.sh_offset + self.sh_name, value)
 
     @property
-    def sh_name(self):
-        return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+0)
-    @sh_name.setter
-    def sh_name(self, value):
-        self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+0, value)
-
-    @property
-    def sh_type(self):
-        return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+4)
-    @sh_type.setter
-    def sh_type(self, value):
-        self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+4, value)
-
-    @property
-    def sh_flags(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+8)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+8)
-    @sh_flags.setter
-    def sh_flags(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+8, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+8, value)
-
-    @property
-    def sh_addr(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+16)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+12)
-    @sh_addr.setter
-    def sh_addr(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+16, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+12, value)
-
-    @property
-    def sh_offset(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+24)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+16)
-    @sh_offset.setter
-    def sh_offset(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+24, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+16, value)
-
-    @property
-    def sh_size(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+32)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+20)
-    @sh_size.setter
-    def sh_size(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+32, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+20, value)
-
-    @property
-    def sh_link(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+40)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+24)
-    @sh_link.setter
-    def sh_link(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+40, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+24, value)
-
-    @property
-    def sh_info(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+44)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+28)
-    @sh_info.setter
-    def sh_info(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+44, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+28, value)
-
-    @property
-    def sh_addralign(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+48)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+32)
-    @sh_addralign.setter
-    def sh_addralign(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+48, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+32, value)
-
-    @property
-    def sh_entsize(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+56)
-        else:
-            return self.elf.read_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+36)
-    @sh_entsize.setter
-    def sh_entsize(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+56, value)
-        else:
-            self.elf.write_word(self.elf.header.e_shoff+(self.elf.header.e_shentsize*self.index)+36, value)
+    def base(self):
+        return self.elf._e_shoff + (self.elf._e_shentsize * self.index)
+
+    # (name, offset, type) for each field, keyed by ELF class.
+    # See Elf_Layout for how these are turned into accessors.
+    LAYOUT32 = (
+        ("sh_name",      0,  "word"),
+        ("sh_type",      4,  "word"),
+        ("sh_flags",     8,  "word"),
+        ("sh_addr",      12, "word"),
+        ("sh_offset",    16, "word"),
+        ("sh_size",      20, "word"),
+        ("sh_link",      24, "word"),
+        ("sh_info",      28, "word"),
+        ("sh_addralign", 32, "word"),
+        ("sh_entsize",   36, "word"),
+    )
+    LAYOUT64 = (
+        ("sh_name",      0,  "word"),
+        ("sh_type",      4,  "word"),
+        ("sh_flags",     8,  "double"),
+        ("sh_addr",      16, "double"),
+        ("sh_offset",    24, "double"),
+        ("sh_size",      32, "double"),
+        ("sh_link",      40, "word"),
+        ("sh_info",      44, "word"),
+        ("sh_addralign", 48, "double"),
+        ("sh_entsize",   56, "double"),
+    )
 
 class Elf_Phdr_Flags(object):
     '''
     Convenience wrapper class for reading and writing a program header's flags.
     '''
+    __slots__ = ("phdr",)
 
     def __init__(self, phdr):
         '''
@@ -268,6 +554,7 @@ class Elf_Phdr(object):
     '''
     Class for reading/writing the contents of an ELF program header entry.
     '''
+    __slots__ = ("elf", "index")
 
     def __init__(self, elf, n=0):
         '''
@@ -280,105 +567,160 @@ class Elf_Phdr(object):
         '''
         self.elf = elf
         self.index = n
-        self.flags = Elf_Phdr_Flags(self)
 
     @property
-    def p_type(self):
-        return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+0)
-    @p_type.setter
-    def p_type(self, value):
-        self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+0, value)
+    def flags(self):
+        return Elf_Phdr_Flags(self)
 
     @property
-    def p_offset(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+8)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+4)
-    @p_offset.setter
-    def p_offset(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+8, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+4, value)
+    def base(self):
+        return self.elf._e_phoff + (self.elf._e_phentsize * self.index)
+
+    LAYOUT32 = (
+        ("p_type",   0,  "word"),
+        ("p_offset", 4,  "word"),
+        ("p_vaddr",  8,  "word"),
+        ("p_paddr",  12, "word"),
+        ("p_filesz", 16, "word"),
+        ("p_memsz",  20, "word"),
+        ("p_flags",  24, "word"),
+        ("p_align",  28, "word"),
+    )
+    LAYOUT64 = (
+        ("p_type",   0,  "word"),
+        ("p_flags",  4,  "word"),
+        ("p_offset", 8,  "double"),
+        ("p_vaddr",  16, "double"),
+        ("p_paddr",  24, "double"),
+        ("p_filesz", 32, "double"),
+        ("p_memsz",  40, "double"),
+        ("p_align",  48, "double"),
+    )
+
+class Elf_Table(object):
+    '''
+    Lazy, read-only sequence view of the program or section header table.
 
-    @property
-    def p_vaddr(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+16)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+8)
-    @p_vaddr.setter
-    def p_vaddr(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+16, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+8, value)
+    Entries are lightweight Elf_Phdr/Elf_Shdr objects that are created on demand and
+    hold nothing but their index; every field access goes to the file. The number of
+    entries (and the table location) is taken from the ELF object's cached header
+    fields, so the view stays valid across edits to the file.
 
-    @property
-    def p_paddr(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+24)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+12)
-    @p_paddr.setter
-    def p_paddr(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+24, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+12, value)
+    For work on every entry of a large table, see buffered().
+    '''
 
-    @property
-    def p_filesz(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+32)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+16)
-    @p_filesz.setter
-    def p_filesz(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+32, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+16, value)
+    def __init__(self, elf, entry_class, count, offset, entsize):
+        '''
+        Class constructor.
 
-    @property
-    def p_memsz(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+40)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+20)
-    @p_memsz.setter
-    def p_memsz(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+40, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+20, value)
+        @elf         - An instance of the ELF class.
+        @entry_class - The (layout specialized) Elf_Phdr or Elf_Shdr class.
+        @count       - Name of the ELF attribute holding the number of entries.
+        @offset      - Name of the ELF attribute holding the file offset of the table.
+        @entsize     - Name of the ELF attribute holding the size of an entry.
 
-    @property
-    def p_flags(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+4)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+24)
-    @p_flags.setter
-    def p_flags(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+4, value)
-        else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+24, value)
+        Returns None.
+        '''
+        self.elf = elf
+        self.entry_class = entry_class
+        self.count = count
+        self.offset = offset
+        self.entsize = entsize
 
-    @property
-    def p_align(self):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            return self.elf.read_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+48)
-        else:
-            return self.elf.read_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+28)
-    @p_align.setter
-    def p_align(self, value):
-        if self.elf.ELFCLASS64 == self.elf.header.e_ident.ei_class:
-            self.elf.write_double(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+48, value)
+    def buffered(self):
+        '''
+        Returns a context manager that reads the whole table into memory with a single read,
+        and gives a view of it whose entries are read and written in memory. If any entry
+        was modified, the table is written back with a single write on exit.
+
+        Usage:
+
+            with elf.section_headers.buffered() as table:
+                for shdr in table:
+                    shdr.sh_offset += size
+        '''
+        return Elf_Table_Buffer(self)
+
+    def __len__(self):
+        return getattr(self.elf, self.count)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+
+        size = len(self)
+        if n < 0:
+            n += size
+        if n < 0 or n >= size:
+            raise IndexError("header table index out of range")
+
+        return self.entry_class(self.elf, n)
+
+    def __iter__(self):
+        for n in range(0, len(self)):
+            yield self.entry_class(self.elf, n)
+
+class Elf_Table_Buffer(object):
+    '''
+    An in-memory copy of a program or section header table, see Elf_Table.buffered().
+
+    Stands in for the ELF object as far as the table's entries are concerned: reads and
+    writes within the table go to memory, and everything else goes to the ELF object.
+    '''
+
+    def __init__(self, table):
+        '''
+        Class constructor.
+
+        @table - The Elf_Table to buffer.
+
+        Returns None.
+        '''
+        self.elf = table.elf
+        self.table = table
+        self.start = getattr(self.elf, table.offset)
+        self.data = bytearray(self.elf.read(self.start, len(table) * getattr(self.elf, table.entsize)))
+        self.end = self.start + len(self.data)
+        self.dirty = False
+
+        # Every entry field access needs these; copying them saves a __getattr__ call each time
+        for name in Elf_Header.CACHED:
+            setattr(self, "_" + name, getattr(self.elf, "_" + name))
+
+    def __getattr__(self, name):
+        # read_string(), etc
+        return getattr(self.elf, name)
+
+    def __enter__(self):
+        return Elf_Table(self, self.table.entry_class, self.table.count, self.table.offset, self.table.entsize)
+
+    def __exit__(self, t, v, traceback):
+        if t is None:
+            self.flush()
+
+    def read(self, offset, size):
+        if self.start <= offset and offset + size <= self.end:
+            offset -= self.start
+            return bytes(self.data[offset:offset+size])
+        return self.elf.read(offset, size)
+
+    def write(self, offset, data):
+        if self.start <= offset and offset + len(data) <= self.end:
+            offset -= self.start
+            self.data[offset:offset+len(data)] = data
+            self.dirty = True
         else:
-            self.elf.write_word(self.elf.header.e_phoff+(self.elf.header.e_phentsize*self.index)+28, value)
+            self.elf.write(offset, data)
+
+    def flush(self):
+        '''
+        Writes the table back to the ELF file, if it has been modified.
+
+        Returns None.
+        '''
+        if self.dirty:
+            self.elf.write(self.start, self.data)
+            self.dirty = False
 
 class Elf_Ident(object):
     '''
@@ -427,6 +769,7 @@ class Elf_Header(object):
     '''
     Class for reading/writing the contents of an ELF header.
     '''
+    __slots__ = ("elf", "e_ident")
 
     def __init__(self, elf):
         '''
@@ -439,156 +782,136 @@ class Elf_Header(object):
         self.elf = elf
         self.e_ident = Elf_Ident(self.elf)
 
-    @property
-    def e_type(self):
-        return self.elf.read_half(16)
-    @e_type.setter
-    def e_type(self, value):
-        self.elf.write_half(16, value)
+    # The header is always at the start of the file
+    base = 0
+
+    # Fields that describe where the program and section header tables live are
+    # cached in the ELF object (as "_<name>"), since they are needed for every
+    # program/section header field access.
+    CACHED = ("e_phoff", "e_shoff", "e_phentsize", "e_shentsize", "e_phnum", "e_shnum", "e_shstrndx")
+
+    LAYOUT32 = (
+        ("e_type",      16, "half"),
+        ("e_machine",   18, "half"),
+        ("e_version",   20, "word"),
+        ("e_entry",     24, "word"),
+        ("e_phoff",     28, "word"),
+        ("e_shoff",     32, "word"),
+        ("e_flags",     36, "word"),
+        ("e_ehsize",    40, "half"),
+        ("e_phentsize", 42, "half"),
+        ("e_phnum",     44, "half"),
+        ("e_shentsize", 46, "half"),
+        ("e_shnum",     48, "half"),
+        ("e_shstrndx",  50, "half"),
+    )
+    LAYOUT64 = (
+        ("e_type",      16, "half"),
+        ("e_machine",   18, "half"),
+        ("e_version",   20, "word"),
+        ("e_entry",     24, "double"),
+        ("e_phoff",     32, "double"),
+        ("e_shoff",     40, "double"),
+        ("e_flags",     48, "word"),
+        ("e_ehsize",    52, "half"),
+        ("e_phentsize", 54, "half"),
+        ("e_phnum",     56, "half"),
+        ("e_shentsize", 58, "half"),
+        ("e_shnum",     60, "half"),
+        ("e_shstrndx",  62, "half"),
+    )
+
+class Elf_Layout(object):
+    '''
+    One of the four possible ELF layouts (ELF32/ELF64 x LSB/MSB).
 
-    @property
-    def e_machine(self):
-        return self.elf.read_half(18)
-    @e_machine.setter
-    def e_machine(self, value):
-        self.elf.write_half(18, value)
+    Holds precompiled struct.Struct objects for each basic ELF data type, along with
+    subclasses of Elf_Header, Elf_Phdr and Elf_Shdr whose fields are bound directly to
+    those structs at their class-specific offsets. Layouts are built once per process
+    and shared by every ELF object with the same class and encoding.
+    '''
 
-    @property
-    def e_version(self):
-        return self.elf.read_word(20)
-    @e_version.setter
-    def e_version(self, value):
-        self.elf.write_word(20, value)
+    _layouts = {}
 
-    @property
-    def e_entry(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_double(24)
-        else:
-            return self.elf.read_word(24)
-    @e_entry.setter
-    def e_entry(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_double(24, value)
-        else:
-            self.elf.write_word(24, value)
+    def __init__(self, ei_class, ei_encoding):
+        '''
+        Class constructor. Use Elf_Layout.get() instead.
 
-    @property
-    def e_phoff(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_double(32)
-        else:
-            return self.elf.read_word(28)
-    @e_phoff.setter
-    def e_phoff(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_double(32)
-        else:
-            self.elf.write_word(28, value)
+        @ei_class    - The ELF class (ELF.ELFCLASS32 or ELF.ELFCLASS64).
+        @ei_encoding - The ELF data encoding (ELF.ELFDATA2LSB or ELF.ELFDATA2MSB).
 
-    @property
-    def e_shoff(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_double(40)
-        else:
-            return self.elf.read_word(32)
-    @e_shoff.setter
-    def e_shoff(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_double(40, value)
-        else:
-            self.elf.write_word(32, value)
+        Returns None.
+        '''
+        self.ei_class = ei_class
+        self.ei_encoding = ei_encoding
 
-    @property
-    def e_flags(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf_read_word(48)
-        else:
-            return self.elf.read_word(36)
-    @e_flags.setter
-    def e_flags(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_word(48, value)
+        if ELF.ELFDATA2MSB == ei_encoding:
+            self.endianess = ">"
         else:
-            self.elf.write_word(36, value)
+            self.endianess = "<"
 
-    @property
-    def e_ehsize(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(52)
-        else:
-            return self.elf.read_half(40)
-    @e_ehsize.setter
-    def e_ehsize(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(52, value)
-        else:
-            self.elf.write_half(40, value)
+        self.byte = struct.Struct(self.endianess + "B")
+        self.half = struct.Struct(self.endianess + "H")
+        self.word = struct.Struct(self.endianess + "I")
+        self.double = struct.Struct(self.endianess + "Q")
 
-    @property
-    def e_phentsize(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(54)
-        else:
-            return self.elf.read_half(42)
-    @e_phentsize.setter
-    def e_phentsize(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(54, value)
+        if ELF.ELFCLASS64 == ei_class:
+            self.address = self.double
         else:
-            self.elf.write_half(42, value)
+            self.address = self.word
 
-    @property
-    def e_phnum(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(56)
-        else:
-            return self.elf.read_half(44)
-    @e_phnum.setter
-    def e_phnum(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(56, value)
-        else:
-            self.elf.write_half(44, value)
+        self.Header = self._specialize(Elf_Header)
+        self.Phdr = self._specialize(Elf_Phdr)
+        self.Shdr = self._specialize(Elf_Shdr)
 
-    @property
-    def e_shentsize(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(58)
-        else:
-            return self.elf.read_half(46)
-    @e_shentsize.setter
-    def e_shentsize(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(58, value)
-        else:
-            self.elf.write_half(46, value)
+    @classmethod
+    def get(cls, ei_class, ei_encoding):
+        '''
+        Returns the (shared) Elf_Layout instance for the given ELF class and encoding.
 
-    @property
-    def e_shnum(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(60)
-        else:
-            return self.elf.read_half(48)
-    @e_shnum.setter
-    def e_shnum(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(60, value)
-        else:
-            self.elf.write_half(48, value)
+        @ei_class    - The ELF class, from e_ident.
+        @ei_encoding - The ELF data encoding, from e_ident.
+        '''
+        # Anything that isn't explicitly 64-bit/big endian is treated as 32-bit/little endian,
+        # which matches how the accessors have always interpreted unknown values.
+        if ELF.ELFCLASS64 != ei_class:
+            ei_class = ELF.ELFCLASS32
+        if ELF.ELFDATA2MSB != ei_encoding:
+            ei_encoding = ELF.ELFDATA2LSB
+
+        key = (ei_class, ei_encoding)
+        try:
+            return cls._layouts[key]
+        except KeyError:
+            return cls._layouts.setdefault(key, cls(ei_class, ei_encoding))
+
+    def _specialize(self, base):
+        '''
+        Creates a subclass of base with an Elf_Field for each entry in its layout table.
 
-    @property
-    def e_shstrndx(self):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            return self.elf.read_half(62)
+        @base - Elf_Header, Elf_Phdr or Elf_Shdr.
+
+        Returns the new class.
+        '''
+        if ELF.ELFCLASS64 == self.ei_class:
+            layout = base.LAYOUT64
+            name = "Elf64"
         else:
-            return self.elf.read_half(50)
-    @e_shstrndx.setter
-    def e_shstrndx(self, value):
-        if self.elf.ELFCLASS64 == self.e_ident.ei_class:
-            self.elf.write_half(62, value)
+            layout = base.LAYOUT32
+            name = "Elf32"
+
+        if ELF.ELFDATA2MSB == self.ei_encoding:
+            name += "MSB"
         else:
-            self.elf.write_half(50, value)
+            name += "LSB"
+
+        cached = getattr(base, "CACHED", ())
+        attributes = {"__slots__" : ()}
+
+        for (field, offset, kind) in layout:
+            attributes[field] = Elf_Field(field, offset, getattr(self, kind), cache=(field in cached))
+
+        return type(name + base.__name__[3:], (base,), attributes)
 
 class ELF(object):
     '''
@@ -599,8 +922,11 @@ class ELF(object):
 
         o self.size            - Returns the size of the ELF file on disk
         o self.header          - EL32_Header object, providing access to the ELF header data
-        o self.program_headers - List of Elf_Phdr objects, providing access to the program header data
-        o self.section_headers - List of Elf_Shdr objects, providing access to the section header data
+        o self.program_headers - Sequence of Elf_Phdr objects, providing access to the program header data
+        o self.section_headers - Sequence of Elf_Shdr objects, providing access to the section header data
+        o self.phnum           - Number of program headers (with extended numbering, e_phnum is just PN_XNUM)
+        o self.shnum           - Number of section headers (likewise, e_shnum may be 0)
+        o self.shstrndx        - Index of the section name string table (likewise, e_shstrndx may be SHN_XINDEX)
 
     Be careful using this class to access elements of the ELF header!! Most everything is implemented
     as getters/setters that directly access the target file on disk. This means, for example, that
@@ -609,6 +935,11 @@ class ELF(object):
 
     If you want to make *sure* nothing gets accidentally written to disk, instantiate this class with
     read_only=True.
+
+    All file access is positional (see Elf_File), so a single ELF instance may be shared by any
+    number of reader threads, e.g. a thread pool decoding symbol tables, string tables and section
+    data in parallel. Writes, and structural edits (insert/append/delete) in particular, are not
+    synchronized against readers and must not run concurrently with them.
     '''
 
     ELFDATA2LSB = 1
@@ -641,129 +972,383 @@ class ELF(object):
     EM_ARM = 40
     EM_X86_64 = 62
 
+    ELFMAG = b"\x7fELF"
+    EV_CURRENT = 1
+
     ELFCLASSNONE = 0
     ELFCLASS32 = 1
     ELFCLASS64 = 2
 
+    # Sizes of the ELF header and of program and section header entries, by ELF class
+    EHSIZE = {ELFCLASS32 : 52, ELFCLASS64 : 64}
+    PHENTSIZE = {ELFCLASS32 : 32, ELFCLASS64 : 56}
+    SHENTSIZE = {ELFCLASS32 : 40, ELFCLASS64 : 64}
+
+    # Extended numbering: when these values are in the ELF header, the real values
+    # are in section header 0 (e_phnum in sh_info, e_shnum in sh_size, e_shstrndx in sh_link)
+    PN_XNUM = 0xFFFF
+    SHN_UNDEF = 0
+    SHN_LORESERVE = 0xFF00
+    SHN_XINDEX = 0xFFFF
+
+    SHT_NULL = 0
     SHT_SYMTAB = 2
+    SHT_NOBITS = 8
     SHT_DYNSYM = 11
 
-    def __init__(self, elfile, read_only=False):
+    DT_NULL = 0
+    DT_SONAME = 14
+    DT_FLAGS_1 = 0x6FFFFFFB
+    DF_1_PIE = 0x08000000
+
+    def __init__(self, elfile, read_only=False, size=None):
         '''
         Class constructor.
 
-        @elfile    - The ELF file to load.
+        @elfile    - The ELF file to load: a path, a seekable file object, or a buffer
+                     (bytearray, memoryview, etc) holding the file, which is edited in place.
         @read_only - Set to True for read-only access to the file.
+        @size      - For buffers, the size of the ELF file, if the buffer is larger (see Elf_Buffer).
 
         Returns None.
         '''
         self.read_only = read_only
+        self.buffer_size = size
 
-        if self.read_only == True:
-            self.file_mode = 'rb'
+        if self._is_buffer(elfile) or hasattr(elfile, "read"):
+            self.elfile = elfile
         else:
-            self.file_mode = 'r+b'
-
-        # Get absolute path to the file
-        self.elfile = os.path.abspath(elfile)
+            # Get absolute path to the file
+            self.elfile = os.path.abspath(elfile)
 
-        # Process the ELF header, along with program and section headers
+        # Open the ELF file and process the ELF header, along with
+        # program and section headers
+        self._open_file()
         self._load_elf_file()
 
     def __enter__(self):
         return self
 
     def __exit__(self, t, v, b):
-        self.fp.close()
+        self.close()
         return None
 
     def _load_elf_file(self):
         '''
-        Opens and loads critical data from the ELF file.
+        Loads critical data from the ELF file.
 
         Returns None.
         '''
-        # Open the ELF file
-        self._open_file()
+        # Decode the ELF class and data encoding once, and pick up the
+        # matching codecs and header accessor classes.
+        ident = bytearray(self.read(0, 16).ljust(16, b"\x00"))
+        self.layout = Elf_Layout.get(ident[4], ident[5])
 
         # Create a ELF header object
-        self.header = Elf_Header(self)
+        self.header = self.layout.Header(self)
+
+        # Cache the header fields needed to locate program/section header entries
+        self._refresh()
+
+        # Program and section header entries are created on demand
+        self.program_headers = Elf_Table(self, self.layout.Phdr, "_e_phnum", "_e_phoff", "_e_phentsize")
+        self.section_headers = Elf_Table(self, self.layout.Shdr, "_e_shnum", "_e_shoff", "_e_shentsize")
+
+    def _refresh(self):
+        '''
+        Re-reads the cached ELF header fields that locate the program and section
+        header tables, with a single read of the ELF header. This is all that is
+        needed to bring the header views up to date after the file has been edited.
+
+        Returns None.
+        '''
+        header = self.read(0, 64)
+
+        for name in Elf_Header.CACHED:
+            field = getattr(self.layout.Header, name)
+            if len(header) >= (field.offset + field.size):
+                value = field.codec.unpack_from(header, field.offset)[0]
+            else:
+                value = 0
+            setattr(self, "_" + name, value)
+
+        # With extended numbering, the cached counts are the real ones, from section header 0
+        if self._e_shoff and (self._e_shnum == 0 or self._e_phnum == self.PN_XNUM or self._e_shstrndx == self.SHN_XINDEX):
+            shdr = self.read(self._e_shoff, self._e_shentsize)
+            for (name, escape, extension) in self.EXTENSIONS:
+                if getattr(self, name) == escape:
+                    field = getattr(self.layout.Shdr, extension)
+                    if len(shdr) >= (field.offset + field.size):
+                        setattr(self, name, field.codec.unpack_from(shdr, field.offset)[0])
+
+    # (cached header field, value that means it is extended, section header 0 field with the real value)
+    EXTENSIONS = (
+        ("_e_phnum", PN_XNUM, "sh_info"),
+        ("_e_shnum", 0, "sh_size"),
+        ("_e_shstrndx", SHN_XINDEX, "sh_link"),
+    )
+
+    @property
+    def phnum(self):
+        # The number of program headers, with extended numbering taken into account
+        return self._e_phnum
+    @phnum.setter
+    def phnum(self, value):
+        self._set_extended("e_phnum", value, self.PN_XNUM, self.PN_XNUM, "sh_info")
+
+    @property
+    def shnum(self):
+        # The number of section headers, with extended numbering taken into account
+        return self._e_shnum
+    @shnum.setter
+    def shnum(self, value):
+        self._set_extended("e_shnum", value, self.SHN_LORESERVE, 0, "sh_size")
+
+    @property
+    def shstrndx(self):
+        # The index of the section name string table, with extended numbering taken into account
+        return self._e_shstrndx
+    @shstrndx.setter
+    def shstrndx(self, value):
+        self._set_extended("e_shstrndx", value, self.SHN_LORESERVE, self.SHN_XINDEX, "sh_link")
+
+    def _set_extended(self, name, value, limit, escape, extension):
+        '''
+        Sets an ELF header field that supports extended numbering.
+
+        @name      - Name of the ELF header field.
+        @value     - The value to set.
+        @limit     - Values of at least this much are stored in section header 0.
+        @escape    - The value to put in the ELF header field instead, in that case.
+        @extension - Name of the section header 0 field to store the value in, in that case.
+
+        Returns None.
+        '''
+        if value >= limit:
+            if not self._e_shoff:
+                raise BotoxException("Extended numbering for %s requires a section header table!" % name)
+            setattr(self.layout.Shdr(self, 0), extension, value)
+            setattr(self.header, name, escape)
+        else:
+            if self._e_shoff:
+                setattr(self.layout.Shdr(self, 0), extension, 0)
+            setattr(self.header, name, value)
+
+        self._refresh()
+
+    def validate(self):
+        '''
+        Checks that the file is an ELF file that can be safely parsed and edited: that the
+        ELF header is sane, that the program and section header tables and every segment
+        and section are within the file, and that section names are within the section name
+        string table. Nothing is written, and each table is read just once, so this is cheap
+        enough to do before making any changes to a file.
+
+        Raises a subclass of ElfFormatException describing the first problem found.
 
-        # Grab all the program headers
-        self.program_headers = []
-        for n in range(0, self.header.e_phnum):
-            phdr = Elf_Phdr(self, n)
-            self.program_headers.append(phdr)
+        Returns None.
+        '''
+        self._validate(self.size, True)
+
+    def _validate(self, size, sections):
+        '''
+        Does the work of validate().
+
+        @size     - The size of the file, to check everything is within it, or None if not known.
+        @sections - Set to False to skip checking the sections and their names.
+
+        Returns None.
+        '''
+        header = bytearray(self.read(0, 64))
+
+        if header[0:4] != self.ELFMAG:
+            raise NotElfException("Not an ELF file!")
+        if len(header) < 16:
+            raise TruncatedElfException("The ELF identification is truncated!")
+        if header[4] not in self.EHSIZE:
+            raise UnsupportedElfException("Unsupported ELF class %d!" % header[4])
+        if header[5] not in (self.ELFDATA2LSB, self.ELFDATA2MSB):
+            raise UnsupportedElfException("Unsupported ELF data encoding %d!" % header[5])
+        if header[6] != self.EV_CURRENT:
+            raise UnsupportedElfException("Unsupported ELF version %d!" % header[6])
+
+        ehsize = self.EHSIZE[self.layout.ei_class]
+        if len(header) < ehsize:
+            raise TruncatedElfException("The ELF header is truncated!")
+        if self.header.e_ehsize < ehsize:
+            raise MalformedElfException("Invalid ELF header size %d!" % self.header.e_ehsize)
+
+        # The extended numbering escapes are only valid with a section header table to hold the real values
+        if not self._e_shoff and (self.header.e_phnum == self.PN_XNUM or self.header.e_shstrndx == self.SHN_XINDEX):
+            raise MalformedElfException("Extended numbering is used, but there is no section header table!")
+
+        tables = [("Program header table", self._e_phnum, self._e_phoff, self._e_phentsize, self.PHENTSIZE),
+                  ("Section header table", self._e_shnum if self._e_shoff else 0, self._e_shoff, self._e_shentsize, self.SHENTSIZE)]
+        for (name, count, offset, entsize, entsizes) in tables:
+            if count == 0:
+                continue
+            if entsize != entsizes[self.layout.ei_class]:
+                raise MalformedElfException("%s has an invalid entry size of %d!" % (name, entsize))
+            if size is not None and offset + count * entsize > size:
+                raise TruncatedElfException("%s (0x%X, %d entries) extends past the end of the file!" % (name, offset, count))
+
+        if self._e_phnum:
+            table = self.program_headers.buffered()
+            with table as program_headers:
+                if len(table.data) < self._e_phnum * self._e_phentsize:
+                    raise TruncatedElfException("Program header table (0x%X) is truncated!" % self._e_phoff)
+                for phdr in program_headers:
+                    (p_type, p_offset, p_vaddr, p_filesz, p_memsz, p_align) = (phdr.p_type, phdr.p_offset, phdr.p_vaddr,
+                                                                               phdr.p_filesz, phdr.p_memsz, phdr.p_align)
+                    if size is not None and p_type != self.PT_NULL and p_offset + p_filesz > size:
+                        raise TruncatedElfException("Program header #%d: segment (0x%X-0x%X) extends past the end of the file!" %
+                                                    (phdr.index, p_offset, p_offset + p_filesz))
+                    if p_type == self.PT_LOAD and p_filesz > p_memsz:
+                        raise MalformedElfException("Program header #%d: file size 0x%X is larger than its memory size 0x%X!" %
+                                                    (phdr.index, p_filesz, p_memsz))
+                    if p_type == self.PT_LOAD and p_align > 1 and (p_align & (p_align - 1) or (p_offset - p_vaddr) % p_align):
+                        raise MalformedElfException("Program header #%d: invalid alignment 0x%X for offset 0x%X and address 0x%X!" %
+                                                    (phdr.index, p_align, p_offset, p_vaddr))
+
+        if not sections or not self._e_shoff or not self._e_shnum:
+            return
+
+        shstrndx = self._e_shstrndx
+        if shstrndx >= self._e_shnum:
+            raise MalformedElfException("Section name string table index %d is out of range (%d sections)!" % (shstrndx, self._e_shnum))
+
+        table = self.section_headers.buffered()
+        with table as section_headers:
+            if len(table.data) < self._e_shnum * self._e_shentsize:
+                raise TruncatedElfException("Section header table (0x%X) is truncated!" % self._e_shoff)
+
+            strsize = 0
+            if shstrndx != self.SHN_UNDEF:
+                shstrtab = section_headers[shstrndx]
+                if shstrtab.sh_type == self.SHT_NOBITS:
+                    raise MalformedElfException("The section name string table has no data!")
+                strsize = shstrtab.sh_size
+
+            # There may be a great many sections, so the fields are decoded straight from the
+            # buffered table, rather than through an Elf_Shdr object each.
+            fields = [getattr(self.layout.Shdr, name) for name in ("sh_name", "sh_type", "sh_offset", "sh_size")]
+            data = table.data
+
+            # Section header 0 holds the extended numbering values, not a section
+            for index in range(1, self._e_shnum):
+                base = index * self._e_shentsize
+                (sh_name, sh_type, sh_offset, sh_size) = [field.codec.unpack_from(data, base + field.offset)[0] for field in fields]
+                if size is not None and sh_type not in (self.SHT_NULL, self.SHT_NOBITS) and sh_offset + sh_size > size:
+                    raise TruncatedElfException("Section header #%d: section (0x%X-0x%X) extends past the end of the file!" %
+                                                (index, sh_offset, sh_offset + sh_size))
+                if strsize and sh_name >= strsize:
+                    raise MalformedElfException("Section header #%d: name (0x%X) is outside the section name string table!" %
+                                                (index, sh_name))
+
+    def dynamic(self):
+        '''
+        Reads the dynamic section (the PT_DYNAMIC segment), with a single read.
+
+        Returns a list of (d_tag, d_val) tuples, up to (not including) the DT_NULL entry;
+        the list is empty if the file has no PT_DYNAMIC segment.
+        '''
+        for phdr in self.program_headers:
+            if phdr.p_type == self.PT_DYNAMIC:
+                (offset, size) = (phdr.p_offset, phdr.p_filesz)
+                break
+        else:
+            return []
 
-        # Get the strings section header so that subsequent section
-        # headers can resolve their section names.
-        self.shstrtab = Elf_Shdr(self, self.header.e_shstrndx)
+        address = self.layout.address
+        data = self.read(offset, size)
 
-        # Grab all the section headers
-        self.section_headers = []
-        for n in range(0, self.header.e_shnum):
-            shdr = Elf_Shdr(self, n)
-            self.section_headers.append(shdr)
+        entries = []
+        for start in range(0, len(data) - 2 * address.size + 1, 2 * address.size):
+            d_tag = address.unpack_from(data, start)[0]
+            if d_tag == self.DT_NULL:
+                break
+            entries.append((d_tag, address.unpack_from(data, start + address.size)[0]))
 
-    # The below methods are the only ones that should touch self.fp
+        return entries
+
+    @property
+    def shstrtab(self):
+        # The section header for the section name string table
+        return self.layout.Shdr(self, self._e_shstrndx)
+
+    # The below methods are the only ones that should touch self.storage
     # directly! All others should be wrappers around these.
+    @staticmethod
+    def _is_buffer(elfile):
+        # On Python 2, str is bytes, and is a path
+        return isinstance(elfile, (bytearray, memoryview)) or (bytes is not str and isinstance(elfile, bytes))
+
     def _open_file(self):
         '''
-        Opens the ELF file whose path is listed in self.elfile.
+        Opens the ELF file (path, file object or buffer) in self.elfile.
 
         Returns None.
         '''
-        # Open the file in unbuffered mode
-        self.fp = open(self.elfile, self.file_mode, 0)
+        if self._is_buffer(self.elfile):
+            self.storage = Elf_Buffer(self.elfile, self.read_only, self.buffer_size)
+        elif hasattr(self.elfile, "read"):
+            self.storage = Elf_Fileobj(self.elfile, self.read_only)
+        else:
+            self.storage = Elf_File(self.elfile, self.read_only)
     def _read_from_file(self, offset, size):
         '''
         Read data from the ELF file.
 
-        @offset - Seek to this file offset before reading
+        @offset - File offset to read from
         @size   - Number of bytes to read
 
         Returns a string of data read from the file.
         '''
-        self.fp.seek(offset)
-        return self.fp.read(size)
+        return self.storage.read(offset, size)
     def _write_to_file(self, offset, data):
         '''
         Write data to the ELF file.
 
-        @offset - Seek to this file offset before writing
+        @offset - File offset to write to
         @data   - Data to write to the file
 
         Returns None.
         '''
-        self.fp.seek(offset)
-        self.fp.write(data)
-        # Shouldn't need the flush since the file is opened
-        # in unbuffered mode, but it can't hurt...right??
-        self.fp.flush()
-    def _file_overwrite(self, data):
+        self.storage.write(offset, data)
+    def _file_move(self, source, destination, size):
         '''
-        Completely overwrite and re-load the ELF file on disk.
+        Move a range of bytes within the ELF file, growing the file if necessary.
 
-        @data - Overwrite the ELF file with this data.
-                If in read-only mode, nothing will happen.
+        @source      - File offset of the data to move.
+        @destination - File offset to move the data to.
+        @size        - Number of bytes to move.
 
         Returns None.
         '''
-        # TODO: Should raise an exception if self.read_only is True?
-        if self.read_only == False:
-            self.fp.close()
-            fp = open(self.elfile, "wb")
-            fp.write(data)
-            fp.close()
-            self._load_elf_file()
+        self.storage.move(source, destination, size)
+    def _file_truncate(self, size):
+        '''
+        Truncate (or extend) the ELF file to the specified size.
+
+        @size - The new file size.
+
+        Returns None.
+        '''
+        self.storage.truncate(size)
+    def close(self):
+        '''
+        Closes the underlying ELF file.
+
+        Returns None.
+        '''
+        self.storage.close()
     @property
     def size(self):
-        self.fp.seek(0, 2)
-        return self.fp.tell()
+        return self.storage.size
     @size.setter
     def size(self):
         return None
-    # End of methods that should be directly accessing self.fp!
+    # End of methods that should be directly accessing self.storage!
 
     # These two methods are the only ones that should be accessing
     # the internal _read_from_file and _write_to_file methods!
@@ -773,20 +1358,27 @@ class ELF(object):
         return self._write_to_file(offset, data)
 
     # These three methods are the only ones that should be accessing
-    # the internal _file_overwrite method!
+    # the internal _file_move and _file_truncate methods!
+    #
+    # Edits are done in place: only the data after the edit is moved, and
+    # afterwards the cached ELF header fields are re-read (see _refresh).
+    # Any header fields that point past the edit (e_shoff, p_offset, etc)
+    # must be updated by the caller. In read-only mode, nothing will happen.
     def insert(self, offset, data):
         '''
         Insert data into the ELF file.
 
-        @offset - Seek to this file offset before writing.
+        @offset - File offset at which to insert the data.
         @data   - Insert this data to file.
 
         Returns None.
         '''
-        elf_file_contents = self.read(0, offset)
-        elf_file_contents += data
-        elf_file_contents += self.read(offset, (self.size-offset))
-        self._file_overwrite(elf_file_contents)
+        # TODO: Should raise an exception if self.read_only is True?
+        if self.read_only == False:
+            size = self.size
+            self._file_move(offset, offset + len(data), size - offset)
+            self.write(offset, data)
+            self._refresh()
     def append(self, data):
         '''
         Append data to the end of the ELF file.
@@ -795,33 +1387,39 @@ class ELF(object):
 
         Returns None.
         '''
-        elf_file_contents = self.read(0, self.size)
-        elf_file_contents += data
-        self.write(0, elf_file_contents)
-        self._file_overwrite(elf_file_contents)
+        if self.read_only == False:
+            self.write(self.size, data)
+            self._refresh()
     def delete(self, offset, size):
         '''
         Remove data from the ELF file.
 
-        @offset - Seek to this file offset before deleting.
+        @offset - File offset of the data to delete.
         @size   - Delete this many bytes from the file.
 
         Returns None.
         '''
-        elf_file_contents = self.read(0, offset)
-        elf_file_contents += self.read((offset+size), (self.size - (offset+size)))
-        self._file_overwrite(elf_file_contents)
+        if self.read_only == False:
+            file_size = self.size
+            self._file_move(offset + size, offset, file_size - (offset + size))
+            self._file_truncate(file_size - size)
+            self._refresh()
 
     def write_string(self, offset, data):
         '''
         Write data to the ELF file, adding a NULL terminating character.
 
         @offset - Seek to this file offset before writing.
-        @data   - Write this data to file.
+        @data   - Write this data to file (bytes, or a text string, which is UTF-8 encoded).
 
         Returns None.
         '''
-        return self.write(offset, data + "\x00")
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.encode("utf-8")
+
+        string = bytearray(data)
+        string.append(0)
+        return self.write(offset, string)
 
     def read_string(self, offset, size=None):
         '''
@@ -831,36 +1429,37 @@ class ELF(object):
         @size   - Number of bytes to read.
                   If None, this will read up to, but not including, the first NULL byte.
 
-        Returns the data read from the file.
+        Returns the data read from the file, as bytes.
         '''
         # Read in blocks of 1024. Better for disk I/O than doing one byte at a time.
         block_size = 1024
         i = 0
-        data = ""
 
-        if size is None:
-            while True:
-                chunk = self.read(offset+i, block_size)
-                if b"\x00" in chunk:
-                    data += chunk.split(b"\x00")[0]
-                    break
-                elif not chunk:
-                    break
-                else:
-                    data += chunk
-                    i += block_size
-        else:
-            data = self.read(offset, size)
+        if size is not None:
+            return self.read(offset, size)
+
+        # Most strings fit in the first block, so don't bother with a buffer for those
+        chunk = self.read(offset, block_size)
+        end = chunk.find(b"\x00")
+        if end != -1:
+            return chunk[0:end]
 
-        return data
+        data = bytearray(chunk)
+        while chunk:
+            i += len(chunk)
+            chunk = self.read(offset+i, block_size)
+            end = chunk.find(b"\x00")
+            if end != -1:
+                data += chunk[0:end]
+                break
+            data += chunk
+
+        return bytes(data)
 
     @property
     def endianess(self):
-        # Before doing anything else, we need to know what endianess the target is
-        if self.ELFDATA2MSB == self.header.e_ident.ei_encoding:
-            return ">"
-        else:
-            return "<"
+        # Decoded from e_ident.ei_encoding when the file was loaded
+        return self.layout.endianess
     @endianess.setter
     def endianess(self, value):
         # This really is for internal use to interface with the struct module.
@@ -869,36 +1468,26 @@ class ELF(object):
         pass
 
     def read_byte(self, offset):
-        return ord(self.read(offset, 1))
+        return self.layout.byte.unpack(self.read(offset, 1))[0]
     def write_byte(self, offset, value):
-        self.write(offset, chr(value))
+        self.write(offset, self.layout.byte.pack(value))
 
     def read_half(self, offset):
-        return struct.unpack("%sH" % self.endianess, self.read(offset, 2))[0]
+        return self.layout.half.unpack(self.read(offset, 2))[0]
     def write_half(self, offset, value):
-        self.write(offset, struct.pack("%sH" % self.endianess, value))
+        self.write(offset, self.layout.half.pack(value))
 
     def read_word(self, offset):
-        return struct.unpack("%sL" % self.endianess, self.read(offset, 4))[0]
+        return self.layout.word.unpack(self.read(offset, 4))[0]
     def write_word(self, offset, value):
-        self.write(offset, struct.pack("%sL" % self.endianess, value))
+        self.write(offset, self.layout.word.pack(value))
 
     def read_double(self, offset):
-        return struct.unpack("%sq" % self.endianess, self.read(offset, 8))[0]
+        return self.layout.double.unpack(self.read(offset, 8))[0]
     def write_double(self, offset, value):
-        self.write(offset, struct.pack("%sq" % self.endianess, value))
+        self.write(offset, self.layout.double.pack(value))
 
     def read_address(self, offset):
-        if self.ELFCLASS64 == self.header.e_ident.ei_class:
-            return self.read_double(offset)
-        else:
-            return self.read_word(offset)
+        return self.layout.address.unpack(self.read(offset, self.layout.address.size))[0]
     def write_address(self, offset, value):
-        if self.ELFCLASS64 == self.header.e_ident.ei_class:
-            return self.write_double(offset, value)
-        else:
-            return self.write_word(offset, value)
-
-
-
-
+        return self.write(offset, self.layout.address.pack(value))
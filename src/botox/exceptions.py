@@ -1,2 +1,32 @@
 class BotoxException(Exception):
     pass
+
+class ElfFormatException(BotoxException):
+    '''
+    Raised by ELF.validate() for files that can't be safely parsed; see the subclasses.
+    '''
+    pass
+
+class NotElfException(ElfFormatException):
+    '''
+    The file is not an ELF file at all (e.g., the magic number is wrong).
+    '''
+    pass
+
+class UnsupportedElfException(ElfFormatException):
+    '''
+    The file is an ELF file, but of an unknown class, data encoding or version.
+    '''
+    pass
+
+class TruncatedElfException(ElfFormatException):
+    '''
+    Part of the file (the ELF header, a header table, a segment or a section) extends past its end.
+    '''
+    pass
+
+class MalformedElfException(ElfFormatException):
+    '''
+    The ELF header values are inconsistent (e.g., wrong entry sizes, or out of range indices).
+    '''
+    pass
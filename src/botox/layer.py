@@ -0,0 +1,408 @@
+import io
+import os
+import sys
+import errno
+import tarfile
+import tempfile
+from botox import Botox
+from botox.exceptions import BotoxException
+
+class Member(object):
+    '''
+    The outcome of processing a single tar member.
+
+    Important class objects:
+
+        o self.name     - Path of the member in the archive
+        o self.action   - LayerPatcher.PATCHED, LayerPatcher.COPIED or LayerPatcher.SKIPPED
+        o self.size     - Size of the member in the input archive
+        o self.new_size - Size of the member in the output archive
+        o self.reason   - Why an ELF file was not patched (SKIPPED only)
+    '''
+    __slots__ = ("name", "action", "size", "new_size", "reason")
+
+    def __init__(self, name, action, size, new_size=None, reason=None):
+        self.name = name
+        self.action = action
+        self.size = size
+        self.new_size = size if new_size is None else new_size
+        self.reason = reason
+
+class _Input(object):
+    '''
+    Sequential reader for a (possibly compressed) tar stream.
+    '''
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.pending = b""
+        self.compression = None
+
+        # Uncompressed streams are read straight from the file descriptor, so that
+        # data can be copied to the output without passing through Python at all.
+        self.fd = None
+        magic = self._raw_read(4)
+        if magic.startswith(LayerPatcher.GZIP_MAGIC):
+            import gzip
+            self.compression = LayerPatcher.GZIP
+            self.fp = gzip.GzipFile(fileobj=_Prefixed(magic, fp), mode="rb")
+        elif magic.startswith(LayerPatcher.ZSTD_MAGIC):
+            self.compression = LayerPatcher.ZSTD
+            self.fp = _zstandard().ZstdDecompressor().stream_reader(_Prefixed(magic, fp))
+        else:
+            self.pending = magic
+            # Only unbuffered files; a buffered reader may have read ahead of the descriptor
+            if isinstance(fp, io.FileIO):
+                self.fd = fp.fileno()
+
+    def _raw_read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.fp.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read(self, size):
+        '''
+        Returns the next size bytes of the stream; short only at the end of the stream.
+        '''
+        if self.pending:
+            data = self.pending[0:size]
+            self.pending = self.pending[size:]
+            if len(data) < size:
+                data += self._raw_read(size - len(data))
+            return data
+        return self._raw_read(size)
+
+class _Output(object):
+    '''
+    Sequential writer for a (possibly compressed) tar stream.
+    '''
+
+    def __init__(self, fp, compression):
+        self.raw = fp
+        self.fd = None
+
+        if compression == LayerPatcher.GZIP:
+            import gzip
+            self.fp = gzip.GzipFile(fileobj=fp, mode="wb", compresslevel=LayerPatcher.GZIP_LEVEL)
+        elif compression == LayerPatcher.ZSTD:
+            self.fp = _zstandard().ZstdCompressor().stream_writer(fp, closefd=False)
+        else:
+            self.fp = fp
+            if isinstance(fp, io.FileIO):
+                self.fd = fp.fileno()
+
+    def write(self, data):
+        if self.fd is None:
+            self.fp.write(data)
+            return
+
+        # Unbuffered files may write less than they were given
+        view = memoryview(data)
+        while len(view) > 0:
+            view = view[self.fp.write(view):]
+
+    def close(self):
+        if self.fp is not self.raw:
+            self.fp.close()
+        self.raw.flush()
+
+class _Prefixed(object):
+    '''
+    File object that reads some already read bytes, followed by the rest of a file.
+    '''
+
+    def __init__(self, prefix, fp):
+        self.prefix = prefix
+        self.fp = fp
+
+    def read(self, size=-1):
+        if self.prefix:
+            if size is None or size < 0:
+                size = len(self.prefix)
+            data = self.prefix[0:size]
+            self.prefix = self.prefix[size:]
+            return data
+        return self.fp.read(size)
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[0:len(data)] = data
+        return len(data)
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise BotoxException("zstd compressed layers require the zstandard module! Please install it from: https://pypi.org/project/zstandard/")
+    return zstandard
+
+class LayerPatcher(object):
+    '''
+    Patches the ELF executables in a tar archive, such as a container image layer, while
+    copying it from one stream to another.
+
+    The archive is read and written strictly sequentially, so either end may be a pipe,
+    and only one member is processed at a time. Members other than ELF executables are
+    copied through verbatim (header blocks included), without passing through Python
+    where the operating system allows it. Each ELF file is spooled to a temporary file,
+    since its section headers are at the end of it, patched with Botox.diff(), and the
+    result is streamed out with Delta.stream(); only the member's tar header is rewritten.
+    '''
+
+    BLOCK_SIZE = tarfile.BLOCKSIZE
+    BUFFER_SIZE = 0x100000
+
+    PATCHED = "patched"
+    COPIED = "copied"
+    SKIPPED = "skipped"
+
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    GZIP_MAGIC = b"\x1f\x8b"
+    ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+    # gzip's default (9) is several times slower, for little gain
+    GZIP_LEVEL = 6
+
+    ELF_MAGIC = b"\x7fELF"
+
+    # Member types with file data that may be an ELF executable
+    REGULAR = [tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE]
+    # Extended header members, which apply to the member that follows them
+    EXTENSIONS = [tarfile.XHDTYPE, tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK]
+    # Largest member size that fits in a ustar header
+    MAX_USTAR_SIZE = (8 ** 11) - 1
+
+    def __init__(self, source, destination, compression=None, spool=None, report=None, **options):
+        '''
+        Class constructor.
+
+        @source      - File object to read the archive from (gzip and zstd compressed archives are detected).
+        @destination - File object to write the patched archive to.
+        @compression - Compression for the output: GZIP, ZSTD, or "none"; defaults to that of the input.
+        @spool       - Directory for temporary copies of ELF files (default: the system's temporary directory).
+        @report      - Callable, invoked as report(member) with a Member for each file in the archive.
+        @options     - Options for the default pause payload, see Botox.patch().
+
+        Returns None.
+        '''
+        self.input = _Input(source)
+        if compression is None:
+            compression = self.input.compression
+        self.output = _Output(destination, compression)
+        self.spool = spool
+        self.report = report or (lambda member: None)
+        self.options = options
+        self.members = 0
+        self.patched = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        # System calls that copy between files without passing the data through Python,
+        # for the output and for spool files; each one is dropped once it has failed.
+        methods = [method for method in ["copy_file_range", "sendfile"] if hasattr(os, method)]
+        self.methods = {True : list(methods), False : list(methods)}
+
+    def _copy(self, size, fd=None):
+        '''
+        Copies data from the input to the output (or to a file descriptor).
+
+        @size - Number of bytes to copy.
+        @fd   - File descriptor to copy to, instead of the output.
+
+        Returns None.
+        '''
+        if fd is None:
+            fd = self.output.fd
+
+        # Anything already buffered has to be written out first
+        if self.input.pending:
+            data = self.input.read(min(size, len(self.input.pending)))
+            self._write(data, fd)
+            size -= len(data)
+
+        methods = self.methods[fd == self.output.fd]
+        while size > 0 and methods and self.input.fd is not None and fd is not None:
+            try:
+                if methods[0] == "copy_file_range":
+                    n = os.copy_file_range(self.input.fd, fd, min(size, self.BUFFER_SIZE))
+                else:
+                    n = os.sendfile(fd, self.input.fd, None, min(size, self.BUFFER_SIZE))
+            except OSError as e:
+                # Not supported for these files (e.g., pipes); try the next method, if any
+                if e.errno not in [errno.EINVAL, errno.EXDEV, errno.ENOSYS, errno.EBADF, errno.ESPIPE, errno.EOPNOTSUPP]:
+                    raise
+                methods.pop(0)
+                continue
+            if n == 0:
+                raise BotoxException("Unexpected end of archive!")
+            size -= n
+
+        while size > 0:
+            data = self.input.read(min(size, self.BUFFER_SIZE))
+            if not data:
+                raise BotoxException("Unexpected end of archive!")
+            self._write(data, fd)
+            size -= len(data)
+
+    def _write(self, data, fd=None):
+        if fd is None or fd == self.output.fd:
+            self.output.write(data)
+        else:
+            view = memoryview(data)
+            while len(view) > 0:
+                view = view[os.write(fd, view):]
+
+    def _read(self, size):
+        data = self.input.read(size)
+        if len(data) != size:
+            raise BotoxException("Unexpected end of archive!")
+        return data
+
+    def _resize(self, header, size):
+        '''
+        Returns a copy of a ustar header block with a new member size (and checksum).
+        '''
+        header = bytearray(header)
+        header[124:136] = ("%011o" % size).encode("ascii") + b"\x00"
+        header[148:156] = b" " * 8
+        header[148:156] = ("%06o" % sum(header)).encode("ascii") + b"\x00 "
+        return bytes(header)
+
+    def _pax(self, data):
+        '''
+        Returns a dictionary of the records in a pax extended header.
+        '''
+        records = {}
+        offset = 0
+        while offset < len(data):
+            space = data.find(b" ", offset)
+            if space < 0:
+                break
+            try:
+                length = int(data[offset:space])
+            except ValueError as e:
+                break
+            if length <= 0:
+                break
+            (key, _, value) = data[space+1:offset+length-1].partition(b"=")
+            records[key] = value
+            offset += length
+        return records
+
+    def _patch(self, header, name, size, padded, first):
+        '''
+        Patches an ELF member, whose first block has already been read.
+
+        Returns a Member.
+        '''
+        (fd, path) = tempfile.mkstemp(prefix="botox-", dir=self.spool)
+        try:
+            self._write(first[0:size], fd)
+            self._copy(size - len(first[0:size]), fd)
+            self._read(padded - max(size, len(first)))
+            os.close(fd)
+            fd = None
+
+            try:
+                delta = Botox(path).diff(**self.options)
+                if delta.output_size > self.MAX_USTAR_SIZE:
+                    raise BotoxException("Patched file is too large for a ustar header!")
+            except BotoxException as e:
+                # Not something we can patch (e.g., a shared library); pass it through
+                self._write(header)
+                with open(path, "rb") as fp:
+                    while True:
+                        data = fp.read(self.BUFFER_SIZE)
+                        if not data:
+                            break
+                        self._write(data)
+                self._write(b"\x00" * (padded - size))
+                return Member(name, self.SKIPPED, size, reason=str(e))
+
+            self._write(self._resize(header, delta.output_size))
+            with open(path, "rb") as fp:
+                delta.stream(fp, self.output)
+            self._write(b"\x00" * (-delta.output_size % self.BLOCK_SIZE))
+            self.patched += 1
+            return Member(name, self.PATCHED, size, delta.output_size)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            os.unlink(path)
+
+    def run(self):
+        '''
+        Copies the whole archive, patching ELF executables along the way.
+
+        Returns None.
+        '''
+        name = None
+        patchable = True
+
+        try:
+            while True:
+                header = self.input.read(self.BLOCK_SIZE)
+                if not header:
+                    break
+                if len(header) != self.BLOCK_SIZE:
+                    raise BotoxException("Unexpected end of archive!")
+
+                if header == b"\x00" * self.BLOCK_SIZE:
+                    # End of archive; copy the end marker and any padding as they are
+                    self._write(header)
+                    while True:
+                        data = self.input.read(self.BUFFER_SIZE)
+                        if not data:
+                            break
+                        self._write(data)
+                    break
+
+                try:
+                    info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape" if sys.version_info[0] > 2 else "strict")
+                except tarfile.HeaderError as e:
+                    raise BotoxException("Invalid tar header: %s" % str(e))
+
+                size = info.size
+                padded = size + (-size % self.BLOCK_SIZE)
+
+                if info.type in self.EXTENSIONS:
+                    data = self._read(padded)
+                    self._write(header + data)
+                    if info.type == tarfile.GNUTYPE_LONGNAME:
+                        name = data[0:size].rstrip(b"\x00").decode("utf-8", "replace")
+                    elif info.type == tarfile.XHDTYPE:
+                        records = self._pax(data[0:size])
+                        if b"path" in records:
+                            name = records[b"path"].decode("utf-8", "replace")
+                        # The member's real size is in the pax header; leave it alone
+                        if b"size" in records:
+                            patchable = False
+                    continue
+
+                member_name = name or info.name
+                self.members += 1
+
+                first = b""
+                if info.type in self.REGULAR and size >= len(self.ELF_MAGIC):
+                    first = self._read(min(padded, self.BLOCK_SIZE))
+
+                if patchable and first.startswith(self.ELF_MAGIC) and not (bytearray(header)[124] & 0x80):
+                    member = self._patch(header, member_name, size, padded, first)
+                else:
+                    self._write(header + first)
+                    self._copy(padded - len(first))
+                    member = Member(member_name, self.COPIED, size)
+
+                self.bytes_in += size
+                self.bytes_out += member.new_size
+                self.report(member)
+
+                name = None
+                patchable = True
+        finally:
+            self.output.close()
@@ -0,0 +1,301 @@
+import re
+from botox.elf import ELF
+
+class Layout(object):
+    '''
+    Describes where injected code will live in a patched ELF file, and how the
+    ELF's headers must be updated to accommodate it.
+
+    All payloads are placed in one contiguous block, inserted into the file in a
+    single operation, so the headers only ever need to be relocated once no matter
+    how many payloads are injected. Alternatively, the block may be written over free
+    space in the file (see free_space()), in which case nothing is moved at all.
+
+    Important class objects:
+
+        o self.offset    - File offset at which the block will be inserted (or written)
+        o self.vaddr     - Virtual address of the start of the block
+        o self.size      - Size of the block inserted into the file (a multiple of the segment
+                           alignment); 0 if the block is written over free space
+        o self.used      - Size of the block up to the end of the last payload; the rest is padding
+        o self.data      - The block itself: all payloads, padded out to self.size
+        o self.entry     - The new ELF entry point
+        o self.addresses - Virtual address of each payload, in the order they were given
+        o self.segment   - Index of the program header for the segment that is grown to hold the block
+        o self.capacity  - Amount of free space the block is written over, or None if it is inserted
+        o self.pages     - Predicted number of extra pages each exec of the patched file touches
+    '''
+
+    def __init__(self, segment, offset, vaddr, alignment, capacity=None):
+        '''
+        Class constructor.
+
+        @segment   - Index of the executable load segment that will hold the payloads.
+        @offset    - File offset at which the payload block will be inserted.
+        @vaddr     - Virtual address corresponding to @offset.
+        @alignment - The block will be padded out to a multiple of this size.
+        @capacity  - To write the block over free space at @offset instead of inserting it,
+                     the size of the free space.
+
+        Returns None.
+        '''
+        self.segment = segment
+        self.offset = offset
+        self.vaddr = vaddr
+        self.alignment = alignment
+        self.capacity = capacity
+        self.pages = None
+        self.entry = None
+        self.addresses = []
+        self.data = bytearray()
+        self.size = 0
+        self.used = 0
+
+    def place(self, payloads, start=None, payload_alignment=1):
+        '''
+        Assigns each payload its final position in the block and builds the block.
+
+        The block is allocated once, at its final size, and each payload is copied
+        straight into it; all padding is left zero filled.
+
+        @payloads          - A list of payload bytes, in the order they should be laid out.
+        @start             - Virtual address of the first payload; defaults to the start of the block.
+                             Any space before it is zero filled.
+        @payload_alignment - Each payload is padded out to a multiple of this size.
+
+        Returns a list of the virtual address of each payload.
+        '''
+        addresses = []
+        position = 0
+
+        if start is not None:
+            position = start - self.vaddr
+
+        for payload in payloads:
+            addresses.append(self.vaddr + position)
+            position += len(payload) + (-len(payload) % payload_alignment)
+
+        # Pad the block out to the alignment size of the load segment, so that the
+        # file offsets of everything after it stay congruent to their virtual addresses.
+        # Nothing moves when the block is written over free space, so it isn't padded.
+        if self.capacity is None:
+            self.used = position
+            self.size = position + (-position % self.alignment)
+            self.data = bytearray(self.size)
+        else:
+            self.used = addresses[-1] + len(payloads[-1]) - self.vaddr if payloads else position
+            self.size = 0
+            self.data = bytearray(self.used)
+
+        for (address, payload) in zip(addresses, payloads):
+            offset = address - self.vaddr
+            self.data[offset:offset+len(payload)] = payload
+
+        return addresses
+
+    def update_header(self, elf, debug=None):
+        '''
+        Updates the ELF header for this layout.
+
+        @elf   - An instance of the ELF class.
+        @debug - Optional callable used to report each modification.
+
+        Returns None.
+        '''
+        debug = debug or (lambda msg: None)
+
+        # If the section headers come after the new payload insertion location
+        # (which they will), update the offset of the section headers by the
+        # size of the payload.
+        if self.size and self.offset <= elf.header.e_shoff:
+            debug("Increasing section header offset by 0x%X" % self.size)
+            elf.header.e_shoff += self.size
+
+        # Program headers virtually always precede the insertion location,
+        # but be sure they are moved along with the rest of the file if not.
+        if self.size and self.offset <= elf.header.e_phoff:
+            debug("Increasing program header offset by 0x%X" % self.size)
+            elf.header.e_phoff += self.size
+
+        if self.entry is not None:
+            debug("Setting ELF entry point to 0x%X" % self.entry)
+            elf.header.e_entry = self.entry
+
+    def update_program_headers(self, elf, debug=None):
+        '''
+        Updates the ELF program headers for this layout.
+
+        @elf   - An instance of the ELF class.
+        @debug - Optional callable used to report each modification.
+
+        Returns None.
+        '''
+        debug = debug or (lambda msg: None)
+
+        with elf.program_headers.buffered() as program_headers:
+            for phdr in program_headers:
+                # Each segment defined in the program headers that starts *after*
+                # the offset where our payload will be inserted must have its
+                # starting offset increased by the size of our payload.
+                if self.offset <= phdr.p_offset:
+                    if self.size:
+                        debug("Increasing the offset of program header #%d by 0x%X" % (phdr.index, self.size))
+                        phdr.p_offset += self.size
+
+                # Increase the executable segment's file and memory size so we can shove our payload in it.
+                # The padding after the payloads is left out, as it would overlap the next segment in memory.
+                # (Payloads written over free space inside the segment need no more room at all.)
+                elif phdr.index == self.segment:
+                    growth = self._growth(phdr.p_offset + phdr.p_filesz)
+                    if growth:
+                        debug("Increasing the size of program header #%d by 0x%X" % (phdr.index, growth))
+                        phdr.p_memsz += growth
+                        phdr.p_filesz += growth
+
+    def update_section_headers(self, elf, debug=None):
+        '''
+        Updates the ELF section headers for this layout.
+
+        @elf   - An instance of the ELF class.
+        @debug - Optional callable used to report each modification.
+
+        Returns None.
+        '''
+        debug = debug or (lambda msg: None)
+
+        # There may be a great many sections (e.g., with -ffunction-sections); they are all
+        # updated in memory, and written back in one go.
+        with elf.section_headers.buffered() as section_headers:
+            for shdr in section_headers:
+                # Section header 0 holds no section, and its size may be the extended section count
+                if shdr.index == 0:
+                    continue
+
+                sh_offset = shdr.sh_offset
+
+                # Each section defined in the section headers that starts *after*
+                # the offset where our payload will be inserted must have its
+                # starting offset increased by the size of our payload.
+                if self.offset <= sh_offset:
+                    if self.size:
+                        debug("Increasing the offset of section header #%d by 0x%X" % (shdr.index, self.size))
+                        shdr.sh_offset += self.size
+
+                # The section in which the actual payload should reside must have its size increased
+                # to acommodate the new payload, and must also be marked as executable.
+                elif self.offset <= (sh_offset + shdr.sh_size):
+                    growth = self._growth(sh_offset + shdr.sh_size)
+                    debug("Payload will reside in section #%d, increasing its size by 0x%X" % (shdr.index, growth))
+                    shdr.flags.execute = True
+                    shdr.flags.allocate = True
+                    shdr.sh_size += growth
+
+    def _growth(self, end):
+        '''
+        Returns how much a segment or section ending at file offset @end must grow by to
+        hold the payloads.
+        '''
+        return max(self.offset + self.used - end, 0)
+
+    def apply(self, elf, debug=None):
+        '''
+        Updates all ELF headers for this layout, and inserts the payload block.
+
+        @elf   - An instance of the ELF class, opened for writing.
+        @debug - Optional callable used to report each modification.
+
+        Returns None.
+        '''
+        # Section and program headers are located via the ELF header, so they
+        # must be updated before the ELF header itself is.
+        self.update_program_headers(elf, debug)
+        self.update_section_headers(elf, debug)
+        self.update_header(elf, debug)
+
+        if self.capacity is not None:
+            if debug is not None:
+                debug("Writing payload of size 0x%X over free space at file offset 0x%X" % (self.used, self.offset))
+            elf.write(self.offset, self.data)
+            return
+
+        if debug is not None:
+            debug("Inserting payload of size 0x%X at file offset 0x%X" % (self.size, self.offset))
+        elf.insert(self.offset, self.data)
+
+def free_space(elf, segment, minimum=16):
+    '''
+    Finds the free space in, and right after, a load segment: runs of zero bytes in the
+    file that no section, segment or header table occupies, such as the padding between
+    sections, or between the end of the segment and the next page. Payloads can be written
+    over free space without moving anything else in the file.
+
+    Nothing can be said to be free in a file without section headers.
+
+    @elf     - An instance of the ELF class.
+    @segment - The program header of the load segment.
+    @minimum - Ignore runs of fewer than this many bytes.
+
+    Returns a list of (offset, vaddr, size) tuples, in file order.
+    '''
+    if not elf._e_shnum:
+        return []
+
+    start = segment.p_offset
+    end = segment.p_offset + segment.p_filesz
+    limit = end
+
+    # Everything in the file that is spoken for, as (start, end) file ranges
+    occupied = [(0, elf.header.e_ehsize),
+                (elf._e_phoff, elf._e_phoff + elf._e_phnum * elf._e_phentsize),
+                (elf._e_shoff, elf._e_shoff + elf._e_shnum * elf._e_shentsize)]
+
+    with elf.program_headers.buffered() as program_headers, elf.section_headers.buffered() as section_headers:
+        # Space after the segment is only free up to its next aligned address, and must not
+        # share a page with the next load segment (see Botox._check_space()). If the
+        # segment has a .bss, the space after it is not free at all.
+        if segment.p_memsz == segment.p_filesz and segment.p_align > 0:
+            vaddr = segment.p_vaddr + segment.p_filesz
+            boundary = vaddr + (-vaddr % segment.p_align)
+            for phdr in program_headers:
+                if phdr.p_type == ELF.PT_LOAD and phdr.index != segment.index and phdr.p_vaddr >= vaddr:
+                    boundary = min(boundary, phdr.p_vaddr - phdr.p_vaddr % segment.p_align)
+            limit = min(end + max(boundary - vaddr, 0), elf.size)
+
+        for phdr in program_headers:
+            if phdr.index != segment.index and phdr.p_filesz:
+                occupied.append((phdr.p_offset, phdr.p_offset + phdr.p_filesz))
+
+        for shdr in section_headers:
+            (sh_type, sh_offset, sh_size) = (shdr.sh_type, shdr.sh_offset, shdr.sh_size)
+            if shdr.index and sh_type != ELF.SHT_NOBITS and sh_size:
+                occupied.append((sh_offset, sh_offset + sh_size))
+
+    # The gaps between the occupied ranges
+    gaps = []
+    position = start
+    for (used_start, used_end) in sorted(occupied):
+        if used_end <= position:
+            continue
+        if used_start >= limit:
+            break
+        if used_start > position:
+            gaps.append((position, used_start))
+        position = used_end
+    if position < limit:
+        gaps.append((position, limit))
+
+    zeros = re.compile(b"\x00{%d,}" % minimum)
+    runs = []
+    for (gap_start, gap_end) in gaps:
+        # Space after the segment must carry straight on from it, for the segment to grow into
+        if gap_start > end or gap_end - gap_start < minimum:
+            continue
+
+        data = elf.read(gap_start, gap_end - gap_start)
+        for match in zeros.finditer(data):
+            (offset, size) = (gap_start + match.start(), len(match.group(0)))
+            if offset > end:
+                continue
+            runs.append((offset, segment.p_vaddr + offset - start, size))
+
+    return runs
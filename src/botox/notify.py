@@ -0,0 +1,140 @@
+import os
+import stat
+import errno
+import socket
+import struct
+from botox.exceptions import BotoxException
+
+# Must match the messages sent by the architecture.Architecture.VARIANT_NOTIFY payloads
+HEADER = struct.Struct("=II")
+NAME_MAX = 1024
+ABSTRACT_PREFIX = "@"
+
+class Notification(object):
+    '''
+    A notification from a process that is about to stop itself.
+
+    Important class objects:
+
+        o self.pid  - Process ID
+        o self.name - argv[0] of the process, if the payload was configured to send it, else b""
+    '''
+    __slots__ = ("pid", "name")
+
+    def __init__(self, pid, name=b""):
+        self.pid = pid
+        self.name = name
+
+class Listener(object):
+    '''
+    Receives notifications from VARIANT_NOTIFY payloads on a FIFO or abstract Unix
+    datagram socket, so that stopped processes can be found without scanning /proc.
+
+    Listeners are non-blocking; use fileno() with select/poll/epoll to wait for
+    notifications, then read() to collect them.
+    '''
+
+    def __init__(self, target):
+        '''
+        Class constructor.
+
+        @target - A FIFO path (created if it does not exist), or an "@name" abstract socket name.
+
+        Returns None.
+        '''
+        self.target = target
+        self.buffer = b""
+        self.fifo = None
+        self.socket = None
+
+        if target.startswith(ABSTRACT_PREFIX):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                self.socket.bind("\x00" + target[len(ABSTRACT_PREFIX):])
+            except socket.error as e:
+                self.socket.close()
+                raise BotoxException("Failed to listen on socket '%s': %s" % (target, str(e)))
+            self.socket.setblocking(False)
+        else:
+            try:
+                os.mkfifo(target, 0o600)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise BotoxException("Failed to create FIFO '%s': %s" % (target, str(e)))
+                if not stat.S_ISFIFO(os.stat(target).st_mode):
+                    raise BotoxException("'%s' exists, and is not a FIFO!" % target)
+
+            # Opened read/write so that the FIFO never sees end-of-file when the
+            # last process that wrote to it goes away; this also means that the
+            # payloads' non-blocking opens succeed for as long as we are listening.
+            self.fifo = os.open(target, os.O_RDWR | os.O_NONBLOCK)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.close()
+
+    def fileno(self):
+        '''
+        Returns the file descriptor to wait on for notifications.
+        '''
+        if self.socket is not None:
+            return self.socket.fileno()
+        return self.fifo
+
+    def read(self):
+        '''
+        Reads all pending notifications, without blocking.
+
+        Returns a list of Notification objects.
+        '''
+        notifications = []
+
+        while True:
+            try:
+                if self.socket is not None:
+                    message = self.socket.recv(HEADER.size + NAME_MAX)
+                    (pid, length) = HEADER.unpack_from(message)
+                    notifications.append(Notification(pid, message[HEADER.size:HEADER.size + length]))
+                    continue
+
+                data = os.read(self.fifo, 65536)
+            except (socket.error, OSError) as e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+            except struct.error as e:
+                # Short datagram; not one of ours
+                continue
+
+            # FIFO messages are written atomically, but a single read may return several
+            self.buffer += data
+            offset = 0
+            while len(self.buffer) - offset >= HEADER.size:
+                (pid, length) = HEADER.unpack_from(self.buffer, offset)
+                if length > NAME_MAX:
+                    # Not one of ours; skip the header, so that it can't hold up the messages after it
+                    offset += HEADER.size
+                    continue
+                end = offset + HEADER.size + length
+                if end > len(self.buffer):
+                    break
+                notifications.append(Notification(pid, self.buffer[offset + HEADER.size:end]))
+                offset = end
+            self.buffer = self.buffer[offset:]
+
+        return notifications
+
+    def close(self):
+        '''
+        Stops listening. The FIFO, if any, is left in place.
+
+        Returns None.
+        '''
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+        if self.fifo is not None:
+            os.close(self.fifo)
+            self.fifo = None
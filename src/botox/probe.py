@@ -0,0 +1,230 @@
+import os
+import sys
+import time
+import struct
+import subprocess
+from botox.elf import ELF
+from botox.exceptions import BotoxException
+
+# Must match the record written by the architecture.Architecture.VARIANT_PROBE payloads
+RECORD_SIZE = 24
+EXEC_ID = 0
+EXIT_ID = 0xFFFFFFFF
+
+class ProbeRecord(object):
+    '''
+    A single record written by a probe payload, or an exec/exit mark written by launch().
+
+    Important class objects:
+
+        o self.pid  - Process ID
+        o self.id   - Binary ID (EXEC_ID and EXIT_ID are the marks written by launch())
+        o self.time - CLOCK_MONOTONIC time, in nanoseconds
+    '''
+    __slots__ = ("pid", "id", "time")
+
+    def __init__(self, pid, id, seconds, nanoseconds):
+        self.pid = pid
+        self.id = id
+        self.time = (seconds * 1000000000) + nanoseconds
+
+class ProbeLog(object):
+    '''
+    Reads the records from a probe file.
+    '''
+
+    # Records are read this many at a time
+    BATCH = 4096
+
+    def __init__(self, path, endianess=None):
+        '''
+        Class constructor.
+
+        @path      - Path to the probe file.
+        @endianess - Byte order of the records (ELF.ELFDATA2LSB or ELF.ELFDATA2MSB);
+                     this is the byte order of the probed binaries, which defaults to
+                     that of the host. See from_elf().
+
+        Returns None.
+        '''
+        self.path = path
+
+        if endianess is None:
+            if sys.byteorder == "big":
+                endianess = ELF.ELFDATA2MSB
+            else:
+                endianess = ELF.ELFDATA2LSB
+
+        if endianess == ELF.ELFDATA2MSB:
+            self.record = struct.Struct(">IIQQ")
+        else:
+            self.record = struct.Struct("<IIQQ")
+
+    @staticmethod
+    def from_elf(path, elfile):
+        '''
+        Returns a ProbeLog for the records written by the specified (patched) ELF file.
+        '''
+        with ELF(elfile, read_only=True) as elf:
+            return ProbeLog(path, elf.header.e_ident.ei_encoding)
+
+    def __iter__(self):
+        '''
+        Yields a ProbeRecord for each record in the file, in the order they were written.
+        A partially written record at the end of the file is ignored.
+        '''
+        with open(self.path, "rb") as fp:
+            while True:
+                data = fp.read(RECORD_SIZE * self.BATCH)
+                for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+                    yield ProbeRecord(*self.record.unpack_from(data, offset))
+                if len(data) < RECORD_SIZE * self.BATCH:
+                    break
+
+class Histogram(object):
+    '''
+    Power-of-two bucketed histogram of durations, in nanoseconds.
+    '''
+
+    def __init__(self):
+        self.buckets = {}
+        self.values = []
+
+    def add(self, value):
+        '''
+        Adds a duration to the histogram.
+
+        @value - Duration in nanoseconds.
+
+        Returns None.
+        '''
+        bucket = 0
+        while (1 << (bucket + 1)) <= value:
+            bucket += 1
+
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def percentile(self, p):
+        '''
+        Returns the @p'th percentile (0-100) of the recorded durations.
+        '''
+        values = sorted(self.values)
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+    def format(self, width=40):
+        '''
+        Returns a human readable rendering of the histogram.
+
+        @width - Width of the largest bar, in characters.
+        '''
+        if not self.values:
+            return "    (no samples)"
+
+        lines = ["    count %d, min %s, p50 %s, p99 %s, max %s" % (len(self.values),
+                                                                 _duration(min(self.values)),
+                                                                 _duration(self.percentile(50)),
+                                                                 _duration(self.percentile(99)),
+                                                                 _duration(max(self.values)))]
+        most = max(self.buckets.values())
+        for bucket in range(min(self.buckets), max(self.buckets) + 1):
+            count = self.buckets.get(bucket, 0)
+            lines.append("    %10s - %-10s %8d %s" % (_duration(1 << bucket),
+                                                       _duration(1 << (bucket + 1)),
+                                                       count,
+                                                       "#" * int(round(float(count) * width / most))))
+        return "\n".join(lines)
+
+def _duration(value):
+    '''
+    Formats a duration given in nanoseconds.
+    '''
+    for (unit, scale) in [("s", 1000000000), ("ms", 1000000), ("us", 1000)]:
+        if value >= scale:
+            return "%.3g%s" % (float(value) / scale, unit)
+    return "%dns" % value
+
+def latencies(records):
+    '''
+    Works out per-process startup and run times from a sequence of probe records.
+
+    @records - An iterable of ProbeRecords, in the order they were written.
+
+    Returns a dictionary of {binary id : (exec_to_entry, entry_to_exit)}, where both are
+    Histograms. exec_to_entry is only populated for processes with an exec mark, and
+    entry_to_exit for processes with an exit mark (see launch()).
+    '''
+    results = {}
+    execs = {}
+    entries = {}
+
+    for record in records:
+        if record.id == EXEC_ID:
+            # A new exec; forget anything that a previous process with the same PID did
+            execs[record.pid] = record.time
+            entries.pop(record.pid, None)
+        elif record.id == EXIT_ID:
+            execs.pop(record.pid, None)
+            entry = entries.pop(record.pid, None)
+            if entry is not None:
+                results[entry[0]][1].add(record.time - entry[1])
+        else:
+            if record.id not in results:
+                results[record.id] = (Histogram(), Histogram())
+
+            # Only the first probe after an exec is the program's entry; probed
+            # programs may well exec other probed programs under the same PID.
+            started = execs.pop(record.pid, None)
+            if started is not None:
+                results[record.id][0].add(record.time - started)
+            entries[record.pid] = (record.id, record.time)
+
+    return results
+
+def _monotonic():
+    '''
+    Returns the current CLOCK_MONOTONIC time as a (seconds, nanoseconds) tuple.
+    '''
+    try:
+        value = time.clock_gettime_ns(time.CLOCK_MONOTONIC)
+    except AttributeError as e:
+        try:
+            value = int(time.clock_gettime(time.CLOCK_MONOTONIC) * 1000000000)
+        except AttributeError as e:
+            raise BotoxException("Probe marks require Python 3.3 or newer!")
+
+    return (value // 1000000000, value % 1000000000)
+
+def _mark(fd, pid, id):
+    '''
+    Writes an exec or exit mark, in the host's byte order, to a probe file.
+    '''
+    (seconds, nanoseconds) = _monotonic()
+    os.write(fd, struct.pack("=IIQQ", pid, id, seconds, nanoseconds))
+
+def launch(path, command):
+    '''
+    Runs a command, writing exec and exit marks for it to a probe file, so that the
+    time from exec to the probed program's entry point can be measured.
+
+    @path    - Path to the probe file.
+    @command - The command to run, as a list of arguments.
+
+    Returns the command's exit status.
+    '''
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    try:
+        # The exec mark is written by the child, right before it execs the command
+        child = subprocess.Popen(command, preexec_fn=lambda: _mark(fd, os.getpid(), EXEC_ID))
+        status = child.wait()
+        _mark(fd, child.pid, EXIT_ID)
+    finally:
+        os.close(fd)
+
+    return status
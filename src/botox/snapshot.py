@@ -0,0 +1,367 @@
+import os
+import json
+import math
+import struct
+from botox.elf import ELF
+from botox.exceptions import BotoxException
+
+# Names of the auxiliary vector entries that are worth reporting
+AUXV = {
+    3  : "AT_PHDR",
+    4  : "AT_PHENT",
+    5  : "AT_PHNUM",
+    6  : "AT_PAGESZ",
+    7  : "AT_BASE",
+    8  : "AT_FLAGS",
+    9  : "AT_ENTRY",
+    11 : "AT_UID",
+    12 : "AT_EUID",
+    13 : "AT_GID",
+    14 : "AT_EGID",
+    15 : "AT_PLATFORM",
+    16 : "AT_HWCAP",
+    17 : "AT_CLKTCK",
+    23 : "AT_SECURE",
+    24 : "AT_BASE_PLATFORM",
+    25 : "AT_RANDOM",
+    26 : "AT_HWCAP2",
+    31 : "AT_EXECFN",
+    32 : "AT_SYSINFO",
+    33 : "AT_SYSINFO_EHDR",
+    51 : "AT_MINSIGSTKSZ",
+}
+
+# struct format of an auxiliary vector word, by (device, inode) of the binary
+_words = {}
+
+class Mapping(object):
+    '''
+    A single line of /proc/pid/maps.
+    '''
+    __slots__ = ("start", "end", "perms", "offset", "device", "inode", "path")
+
+    def __init__(self, start, end, perms, offset, device, inode, path):
+        self.start = start
+        self.end = end
+        self.perms = perms
+        self.offset = offset
+        self.device = device
+        self.inode = inode
+        self.path = path
+
+    @staticmethod
+    def parse(line):
+        '''
+        Returns a Mapping for a line of /proc/pid/maps.
+        '''
+        fields = line.split(None, 5)
+        (start, end) = fields[0].split("-")
+        if len(fields) > 5:
+            path = fields[5].rstrip("\n")
+        else:
+            path = ""
+        return Mapping(int(start, 16), int(end, 16), fields[1], int(fields[2], 16), fields[3], int(fields[4]), path)
+
+    def key(self):
+        '''
+        Returns a tuple identifying this mapping, for de-duplication.
+        '''
+        return (self.start, self.end, self.perms, self.offset, self.device, self.inode, self.path)
+
+    def to_dict(self):
+        return dict(zip(self.__slots__, self.key()))
+
+class Snapshot(object):
+    '''
+    The memory layout and startup state of a (stopped) process.
+
+    Important class objects:
+
+        o self.pid       - Process ID
+        o self.exe       - Path to the process executable
+        o self.binary    - (device, inode) of the process executable, identifying the binary
+        o self.cmdline   - List of command line arguments
+        o self.maps      - List of Mapping objects
+        o self.auxv      - Dictionary of auxiliary vector entries, keyed by AT_XXX name (or number)
+        o self.environ   - List of "NAME=VALUE" environment strings
+        o self.registers - Dictionary of the stack pointer ("sp"), program counter ("pc"),
+                           and the system call the process is blocked in ("syscall", "args"),
+                           or None if the process is running
+    '''
+
+    def __init__(self, pid):
+        '''
+        Class constructor. Reads everything from /proc/pid.
+
+        @pid - Process ID.
+
+        Returns None.
+        '''
+        self.pid = pid
+        proc = "/proc/%d/" % pid
+
+        try:
+            self.exe = os.readlink(proc + "exe")
+            info = os.stat(proc + "exe")
+            self.binary = (info.st_dev, info.st_ino)
+
+            with open(proc + "maps", "r") as fp:
+                self.maps = [Mapping.parse(line) for line in fp]
+
+            self.cmdline = self._strings(self._read(proc + "cmdline"))
+            self.environ = self._strings(self._read(proc + "environ"))
+            self.auxv = self._auxv(self._read(proc + "auxv"), proc + "exe", self.binary)
+            self.registers = self._registers(self._read(proc + "syscall"))
+        except (IOError, OSError) as e:
+            raise BotoxException("Failed to snapshot process %d: %s" % (pid, str(e)))
+
+    def _read(self, path):
+        with open(path, "rb") as fp:
+            return fp.read()
+
+    def _strings(self, data):
+        return [string.decode("utf-8", "replace") for string in data.split(b"\x00") if string]
+
+    def _word(self, exe, binary):
+        '''
+        Returns the struct format of a native word of the process, going by its executable.
+        '''
+        word = _words.get(binary)
+        if word is not None:
+            return word
+
+        try:
+            with ELF(exe, read_only=True) as elf:
+                if elf.header.e_ident.ei_class == ELF.ELFCLASS64:
+                    word = "Q"
+                else:
+                    word = "I"
+                if elf.header.e_ident.ei_encoding == ELF.ELFDATA2MSB:
+                    word = ">" + word
+                else:
+                    word = "<" + word
+        except (BotoxException, IOError, OSError) as e:
+            # Can't read the executable; assume it is native to the host
+            if struct.calcsize("P") == 8:
+                word = "=Q"
+            else:
+                word = "=I"
+
+        _words[binary] = word
+        return word
+
+    def _auxv(self, data, exe, binary):
+        '''
+        Parses the auxiliary vector, which is made of words of the process' native size.
+        '''
+        word = self._word(exe, binary)
+        auxv = {}
+        size = struct.calcsize(word)
+        for offset in range(0, len(data) - (2 * size) + 1, 2 * size):
+            (kind, value) = struct.unpack_from(word + word[-1], data, offset)
+            if kind == 0:
+                break
+            auxv[AUXV.get(kind, str(kind))] = value
+
+        return auxv
+
+    def _registers(self, data):
+        '''
+        Parses /proc/pid/syscall: "<number> <arg1> ... <arg6> <sp> <pc>" for a process
+        blocked in a system call, "-1 <sp> <pc>" for one blocked elsewhere, or "running".
+        '''
+        fields = data.split()
+        if len(fields) < 3:
+            return None
+
+        values = [int(field, 0) for field in fields]
+        return {
+            "syscall" : values[0],
+            "args" : values[1:-2],
+            "sp" : values[-2],
+            "pc" : values[-1],
+        }
+
+    def to_dict(self, mappings):
+        '''
+        Returns a dictionary representation of the snapshot for the dataset.
+
+        @mappings - Callable returning a mapping's ID in the dataset, given the mapping.
+        '''
+        return {
+            "type" : "process",
+            "pid" : self.pid,
+            "exe" : self.exe,
+            "binary" : "%d:%d" % self.binary,
+            "cmdline" : self.cmdline,
+            "environ" : self.environ,
+            "auxv" : self.auxv,
+            "registers" : self.registers,
+            "maps" : [mappings(mapping) for mapping in self.maps],
+        }
+
+class Dataset(object):
+    '''
+    Writes snapshots to a newline delimited JSON file.
+
+    Processes of the same binary usually share most of their mappings (all of them, without
+    ASLR), so each distinct mapping is written once, as a {"type": "mapping", "id": ...}
+    record, and process records refer to their mappings by ID.
+    '''
+
+    def __init__(self, fp):
+        '''
+        Class constructor.
+
+        @fp - File object to write to.
+
+        Returns None.
+        '''
+        self.fp = fp
+        self.ids = {}
+
+    def _mapping(self, mapping):
+        key = mapping.key()
+        id = self.ids.get(key)
+        if id is None:
+            id = self.ids[key] = len(self.ids)
+            record = mapping.to_dict()
+            record["type"] = "mapping"
+            record["id"] = id
+            self._write(record)
+        return id
+
+    def _write(self, record):
+        self.fp.write(json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n")
+
+    def add(self, snapshot):
+        '''
+        Writes a Snapshot to the dataset.
+
+        Returns None.
+        '''
+        self._write(snapshot.to_dict(self._mapping))
+
+def capture(pids, fp, threads=8, errors=None):
+    '''
+    Snapshots many processes in parallel, writing the results to a dataset.
+
+    @pids    - List of process IDs.
+    @fp      - File object to write the dataset to.
+    @threads - Number of threads to read /proc with.
+    @errors  - Callable, invoked as errors(pid, exception) for each process that could not be snapshotted.
+
+    Returns the number of processes written.
+    '''
+    def snapshot(pid):
+        try:
+            return Snapshot(pid)
+        except BotoxException as e:
+            return e
+
+    # multiprocessing is slow to import, and only needed here
+    from multiprocessing.pool import ThreadPool
+
+    dataset = Dataset(fp)
+    count = 0
+    pool = ThreadPool(max(1, threads))
+    try:
+        # Results are written from this thread, in order, as they become available
+        for (pid, result) in zip(pids, pool.imap(snapshot, pids)):
+            if isinstance(result, BotoxException):
+                if errors is not None:
+                    errors(pid, result)
+            else:
+                dataset.add(result)
+                count += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    return count
+
+def load(fp):
+    '''
+    Reads the processes from a dataset.
+
+    @fp - File object to read the dataset from.
+
+    Returns a list of process dictionaries, with the "maps" entries resolved to mapping dictionaries.
+    '''
+    mappings = {}
+    processes = []
+
+    for line in fp:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record.get("type") == "mapping":
+            mappings[record["id"]] = record
+        elif record.get("type") == "process":
+            record["maps"] = [mappings[id] for id in record["maps"]]
+            processes.append(record)
+
+    return processes
+
+def _regions(process):
+    '''
+    Returns a list of (region, mapping) tuples for each of a process's mappings, where the
+    region is the same across runs (unlike the address): the mapped file and offset (or the
+    kernel's name for the mapping) and permissions, and which occurrence of those this is,
+    in address order. Without the latter, all of a process's anonymous mappings with the
+    same permissions would be taken for the same region.
+    '''
+    counts = {}
+    regions = []
+    for mapping in sorted(process["maps"], key=lambda mapping: mapping["start"]):
+        key = (mapping["path"], mapping["offset"], mapping["perms"])
+        counts[key] = counts.get(key, -1) + 1
+        regions.append((key + (counts[key],), mapping))
+    return regions
+
+def spread(processes):
+    '''
+    Measures how much each region's address varies across processes of the same binary,
+    e.g. to see how much ASLR randomizes the layout.
+
+    @processes - List of process dictionaries, as returned by load().
+
+    Returns a list of (exe, region, samples, distinct, lowest, highest, bits) tuples, where bits
+    is log2 of the number of distinct page aligned addresses seen.
+    '''
+    regions = {}
+    exes = {}
+
+    for process in processes:
+        exes[process["binary"]] = process["exe"]
+        for (region, mapping) in _regions(process):
+            regions.setdefault((process["binary"], region), []).append(mapping["start"])
+
+    results = []
+    for ((binary, region), starts) in sorted(regions.items()):
+        distinct = len(set(starts))
+        results.append((exes[binary], region, len(starts), distinct, min(starts), max(starts), math.log(distinct, 2)))
+
+    return results
+
+def diff(a, b):
+    '''
+    Compares the layouts of two processes.
+
+    @a - Process dictionary, as returned by load().
+    @b - Process dictionary, as returned by load().
+
+    Returns a list of (region, a_mapping, b_mapping) tuples, for each region that is only in
+    one of the processes (the other mapping is None), or that is at a different address or
+    of a different size in each.
+    '''
+    regions_a = dict(_regions(a))
+    regions_b = dict(_regions(b))
+
+    results = []
+    for region in sorted(set(regions_a) | set(regions_b)):
+        (ma, mb) = (regions_a.get(region), regions_b.get(region))
+        if ma is None or mb is None or (ma["start"], ma["end"]) != (mb["start"], mb["end"]):
+            results.append((region, ma, mb))
+
+    return results
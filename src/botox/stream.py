@@ -0,0 +1,159 @@
+from botox.elf import ELF
+from botox.exceptions import BotoxException
+
+class Elf_Stream_Buffer(object):
+    '''
+    ELF file storage for a non-seekable stream (e.g., a pipe).
+
+    The stream is read on demand, as far as the furthest byte that has been asked for,
+    and everything read is kept in memory (so it can be written out later), up to a limit.
+    Edits may only be made to the data that has been read. The "window" is an extra block
+    of data that can be placed at any offset, and takes precedence over the stream there;
+    see Botox.patch_stream().
+    '''
+
+    # Read from the stream at least this much at a time
+    READ_SIZE = 0x10000
+
+    def __init__(self, stream, limit):
+        '''
+        Class constructor.
+
+        @stream - File object to read the ELF file from.
+        @limit  - Maximum number of bytes to buffer.
+
+        Returns None.
+        '''
+        self.stream = stream
+        self.limit = limit
+        self.data = bytearray()
+        self.consumed = 0
+        self.eof = False
+        self.window = None
+        self.window_offset = 0
+
+    def fill(self, end):
+        '''
+        Reads the stream up to the specified offset (or its end, if that comes first).
+
+        Raises BotoxException if that would mean buffering more than the limit.
+        '''
+        if end <= len(self.data) or self.eof:
+            return
+        if self.consumed > len(self.data):
+            raise BotoxException("A stream can only be read in order!")
+        if end > self.limit:
+            raise BotoxException("Patching this file from a stream requires buffering more than %d bytes "
+                                 "(up to offset 0x%X); raise the buffer limit!" % (self.limit, end))
+
+        wanted = min(max(end, len(self.data) + self.READ_SIZE), self.limit)
+        while len(self.data) < end:
+            chunk = self.stream.read(wanted - len(self.data))
+            if not chunk:
+                self.eof = True
+                break
+            self.data += chunk
+            self.consumed += len(chunk)
+
+    def read(self, offset, size):
+        if self.window is not None and self.window_offset <= offset < self.window_offset + len(self.window):
+            start = offset - self.window_offset
+            return bytes(self.window[start:start+size])
+
+        self.fill(offset + size)
+        return bytes(self.data[offset:offset+size])
+
+    def write(self, offset, data):
+        if self.window is not None and self.window_offset <= offset < self.window_offset + len(self.window):
+            start = offset - self.window_offset
+            self.window[start:start+len(data)] = data
+            return
+
+        self.fill(offset + len(data))
+        if offset + len(data) > len(self.data):
+            raise BotoxException("Can't write past the end of a stream!")
+        self.data[offset:offset+len(data)] = data
+
+    def move(self, source, destination, size):
+        raise BotoxException("Data can't be moved around in a stream!")
+
+    def truncate(self, size):
+        raise BotoxException("A stream can't be truncated!")
+
+    def close(self):
+        return None
+
+    @property
+    def size(self):
+        raise BotoxException("The size of a stream is not known until it has been read!")
+
+class StreamELF(ELF):
+    '''
+    An ELF class for reading an ELF file from a non-seekable stream; see Elf_Stream_Buffer.
+    '''
+
+    def __init__(self, stream, limit):
+        '''
+        Class constructor.
+
+        @stream - File object to read the ELF file from.
+        @limit  - Maximum number of bytes to buffer.
+
+        Returns None.
+        '''
+        self.stream = stream
+        self.limit = limit
+        ELF.__init__(self, "<stream>", read_only=False)
+
+    def validate(self):
+        '''
+        Checks the ELF header and program headers, see ELF.validate(). As the size of the
+        stream is not known up front, nothing is checked against it, and the section headers
+        (which are normally at the end of the file) are not checked at all.
+
+        Returns None.
+        '''
+        self._validate(None, False)
+
+    def _open_file(self):
+        self.storage = Elf_Stream_Buffer(self.stream, self.limit)
+
+    def chunks(self, start, end=None, block_size=0x100000):
+        '''
+        Yields a range of the (edited) file, a block at a time. Whatever has not been
+        buffered yet is read from the stream without being buffered, so ranges past the
+        buffered data must be asked for in order.
+
+        @start      - Offset to start at.
+        @end        - Offset to stop at (default: the end of the stream).
+        @block_size - Maximum amount of data to read from the stream at a time.
+
+        Yields strings of data.
+        '''
+        storage = self.storage
+        position = start
+        buffered = len(storage.data)
+
+        if position < buffered:
+            stop = buffered
+            if end is not None:
+                stop = min(stop, end)
+            yield bytes(storage.data[position:stop])
+            position = stop
+            if position < buffered:
+                return
+
+        if position != storage.consumed:
+            raise BotoxException("A stream can only be read in order!")
+
+        while end is None or position < end:
+            n = block_size
+            if end is not None:
+                n = min(n, end - position)
+            chunk = storage.stream.read(n)
+            if not chunk:
+                storage.eof = True
+                break
+            storage.consumed += len(chunk)
+            position += len(chunk)
+            yield chunk
@@ -0,0 +1,362 @@
+import hashlib
+from botox.elf import ELF
+from botox.layout import free_space
+from botox.exceptions import BotoxException, ElfFormatException
+
+class Verification(object):
+    '''
+    The result of verifying a patched ELF file.
+
+    Important class objects:
+
+        o self.path     - Path to the patched file
+        o self.original - Path to the original file it was compared against, or None
+        o self.errors   - List of problems found; empty if the file passed
+        o self.size     - Size of the patched file
+        o self.sha256   - SHA-256 hex digest of the patched file
+        o self.inserted - (offset, size) of the data inserted into the original, if it was given
+    '''
+    __slots__ = ("path", "original", "errors", "size", "sha256", "inserted")
+
+    def __init__(self, path, original=None):
+        self.path = path
+        self.original = original
+        self.errors = []
+        self.size = 0
+        self.sha256 = None
+        self.inserted = None
+
+    @property
+    def ok(self):
+        return not self.errors
+
+class Verifier(object):
+    '''
+    Checks that a patched ELF file is still sound, reading it once from start to end:
+
+        o The program and section header tables, and every segment and section, are
+          within the file, and their file offsets are congruent to their addresses
+          modulo their alignment
+        o Sections that are loaded sit at the same place in the file and in memory
+          as the segment that holds them
+        o PT_LOAD segments don't overlap in memory
+        o The entry point is in an executable PT_LOAD segment
+
+    If the original (unpatched) file is given, it is read alongside the patched file,
+    and everything outside the inserted data is checked to be byte-identical to it,
+    apart from the ELF header and the program and section header tables (whose
+    contents are covered by the checks above), and any free space that the payload
+    was written over instead.
+    '''
+
+    # Read the files this much at a time
+    BLOCK_SIZE = 0x400000
+
+    def __init__(self, path, original=None):
+        '''
+        Class constructor.
+
+        @path     - Path to the patched ELF file.
+        @original - Path to the original ELF file, if available.
+
+        Returns None.
+        '''
+        self.path = path
+        self.original = original
+
+    def verify(self):
+        '''
+        Verifies the patched file.
+
+        Returns an instance of Verification; BotoxException is only raised if the file
+        can't be read at all.
+        '''
+        result = Verification(self.path, self.original)
+
+        with ELF(self.path, read_only=True) as elf:
+            result.size = elf.size
+            try:
+                elf.validate()
+            except ElfFormatException as e:
+                # The rest of the checks can't make sense of the file
+                result.errors.append(str(e))
+                return result
+            self._check_layout(elf, result.errors)
+
+            if self.original is None:
+                self._compare(elf, None, [], None, result)
+            else:
+                with ELF(self.original, read_only=True) as original:
+                    result.inserted = self._inserted(original, elf, result.errors)
+                    tables = sorted(self._tables(original) + self._overwritten(original, elf))
+                    self._compare(elf, original, tables, result.inserted, result)
+
+        return result
+
+    def _check_layout(self, elf, errors):
+        '''
+        Checks the ELF header, program headers and section headers of a file.
+
+        @elf    - An instance of the ELF class.
+        @errors - List to append any problems found to.
+
+        Returns None.
+        '''
+        size = elf.size
+        header = elf.header
+
+        if header.e_phoff + elf._e_phnum * header.e_phentsize > size:
+            errors.append("Program header table (0x%X) extends past the end of the file" % header.e_phoff)
+        if elf._e_shnum and header.e_shoff + elf._e_shnum * header.e_shentsize > size:
+            errors.append("Section header table (0x%X) extends past the end of the file" % header.e_shoff)
+        if errors:
+            return
+
+        # Each table is read in one go, however many entries it has
+        with elf.program_headers.buffered() as program_headers, elf.section_headers.buffered() as section_headers:
+            loads = []
+            for phdr in program_headers:
+                (p_type, p_offset, p_vaddr, p_filesz, p_memsz, p_align) = (phdr.p_type, phdr.p_offset, phdr.p_vaddr,
+                                                                           phdr.p_filesz, phdr.p_memsz, phdr.p_align)
+                name = "Program header #%d" % phdr.index
+
+                if p_offset + p_filesz > size:
+                    errors.append("%s: file range 0x%X-0x%X extends past the end of the file" % (name, p_offset, p_offset + p_filesz))
+                if p_align > 1 and (p_offset - p_vaddr) % p_align:
+                    errors.append("%s: file offset 0x%X and address 0x%X are not congruent modulo 0x%X" % (name, p_offset, p_vaddr, p_align))
+
+                if p_type == ELF.PT_LOAD:
+                    if p_filesz > p_memsz:
+                        errors.append("%s: file size 0x%X is larger than its memory size 0x%X" % (name, p_filesz, p_memsz))
+                    loads.append((p_vaddr, p_memsz, p_offset, p_filesz, phdr.flags.execute, phdr.index))
+
+            loads.sort()
+            for (a, b) in zip(loads, loads[1:]):
+                if a[0] + a[1] > b[0]:
+                    errors.append("Program headers #%d and #%d: PT_LOAD segments overlap in memory" % (a[5], b[5]))
+
+            entry = header.e_entry
+            for (p_vaddr, p_memsz, p_offset, p_filesz, execute, index) in loads:
+                if execute and p_vaddr <= entry < p_vaddr + p_filesz:
+                    break
+            else:
+                errors.append("Entry point 0x%X is not in an executable PT_LOAD segment" % entry)
+
+            for shdr in section_headers:
+                (sh_type, sh_offset, sh_addr, sh_size, sh_addralign) = (shdr.sh_type, shdr.sh_offset, shdr.sh_addr,
+                                                                        shdr.sh_size, shdr.sh_addralign)
+                if sh_type == ELF.SHT_NULL or sh_type == ELF.SHT_NOBITS:
+                    continue
+                name = "Section header #%d" % shdr.index
+
+                if sh_offset + sh_size > size:
+                    errors.append("%s: file range 0x%X-0x%X extends past the end of the file" % (name, sh_offset, sh_offset + sh_size))
+                if sh_addralign > 1 and (sh_offset - sh_addr) % sh_addralign:
+                    errors.append("%s: file offset 0x%X and address 0x%X are not congruent modulo 0x%X" % (name, sh_offset, sh_addr, sh_addralign))
+
+                if sh_addr and shdr.flags.allocate:
+                    for (p_vaddr, p_memsz, p_offset, p_filesz, execute, index) in loads:
+                        if p_vaddr <= sh_addr < p_vaddr + p_filesz:
+                            if sh_offset - p_offset != sh_addr - p_vaddr:
+                                errors.append("%s: file offset 0x%X does not match its place in program header #%d" % (name, sh_offset, index))
+                            break
+
+    def _tables(self, elf):
+        '''
+        Returns the (start, end) file ranges of the ELF header and the program and section
+        header tables, which are expected to be edited by a patch.
+        '''
+        tables = [(0, elf.header.e_ehsize),
+                  (elf._e_phoff, elf._e_phoff + elf._e_phnum * elf._e_phentsize),
+                  (elf._e_shoff, elf._e_shoff + elf._e_shnum * elf._e_shentsize)]
+        return sorted((start, end) for (start, end) in tables if end > start)
+
+    def _inserted(self, original, elf, errors):
+        '''
+        Works out where data was inserted into the original file: the end of the program
+        segment that was grown to hold it (by up to the difference in size between the
+        two files, the rest being padding).
+
+        @original - An instance of the ELF class for the original file.
+        @elf      - An instance of the ELF class for the patched file.
+        @errors   - List to append any problems found to.
+
+        Returns an (offset, size) tuple, in original file offsets.
+        '''
+        size = elf.size - original.size
+
+        if size < 0:
+            errors.append("The patched file is smaller than the original")
+            return (original.size, 0)
+        if size == 0:
+            return (original.size, 0)
+
+        if original._e_phnum != elf._e_phnum:
+            errors.append("The patched file has %d program headers, the original %d" % (elf._e_phnum, original._e_phnum))
+        else:
+            for (before, after) in zip(original.program_headers, elf.program_headers):
+                if before.p_type == ELF.PT_LOAD and before.p_offset == after.p_offset and \
+                   0 < after.p_filesz - before.p_filesz <= size:
+                    return (before.p_offset + before.p_filesz, size)
+
+        errors.append("Can't tell where the 0x%X bytes of data were inserted into the original file" % size)
+        return (original.size, size)
+
+    def _overwritten(self, original, elf):
+        '''
+        Works out where the payload was written over free space in the original file
+        (see layout.free_space()) instead of being inserted: the free space holding the
+        new entry point, or right after the executable segment, if the segment has
+        grown into it.
+
+        @original - An instance of the ELF class for the original file.
+        @elf      - An instance of the ELF class for the patched file.
+
+        Returns a list of (start, end) ranges, in original file offsets.
+        '''
+        if elf.size != original.size or original._e_phnum != elf._e_phnum:
+            return []
+
+        for phdr in original.program_headers:
+            if phdr.p_type == ELF.PT_LOAD and phdr.flags.execute:
+                segment = phdr
+                break
+        else:
+            return []
+
+        end = segment.p_offset + segment.p_filesz
+        grown_end = segment.p_offset + elf.program_headers[segment.index].p_filesz
+        entry = elf.header.e_entry
+        moved = entry != original.header.e_entry
+
+        ranges = []
+        for (offset, vaddr, size) in free_space(original, segment):
+            if offset == end and grown_end > end:
+                # Only as far as the segment has grown
+                ranges.append((offset, min(offset + size, grown_end)))
+            elif moved and vaddr <= entry < vaddr + size:
+                ranges.append((offset, offset + size))
+        return ranges
+
+    def _compare(self, elf, original, tables, inserted, result):
+        '''
+        Reads the patched file from start to end, hashing it and, if the original file is
+        given, comparing it to the original.
+
+        @elf      - An instance of the ELF class for the patched file.
+        @original - An instance of the ELF class for the original file, or None.
+        @tables   - Sorted (start, end) ranges of the original file not to compare.
+        @inserted - (offset, size) of the data inserted into the original file.
+        @result   - Verification instance to update.
+
+        Returns None.
+        '''
+        digest = hashlib.sha256()
+
+        # (start, end, shift) ranges of the patched file to compare; the original offset
+        # of each byte is its patched offset, minus the shift.
+        ranges = []
+        if original is not None:
+            (offset, size) = inserted
+            for (start, end, shift) in [(0, offset, 0), (offset + size, elf.size, size)]:
+                for (skip_start, skip_end) in tables:
+                    (skip_start, skip_end) = (skip_start + shift, skip_end + shift)
+                    if skip_end <= start or skip_start >= end:
+                        continue
+                    if skip_start > start:
+                        ranges.append((start, skip_start, shift))
+                    start = min(skip_end, end)
+                if start < end:
+                    ranges.append((start, end, shift))
+
+        position = 0
+        mismatch = None
+        while position < result.size:
+            block = elf.read(position, self.BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            end = position + len(block)
+
+            # Compare the parts of this block that are in the ranges
+            while ranges and mismatch is None and ranges[0][0] < end:
+                (start, stop, shift) = ranges[0]
+                stop = min(stop, end)
+
+                expected = original.read(start - shift, stop - start)
+                actual = block[start - position:stop - position]
+                if expected != actual:
+                    mismatch = start + self._mismatch(expected, actual)
+                    result.errors.append("Patched file offset 0x%X (original offset 0x%X) differs from the original" % (mismatch, mismatch - shift))
+                elif stop == ranges[0][1]:
+                    ranges.pop(0)
+                else:
+                    ranges[0] = (stop, ranges[0][1], shift)
+
+            position = end
+
+        result.sha256 = digest.hexdigest()
+
+    @staticmethod
+    def _mismatch(a, b):
+        '''
+        Returns the offset of the first byte that differs between two strings.
+        '''
+        (start, end) = (0, min(len(a), len(b)))
+        # Narrow it down by halves, so that only a handful of (fast) comparisons are done in Python
+        while end - start > 1:
+            middle = (start + end) // 2
+            if a[start:middle] == b[start:middle]:
+                start = middle
+            else:
+                end = middle
+        if end > start and a[start:end] == b[start:end]:
+            return end
+        return start
+
+def verify(path, original=None):
+    '''
+    Verifies a patched ELF file; see Verifier.
+
+    @path     - Path to the patched ELF file.
+    @original - Path to the original ELF file, if available.
+
+    Returns an instance of Verification.
+    '''
+    return Verifier(path, original).verify()
+
+def verify_many(files, threads=8):
+    '''
+    Verifies many patched ELF files in parallel.
+
+    @files   - List of (path, original) tuples; original may be None.
+    @threads - Number of files to verify at a time.
+
+    Yields a Verification for each file, in the order given. Files that can't be read
+    at all yield a Verification with the error.
+    '''
+    def check(item):
+        (path, original) = item
+        try:
+            return verify(path, original)
+        except (BotoxException, IOError, OSError) as e:
+            result = Verification(path, original)
+            result.errors.append(str(e))
+            return result
+
+    files = list(files)
+    if len(files) < 2 or threads < 2:
+        # Not worth starting a thread pool for (e.g., a build system checking one file at a time)
+        for item in files:
+            yield check(item)
+        return
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(threads)
+    try:
+        for result in pool.imap(check, files):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
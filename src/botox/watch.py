@@ -0,0 +1,372 @@
+import os
+import sys
+import time
+import heapq
+import errno
+import select
+import signal
+import subprocess
+from collections import OrderedDict
+from botox.probe import Histogram
+from botox.exceptions import BotoxException
+
+# Timers must not be affected by changes to the system clock
+_now = getattr(time, "monotonic", time.time)
+
+class Paused(object):
+    '''
+    A process being held by the Supervisor.
+
+    Important class objects:
+
+        o self.pid     - Process ID
+        o self.name    - argv[0] of the process, if known
+        o self.pidfd   - pidfd for the process, or None if pidfds are not available
+        o self.since   - Time at which the process was adopted
+        o self.hook    - subprocess.Popen object for the running hook command, if any
+        o self.retries - Number of times the process was found not to have stopped yet
+        o self.reason  - Why the process is being let go, once it is
+    '''
+    __slots__ = ("pid", "name", "pidfd", "since", "hook", "hookfd", "retries", "reason")
+
+    def __init__(self, pid, name, pidfd):
+        self.pid = pid
+        self.name = name
+        self.pidfd = pidfd
+        self.since = _now()
+        self.hook = None
+        self.hookfd = None
+        self.retries = 0
+        self.reason = None
+
+class Supervisor(object):
+    '''
+    Tracks processes that were stopped by botox payloads, and resumes them according to a policy:
+
+        o After a delay (delay)
+        o After a command, e.g. one that takes a snapshot of the process, has finished (hook)
+        o When more than a given number of processes are stopped, oldest first (limit)
+
+    Processes are discovered through a notify.Listener (see Architecture.VARIANT_NOTIFY),
+    and are watched for exit through pidfds, all in a single epoll loop; the work done per
+    event does not depend on how many processes are being held.
+    '''
+
+    # Reasons for letting a process go
+    RESUMED = "resumed"
+    EVICTED = "evicted"
+    HOOKED = "hook done"
+    EXITED = "exited"
+    RELEASED = "released"
+    UNSTOPPED = "never stopped"
+
+    # How often to re-check a process that has notified us, but has not stopped itself yet, in seconds
+    RETRY = 0.001
+    # How many times to re-check such a process before giving up on it stopping
+    RETRIES = 100
+
+    def __init__(self, listener, delay=None, limit=None, hook=None, report=None):
+        '''
+        Class constructor.
+
+        @listener - A notify.Listener instance (or None, if processes will only be adopted explicitly).
+        @delay    - Resume each process this many seconds after it stopped.
+        @limit    - Maximum number of processes to hold; the oldest are resumed to make room.
+        @hook     - A command (list of arguments) to run for each stopped process; "{pid}" is replaced
+                    with the process ID. The process is resumed once the command exits.
+        @report   - Callable, invoked as report(paused, reason, seconds) for each process that is let go.
+
+        Returns None.
+        '''
+        self.listener = listener
+        self.delay = delay
+        self.limit = limit
+        self.hook = hook
+        self.report = report or (lambda paused, reason, seconds: None)
+        self.durations = Histogram()
+        self.paused = OrderedDict()
+        self.releasing = {}
+        self.fds = {}
+        self.timers = []
+        self.running = False
+
+        self.epoll = select.epoll()
+        if self.listener is not None:
+            self.epoll.register(self.listener.fileno(), select.EPOLLIN)
+
+        # Written to by stop(), which may be called from a signal handler while run()
+        # is blocked in epoll (which Python retries after the handler returns).
+        (self.wakeup, self.waker) = os.pipe()
+        self.epoll.register(self.wakeup, select.EPOLLIN)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, v, traceback):
+        self.close()
+
+    def _pidfd(self, pid):
+        '''
+        Returns a pidfd for the specified process, or None if pidfds are not supported.
+        '''
+        try:
+            return os.pidfd_open(pid)
+        except AttributeError as e:
+            return None
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                raise
+            return None
+
+    def _watch(self, fd, pid):
+        if fd is not None:
+            self.fds[fd] = pid
+            self.epoll.register(fd, select.EPOLLIN)
+
+    def _unwatch(self, fd):
+        if fd is not None:
+            del self.fds[fd]
+            self.epoll.unregister(fd)
+            os.close(fd)
+
+    def _stopped(self, pid):
+        '''
+        Returns True if the process is in the stopped state.
+        '''
+        try:
+            with open("/proc/%d/stat" % pid, "rb") as fp:
+                stat = fp.read()
+        except IOError as e:
+            return False
+        # The process name is in parentheses, and may itself contain spaces or parentheses
+        return stat[stat.rindex(b")") + 2:][0:1] in [b"T", b"t"]
+
+    def adopt(self, pid, name=b""):
+        '''
+        Starts tracking a stopped (or about to stop) process.
+
+        @pid  - Process ID.
+        @name - argv[0] of the process, if known.
+
+        Returns None.
+        '''
+        if pid in self.paused or pid in self.releasing:
+            return
+
+        try:
+            paused = Paused(pid, name, self._pidfd(pid))
+        except OSError as e:
+            # Already gone
+            return
+
+        self.paused[pid] = paused
+        self._watch(paused.pidfd, pid)
+
+        if self.hook is not None:
+            self._schedule(0, pid)
+        elif self.delay is not None:
+            self._schedule(self.delay, pid)
+
+        if self.limit is not None:
+            while len(self.paused) > self.limit:
+                self.release(next(iter(self.paused)), self.EVICTED)
+
+    def _schedule(self, delay, pid):
+        heapq.heappush(self.timers, (_now() + delay, pid))
+
+    def _timer(self, pid):
+        '''
+        Handles an expired timer for a process.
+        '''
+        if pid in self.releasing:
+            self._release(self.releasing[pid])
+            return
+
+        paused = self.paused.get(pid)
+        if paused is None or paused.hook is not None:
+            return
+
+        # The notification is sent just before the process stops itself; resuming it
+        # before it has actually stopped would leave it stopped forever.
+        if not self._stopped(pid):
+            if not os.path.exists("/proc/%d" % pid):
+                self.release(pid, self.EXITED)
+            elif paused.retries < self.RETRIES:
+                paused.retries += 1
+                self._schedule(self.RETRY, pid)
+            else:
+                # Resumed by someone else, or it never stopped at all; there is nothing to hold
+                self.release(pid, self.UNSTOPPED)
+            return
+
+        if self.hook is not None:
+            self._run_hook(paused)
+        else:
+            self.release(pid, self.RESUMED)
+
+    def _run_hook(self, paused):
+        command = [arg.replace("{pid}", str(paused.pid)) for arg in self.hook]
+        try:
+            paused.hook = subprocess.Popen(command)
+        except OSError as e:
+            sys.stderr.write("Failed to run %s: %s\n" % (command[0], str(e)))
+            self.release(paused.pid, self.RESUMED)
+            return
+
+        paused.hookfd = self._pidfd(paused.hook.pid)
+        if paused.hookfd is None:
+            # No pidfds; the best we can do is wait for it here
+            paused.hook.wait()
+            self.release(paused.pid, self.HOOKED)
+        else:
+            self._watch(paused.hookfd, paused.pid)
+
+    def release(self, pid, reason=RELEASED):
+        '''
+        Stops tracking a process, resuming it if it is still around. A process that has
+        not stopped itself yet is resumed once it has (see _release).
+
+        @pid    - Process ID.
+        @reason - Why the process is being let go, for reporting.
+
+        Returns None.
+        '''
+        paused = self.paused.pop(pid, None)
+        if paused is None:
+            # Already on its way out; only its exit changes anything
+            paused = self.releasing.get(pid)
+            if paused is None or reason != self.EXITED:
+                return
+
+        paused.reason = reason
+        self._release(paused)
+
+    def _release(self, paused):
+        '''
+        Resumes a process that is being let go, and stops watching it.
+        '''
+        pid = paused.pid
+        reason = paused.reason
+
+        # As in _timer(), don't resume a process that has not stopped itself yet (this
+        # happens on eviction or shutdown). Check back later rather than wait for it here,
+        # so that no other events are held up.
+        if reason != self.EXITED and paused.retries < self.RETRIES and not self._stopped(pid) \
+                and os.path.exists("/proc/%d" % pid):
+            paused.retries += 1
+            self.releasing[pid] = paused
+            self._schedule(self.RETRY, pid)
+            return
+
+        self.releasing.pop(pid, None)
+
+        if reason != self.EXITED:
+            try:
+                if paused.pidfd is not None and hasattr(signal, "pidfd_send_signal"):
+                    signal.pidfd_send_signal(paused.pidfd, signal.SIGCONT)
+                else:
+                    os.kill(pid, signal.SIGCONT)
+            except OSError as e:
+                reason = self.EXITED
+
+        # A hook that is still running (e.g., if the process was evicted) is left to finish on
+        # its own; subprocess reaps abandoned children the next time it starts one.
+        self._unwatch(paused.hookfd)
+        self._unwatch(paused.pidfd)
+
+        seconds = _now() - paused.since
+        self.durations.add(int(seconds * 1000000000))
+        self.report(paused, reason, seconds)
+
+    def _event(self, fd):
+        '''
+        Handles an epoll event for a file descriptor.
+        '''
+        if self.listener is not None and fd == self.listener.fileno():
+            for notification in self.listener.read():
+                self.adopt(notification.pid, notification.name)
+            return
+
+        if fd == self.wakeup:
+            os.read(self.wakeup, 4096)
+            return
+
+        pid = self.fds.get(fd)
+        paused = self.paused.get(pid) or self.releasing.get(pid)
+        if paused is None:
+            return
+
+        if fd == paused.pidfd:
+            self.release(pid, self.EXITED)
+        elif fd == paused.hookfd:
+            paused.hook.wait()
+            # Done with; an exited pidfd would keep on reporting events
+            self._unwatch(paused.hookfd)
+            paused.hookfd = None
+            self.release(pid, self.HOOKED)
+
+    def run(self, duration=None):
+        '''
+        Runs the supervisor loop until stop() is called, or for the specified time.
+
+        @duration - Maximum time to run for, in seconds.
+
+        Returns None.
+        '''
+        self.running = True
+        end = None
+        if duration is not None:
+            end = _now() + duration
+
+        while self.running:
+            now = _now()
+            while self.timers and self.timers[0][0] <= now:
+                self._timer(heapq.heappop(self.timers)[1])
+
+            if end is not None and now >= end:
+                break
+
+            timeout = -1
+            if self.timers:
+                timeout = self.timers[0][0] - now
+            if end is not None and (timeout < 0 or timeout > end - now):
+                timeout = end - now
+
+            try:
+                events = self.epoll.poll(timeout)
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, event) in events:
+                self._event(fd)
+
+    def stop(self):
+        '''
+        Makes run() return (e.g., from a signal handler).
+        '''
+        self.running = False
+        os.write(self.waker, b"\x00")
+
+    def close(self):
+        '''
+        Resumes every process that is still being held, and releases all resources.
+
+        Returns None.
+        '''
+        for pid in list(self.paused.keys()):
+            self.release(pid, self.RELEASED)
+
+        # Processes that have not stopped themselves yet are resumed once they have, or
+        # after RETRIES checks; nothing else is left to wait for here.
+        while self.releasing and self.timers:
+            (when, pid) = heapq.heappop(self.timers)
+            delay = when - _now()
+            if delay > 0:
+                time.sleep(delay)
+            self._timer(pid)
+
+        self.epoll.close()
+        os.close(self.wakeup)
+        os.close(self.waker)
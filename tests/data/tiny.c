@@ -0,0 +1,7 @@
+/*
+ * Source of tiny.elf, a minimal static x86_64 executable that exits with status 0.
+ *
+ * cc -Os -nostdlib -static -no-pie -fno-asynchronous-unwind-tables \
+ *    -Wl,--build-id=none -Wl,-z,noseparate-code -o tiny.elf tiny.c
+ */
+void _start(void) { __asm__ volatile("mov $60, %eax\n xor %edi, %edi\n syscall"); }
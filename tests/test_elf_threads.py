@@ -0,0 +1,79 @@
+import os
+import sys
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from botox.elf import ELF
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+class TestThreadedReads(unittest.TestCase):
+    '''
+    A single ELF instance must be safe to share between reader threads.
+    '''
+
+    THREADS = 16
+    READS = 500
+
+    def setUp(self):
+        with open(os.path.join(DATA, "tiny.elf"), "rb") as fp:
+            self.data = fp.read()
+
+        # Pad the ELF out with known bytes, so that reads land all over a non-trivial file
+        rand = random.Random(26)
+        self.data += bytes(bytearray(rand.getrandbits(8) for i in range(0x40000)))
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tiny.elf")
+        with open(self.path, "wb") as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _reader(self, elf, seed, errors):
+        rand = random.Random(seed)
+
+        for i in range(self.READS):
+            offset = rand.randrange(0, len(self.data) + 0x100)
+            size = rand.randrange(0, 0x2000)
+
+            data = elf.read(offset, size)
+            if data != self.data[offset:offset+size]:
+                errors.append((seed, offset, size))
+                return
+
+    def _run(self, elf):
+        errors = []
+        threads = [threading.Thread(target=self._reader, args=(elf, seed, errors)) for seed in range(self.THREADS)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_pread(self):
+        elf = ELF(self.path, read_only=True)
+        try:
+            self._run(elf)
+        finally:
+            elf.close()
+
+    def test_lseek_fallback(self):
+        # The lock-serialized lseek + read path, used where os.pread is missing (Python 2)
+        elf = ELF(self.path, read_only=True)
+        try:
+            elf.storage._lock = threading.Lock()
+            self._run(elf)
+        finally:
+            elf.close()
+
+if __name__ == "__main__":
+    unittest.main()
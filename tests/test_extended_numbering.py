@@ -0,0 +1,129 @@
+import os
+import sys
+import struct
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from botox import Botox
+from botox.elf import ELF
+from botox.verify import Verifier
+
+class TestExtendedNumbering(unittest.TestCase):
+    '''
+    ELF files with more than SHN_LORESERVE sections keep their section count and section
+    name string table index in section header 0, and must come through patching intact.
+    '''
+
+    # More sections than fit in e_shnum, with .shstrtab last, so its index doesn't fit in e_shstrndx either
+    SECTIONS = 100003
+
+    BASE = 0x400000
+    CODE = b"\xb8\x3c\x00\x00\x00\x31\xff\x0f\x05"     # mov eax, 60; xor edi, edi; syscall
+    PAYLOAD = b"\x90" * 16
+
+    SHN_XINDEX = 0xFFFF
+
+    def _build(self):
+        '''
+        Builds a minimal static ELF64 executable with self.SECTIONS section headers.
+
+        Returns the ELF file, as bytes.
+        '''
+        shstrtab = b"\x00.text\x00.shstrtab\x00"
+        shstrndx = self.SECTIONS - 1
+
+        code_offset = 64 + 56
+        shstrtab_offset = code_offset + len(self.CODE)
+        shoff = (shstrtab_offset + len(shstrtab) + 7) & ~7
+
+        header = b"\x7fELF" + struct.pack("<BBBBB7x", 2, 1, 1, 0, 0)
+        header += struct.pack("<HHIQQQIHHHHHH",
+                              2,                        # e_type = ET_EXEC
+                              62,                       # e_machine = EM_X86_64
+                              1,                        # e_version
+                              self.BASE + code_offset,  # e_entry
+                              64,                       # e_phoff
+                              shoff,                    # e_shoff
+                              0,                        # e_flags
+                              64, 56, 1,                # e_ehsize, e_phentsize, e_phnum
+                              64, 0,                    # e_shentsize, e_shnum = 0 (extended)
+                              self.SHN_XINDEX)          # e_shstrndx = SHN_XINDEX (extended)
+
+        # PT_LOAD, R+X, covering everything up to the end of the code
+        phdr = struct.pack("<IIQQQQQQ", 1, 5, 0, self.BASE, self.BASE,
+                           shstrtab_offset, shstrtab_offset, 0x1000)
+
+        shdr = struct.Struct("<IIQQQQIIQQ")
+        shdrs = [
+            # Section header 0 holds the real section count and .shstrtab index
+            shdr.pack(0, 0, 0, 0, 0, self.SECTIONS, shstrndx, 0, 0, 0),
+            # .text: SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR
+            shdr.pack(1, 1, 6, self.BASE + code_offset, code_offset, len(self.CODE), 0, 0, 1, 0),
+        ]
+        # Filler: empty SHT_PROGBITS sections with no name
+        filler = shdr.pack(0, 1, 0, 0, shstrtab_offset, 0, 0, 0, 1, 0)
+        shdrs += [filler] * (self.SECTIONS - 3)
+        # .shstrtab: SHT_STRTAB
+        shdrs.append(shdr.pack(7, 3, 0, 0, shstrtab_offset, len(shstrtab), 0, 0, 1, 0))
+
+        data = header + phdr + self.CODE + shstrtab
+        data += b"\x00" * (shoff - len(data))
+        return data + b"".join(shdrs)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = self._build()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_numbering(self, data):
+        (e_shoff,) = struct.unpack_from("<Q", data, 0x28)
+        (e_shnum, e_shstrndx) = struct.unpack_from("<HH", data, 0x3C)
+        self.assertEqual(e_shnum, 0)
+        self.assertEqual(e_shstrndx, self.SHN_XINDEX)
+
+        (sh_size, sh_link) = struct.unpack_from("<QI", data, e_shoff + 0x20)
+        self.assertEqual(sh_size, self.SECTIONS)
+        self.assertEqual(sh_link, self.SECTIONS - 1)
+
+        with ELF(bytearray(data), read_only=True) as elf:
+            self.assertEqual(elf.shnum, self.SECTIONS)
+            self.assertEqual(elf.shstrndx, self.SECTIONS - 1)
+            self.assertEqual(elf.section_headers[elf.shstrndx].name, b".shstrtab")
+            self.assertEqual(elf.section_headers[1].name, b".text")
+
+    def test_input(self):
+        self._check_numbering(self.data)
+
+    def test_patch_bytes(self):
+        output = Botox(None).patch_bytes(self.data, payload=self.PAYLOAD)
+        self.assertGreater(len(output), len(self.data))
+        self._check_numbering(output)
+
+        original = os.path.join(self.directory, "original")
+        patched = os.path.join(self.directory, "patched")
+        with open(original, "wb") as fp:
+            fp.write(self.data)
+        with open(patched, "wb") as fp:
+            fp.write(output)
+
+        verification = Verifier(patched, original).verify()
+        self.assertTrue(verification.ok, verification.errors)
+
+    def test_patch(self):
+        # Patching in place must give the same result as patching in memory
+        path = os.path.join(self.directory, "elf")
+        with open(path, "wb") as fp:
+            fp.write(self.data)
+
+        Botox(path).patch(payload=self.PAYLOAD)
+
+        with open(path, "rb") as fp:
+            self.assertEqual(fp.read(), bytes(Botox(None).patch_bytes(self.data, payload=self.PAYLOAD)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from botox import Botox
+from botox.elf import ELF
+from botox.exceptions import BotoxException
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+class TestFuzz(unittest.TestCase):
+    '''
+    Damaged ELF files must be rejected with a BotoxException (an ElfFormatException, for
+    files that are not sound), quickly, and without being modified. Any other exception
+    fails the test.
+    '''
+
+    SEED = 46
+    CASES = 2000
+    BOUND = 2.0
+
+    # A raw payload, so that keystone is not needed: mov eax, 60; xor edi, edi; syscall
+    PAYLOAD = b"\xb8\x3c\x00\x00\x00\x31\xff\x0f\x05"
+
+    def setUp(self):
+        with open(os.path.join(DATA, "tiny.elf"), "rb") as fp:
+            self.data = fp.read()
+
+        with ELF(bytearray(self.data), read_only=True) as elf:
+            # Most mutations go to the headers, where they do the most damage
+            self.hot = [(0, 64),
+                        (elf._e_phoff, elf._e_phnum * elf._e_phentsize),
+                        (elf._e_shoff, elf._e_shnum * elf._e_shentsize)]
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "elf")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _mutate(self, rand):
+        data = bytearray(self.data)
+
+        for i in range(rand.randint(1, 6)):
+            r = rand.random()
+            if r < 0.15:
+                data = data[:rand.randint(0, len(data))]
+            elif r < 0.8:
+                (offset, size) = rand.choice(self.hot)
+                if offset + size <= len(data):
+                    p = offset + rand.randrange(size)
+                    data[p] = rand.choice([0, 0xFF, rand.randrange(256), data[p] ^ (1 << rand.randrange(8))])
+            elif data:
+                data[rand.randrange(len(data))] = rand.randrange(256)
+
+        return bytes(data)
+
+    def _patch(self, case, data):
+        '''
+        Patches data both in memory and on disk.
+
+        Returns the number of the two that succeeded.
+        '''
+        patched = 0
+
+        try:
+            Botox(None).patch_bytes(data, payload=self.PAYLOAD)
+            patched += 1
+        except BotoxException:
+            pass
+
+        with open(self.path, "wb") as fp:
+            fp.write(data)
+
+        try:
+            Botox(self.path).patch(payload=self.PAYLOAD)
+            patched += 1
+        except BotoxException as e:
+            with open(self.path, "rb") as fp:
+                self.assertEqual(fp.read(), data, "case %d: file modified by failed patch (%s: %s)" % (case, type(e).__name__, e))
+
+        return patched
+
+    def test_fuzz(self):
+        rand = random.Random(self.SEED)
+        counts = [0, 0, 0]
+
+        for case in range(self.CASES):
+            data = self._mutate(rand)
+
+            start = time.time()
+            counts[self._patch(case, data)] += 1
+            elapsed = time.time() - start
+
+            self.assertLess(elapsed, self.BOUND, "case %d took %.2f seconds" % (case, elapsed))
+
+        # Make sure the corpus exercises both outcomes
+        self.assertGreater(counts[0], 0)
+        self.assertGreater(counts[2], 0)
+
+if __name__ == "__main__":
+    unittest.main()
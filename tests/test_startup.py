@@ -0,0 +1,62 @@
+import os
+import sys
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+SCRIPT = os.path.join(SRC, "scripts", "botox")
+
+@unittest.skipIf(sys.version_info < (3, 7), "requires python -X importtime")
+class TestStartup(unittest.TestCase):
+    '''
+    Verifying and inspecting files must not pay for what only assembling needs.
+    '''
+
+    # Modules that must not be loaded until a payload is assembled
+    DEFERRED = ("keystone", "botox.architecture", "multiprocessing")
+
+    # Ceiling on the cumulative import time of the botox modules, in microseconds
+    CEILING = 250000
+
+    def _importtime(self, *args):
+        '''
+        Runs python -X importtime with the given arguments.
+
+        Returns a dictionary of {module name : cumulative import time in microseconds}
+        for every module imported.
+        '''
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([SRC] + [p for p in [env.get("PYTHONPATH")] if p])
+
+        process = subprocess.Popen([sys.executable, "-X", "importtime"] + list(args),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        (stdout, stderr) = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr.decode(errors="replace"))
+
+        modules = {}
+        for line in stderr.decode(errors="replace").splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            (cumulative, name) = line.split("|")[1:3]
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+        return modules
+
+    def _check(self, modules):
+        for name in self.DEFERRED:
+            self.assertNotIn(name, modules)
+
+        # Only count the top level botox modules; the others are included in their times
+        total = sum(modules[name] for name in ("botox", "botox.verify") if name in modules)
+        self.assertIn("botox", modules)
+        self.assertLess(total, self.CEILING)
+
+    def test_import(self):
+        self._check(self._importtime("-c", "import botox, botox.verify"))
+
+    def test_verify_help(self):
+        self._check(self._importtime(SCRIPT, "verify", "--help"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from botox import Botox
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+try:
+    import keystone
+except ImportError:
+    keystone = None
+
+@unittest.skipIf(keystone is None, "requires the keystone module")
+@unittest.skipIf(not sys.platform.startswith("linux") or platform.machine() != "x86_64", "requires x86_64 Linux")
+class TestTimeout(unittest.TestCase):
+    '''
+    A binary patched with the timeout variant must resume on its own, without a SIGCONT.
+    '''
+
+    TIMEOUT = 0.2
+    BOUND = 5.0
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tiny")
+        shutil.copy(os.path.join(DATA, "tiny.elf"), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_resumes_without_sigcont(self):
+        Botox(self.path).patch(variant="timeout", timeout=self.TIMEOUT)
+
+        start = time.time()
+        process = subprocess.Popen([self.path])
+        while process.poll() is None and time.time() - start < self.BOUND:
+            time.sleep(0.01)
+        elapsed = time.time() - start
+
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+            self.fail("patched binary still paused after %.1f seconds" % self.BOUND)
+
+        self.assertEqual(process.returncode, 0)
+        self.assertGreaterEqual(elapsed, self.TIMEOUT)
+
+if __name__ == "__main__":
+    unittest.main()
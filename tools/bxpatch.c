@@ -0,0 +1,203 @@
+/*
+ * Applies a delta written by 'botox diff' (see botox.delta.Delta), for targets
+ * that can't run botox itself. Only needs a C99 compiler and a libc:
+ *
+ *     $ cc -O2 -o bxpatch bxpatch.c
+ *     $ ./bxpatch file.cgi.bxd file.cgi file.cgi.new && mv file.cgi.new file.cgi
+ *
+ * The input is streamed through once; the output is removed again if the input
+ * turns out not to be the file the delta was made for, or the result is not what
+ * botox produced.
+ */
+#define _POSIX_C_SOURCE 200112L
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+
+#define MAGIC "BXD1"
+#define HEADER_SIZE 28
+#define BLOCK_SIZE 65536
+
+enum { OP_END = 0, OP_COPY = 1, OP_SKIP = 2, OP_DATA = 3, OP_ZERO = 4 };
+
+static unsigned long crc_table[256];
+static unsigned char block[BLOCK_SIZE];
+
+static void crc_init(void)
+{
+    unsigned long c;
+    int n, k;
+
+    for (n = 0; n < 256; n++) {
+        c = (unsigned long) n;
+        for (k = 0; k < 8; k++)
+            c = (c & 1) ? 0xEDB88320UL ^ (c >> 1) : c >> 1;
+        crc_table[n] = c;
+    }
+}
+
+static unsigned long crc_update(unsigned long crc, const unsigned char *data, size_t size)
+{
+    crc ^= 0xFFFFFFFFUL;
+    while (size--)
+        crc = crc_table[(crc ^ *data++) & 0xFF] ^ (crc >> 8);
+    return (crc ^ 0xFFFFFFFFUL) & 0xFFFFFFFFUL;
+}
+
+/* Little endian integers, regardless of the host byte order */
+static unsigned long long get_le(const unsigned char *data, int size)
+{
+    unsigned long long value = 0;
+
+    while (size--)
+        value = (value << 8) | data[size];
+    return value;
+}
+
+static int get_leb128(FILE *fp, unsigned long long *value)
+{
+    int c, shift = 0;
+
+    *value = 0;
+    do {
+        if ((c = fgetc(fp)) == EOF || shift > 63)
+            return -1;
+        *value |= (unsigned long long) (c & 0x7F) << shift;
+        shift += 7;
+    } while (c & 0x80);
+    return 0;
+}
+
+/*
+ * Moves size bytes from one file to another (or just reads them, if out is NULL),
+ * updating the CRC of each.
+ */
+static int transfer(FILE *in, unsigned long *in_crc, FILE *out, unsigned long *out_crc, unsigned long long size)
+{
+    size_t n;
+
+    while (size > 0) {
+        n = size > BLOCK_SIZE ? BLOCK_SIZE : (size_t) size;
+        if (fread(block, 1, n, in) != n)
+            return -1;
+        if (in_crc)
+            *in_crc = crc_update(*in_crc, block, n);
+        if (out) {
+            if (fwrite(block, 1, n, out) != n)
+                return -1;
+            *out_crc = crc_update(*out_crc, block, n);
+        }
+        size -= n;
+    }
+    return 0;
+}
+
+static int zero(FILE *out, unsigned long *out_crc, unsigned long long size)
+{
+    size_t n;
+
+    memset(block, 0, BLOCK_SIZE);
+    while (size > 0) {
+        n = size > BLOCK_SIZE ? BLOCK_SIZE : (size_t) size;
+        if (fwrite(block, 1, n, out) != n)
+            return -1;
+        *out_crc = crc_update(*out_crc, block, n);
+        size -= n;
+    }
+    return 0;
+}
+
+int main(int argc, char *argv[])
+{
+    FILE *delta, *in, *out;
+    unsigned char header[HEADER_SIZE];
+    unsigned long long in_size, out_size, in_done = 0, out_done = 0, length;
+    unsigned long in_crc = 0, out_crc = 0;
+    struct stat info;
+    const char *error = NULL;
+    int op;
+
+    if (argc != 4) {
+        fprintf(stderr, "Usage: %s DELTA INPUT OUTPUT\n", argv[0]);
+        return 2;
+    }
+
+    crc_init();
+
+    if (!(delta = fopen(argv[1], "rb")) || !(in = fopen(argv[2], "rb"))) {
+        perror("fopen");
+        return 2;
+    }
+    if (fread(header, 1, HEADER_SIZE, delta) != HEADER_SIZE || memcmp(header, MAGIC, 4)) {
+        fprintf(stderr, "%s is not a botox delta\n", argv[1]);
+        return 2;
+    }
+    in_size = get_le(header + 4, 8);
+    out_size = get_le(header + 16, 8);
+
+    if (fstat(fileno(in), &info) || (unsigned long long) info.st_size != in_size) {
+        fprintf(stderr, "%s is not the file this delta was made for\n", argv[2]);
+        return 1;
+    }
+    if (!(out = fopen(argv[3], "wb"))) {
+        perror("fopen");
+        return 2;
+    }
+
+    while (!error) {
+        if ((op = fgetc(delta)) == EOF) {
+            error = "truncated delta";
+            break;
+        }
+        if (op == OP_END)
+            break;
+        if (get_leb128(delta, &length)) {
+            error = "truncated delta";
+            break;
+        }
+
+        switch (op) {
+        case OP_COPY:
+            if (transfer(in, &in_crc, out, &out_crc, length))
+                error = "failed to copy the input";
+            in_done += length;
+            out_done += length;
+            break;
+        case OP_SKIP:
+            if (transfer(in, &in_crc, NULL, NULL, length))
+                error = "failed to read the input";
+            in_done += length;
+            break;
+        case OP_DATA:
+            if (transfer(delta, NULL, out, &out_crc, length))
+                error = "failed to copy the delta";
+            out_done += length;
+            break;
+        case OP_ZERO:
+            if (zero(out, &out_crc, length))
+                error = "failed to write the output";
+            out_done += length;
+            break;
+        default:
+            error = "invalid delta operation";
+        }
+    }
+
+    if (!error && (in_done != in_size || in_crc != (unsigned long) get_le(header + 12, 4)))
+        error = "the input is not the file this delta was made for";
+    if (!error && (out_done != out_size || out_crc != (unsigned long) get_le(header + 24, 4)))
+        error = "the output is not what was expected";
+    if (fclose(out) && !error)
+        error = "failed to write the output";
+
+    if (error) {
+        fprintf(stderr, "%s: %s\n", argv[3], error);
+        remove(argv[3]);
+        return 1;
+    }
+
+    /* Keep the input's permissions, e.g. so that an executable stays executable */
+    chmod(argv[3], info.st_mode & 07777);
+    return 0;
+}